@@ -1,27 +1,70 @@
 import os
-from flask import Flask, json, request, abort, jsonify, redirect
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, g, json, request, abort, jsonify, redirect, Response, stream_with_context
+from sqlalchemy import text
 from flask_migrate import Migrate
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
 from models import CreateEntity
-from auth import requires_auth, AuthError
+from json_views import list_json, stream_json, envelope
+from pagination import page_args, paginate, paginate_sorted, sort_order
+from filtering import list_args, filter_query, check_sort
+from streaming import stream_list, orm_docs
+from fieldsets import fieldset_args, fieldset_query
+from serializers import serializer, FastJSONEncoder
+from bulk import (bulk_args, bulk_insert, cast_args, replace_cast,
+                  filter_args, query_filter_args, change_args, dry_run_arg,
+                  count_matching, bulk_delete, bulk_update)
+from http_cache import conditional, response_cache
+from entity_cache import entity_cache, entity_rows
+from change_feed import CHANGE_FEED, start_change_listener
+from db_pool import pool_stats
+from routing import RoutingSQLAlchemy, init_routing, read_from_replica
+from search import SEARCH_TYPES, search_args, search
+from payroll import (PAYROLL_REFRESH_SECONDS, payroll_args, payroll_report, refresh_payroll,
+                     start_payroll_refresher)
+from auth import requires_auth, AuthError, jwks_store, token_cache, JWKS_BACKGROUND_REFRESH
+from local_issuer import AUTH_LOCAL_ISSUER, install_local_issuer
 import sys
 
 
 def create_app(test_config=None):
     # create and configure the app
     app = Flask(__name__)
+    app.json_encoder = FastJSONEncoder
 
     # db setting
     app.config.from_object('config')
 
-    db = SQLAlchemy(app)
+    # reads may go to a replica (see routing.py)
+    db = RoutingSQLAlchemy(app)
     migrate = Migrate(app, db)
+    init_routing(app)
 
     # cors config
     CORS(app, resources={"*": {"origins": "*"}})
 
+    # offline token issuer for local testing and benchmarking
+    if AUTH_LOCAL_ISSUER:
+        install_local_issuer()
+
+    # keep auth0 public keys fresh off the request path
+    if JWKS_BACKGROUND_REFRESH:
+        jwks_store.start_refresher()
+
+    # keep the worker's caches coherent with writes from the other workers
+    # (started on the first request, once the db settings are final)
+    if CHANGE_FEED:
+        @app.before_first_request
+        def start_change_feed():
+            start_change_listener(db.engine)
+
+    # refresh the payroll rollup on a schedule, one worker at a time
+    # (see payroll.py)
+    if PAYROLL_REFRESH_SECONDS > 0:
+        @app.before_first_request
+        def start_payroll_refresh():
+            start_payroll_refresher(db.engine)
+
     @app.after_request
     def after_request(response):
         response.headers.add('Access-Control-Allow-Headers',
@@ -35,6 +78,135 @@ def create_app(test_config=None):
     # get models
     Movie, Actor, Director, MovieActor, db_object = CreateEntity(db)
 
+    # strong etag + if-none-match for the get endpoints (see http_cache.py)
+    # the json_agg path renders different bytes, so it gets its own etags
+    def conditional_get(view):
+        return conditional(db.session, view,
+                           lambda: 'agg' if app.config['JSON_AGG_READS'] else 'orm')
+
+    # shared by the by-id endpoints: serialized entity, read through the
+    # entity cache (see entity_cache.py), None when there is no such row
+    def entity_response(model, entity_id, fields, expand):
+        key = (model.__tablename__, entity_id, fields, expand)
+        doc = entity_cache.get(key)
+        if doc is None:
+            generation = entity_cache.generation()
+            entity = (fieldset_query(model, fields, expand)
+                      .filter(model.id == entity_id)
+                      .one_or_none())
+            if entity is None:
+                return None
+            doc = entity.json_format(fields, expand)
+            # replica rows may predate the last eviction (see routing.py)
+            if not read_from_replica():
+                entity_cache.put(key, doc, entity_rows(entity, expand), generation)
+        return doc
+
+    # shared by the list endpoints: full list, one keyset page when the
+    # client sends limit / after, or a chunked full dump with stream=true.
+    # fields / expand pick columns and relationships (see fieldsets.py)
+    def list_response(view, model):
+        filters, sort = list_args(view, model, request.args)
+        check_sort(db.session, model, sort, app.config['SORT_GUARD_ROWS'])
+        page = page_args(request.args,
+                         app.config['DEFAULT_PAGE_SIZE'],
+                         app.config['MAX_PAGE_SIZE'],
+                         model, sort)
+        fields, expand = fieldset_args(request.args, model)
+        # the sort column makes the cursor, load it even when not picked
+        loaded = fields
+        if fields is not None and sort is not None and sort.column not in fields:
+            loaded = fields + (sort.column,)
+        query = filter_query(fieldset_query(model, loaded, expand), model, filters)
+        serialize = serializer(model, fields, expand)
+
+        if request.args.get('stream', 'false').lower() == 'true':
+            if page is not None:
+                raise BadRequest
+            return stream_response(view, model, query, serialize, fields, filters, sort)
+
+        # single-query read path, postgres builds the full json documents
+        # (sparse requests take the orm path, they are cheap already)
+        if app.config['JSON_AGG_READS'] and fields is None:
+            docs, next_cursor = list_json(db.session, view, page, filters, sort)
+            body = envelope(view, docs, page is not None, next_cursor)
+            return Response(body, mimetype=app.config['JSONIFY_MIMETYPE'])
+
+        if page is None:
+            if sort is not None:
+                query = query.order_by(*sort_order(model, sort))
+            return jsonify({
+                'success': True,
+                view: [serialize(row) for row in query.all()]
+            })
+
+        if sort is None:
+            rows, next_cursor = paginate(query, model.id, *page)
+        else:
+            rows, next_cursor = paginate_sorted(query, model, sort, *page)
+        return jsonify({
+            'success': True,
+            view: [serialize(row) for row in rows],
+            'next_cursor': next_cursor
+        })
+
+    def stream_response(view, model, query, serialize, fields, filters, sort):
+        batch_size = app.config['STREAM_BATCH_SIZE']
+        if app.config['JSON_AGG_READS'] and fields is None:
+            docs = stream_json(db.session, view, batch_size, filters, sort)
+        else:
+            docs = orm_docs(query, sort_order(model, sort), batch_size,
+                            lambda row: json.dumps(serialize(row)))
+
+        return Response(stream_with_context(stream_list(view, docs, batch_size)),
+                        mimetype=app.config['JSONIFY_MIMETYPE'])
+
+    # shared by the post endpoints when the body is a json array:
+    # one transaction, new ids in item order (see bulk.py)
+    def bulk_create_response(model, key, items):
+        if len(items) > app.config['MAX_BULK_ITEMS']:
+            raise BadRequest
+        ids, errors = bulk_insert(db.session, model, items,
+                                  bulk_args(request.args),
+                                  app.config['BULK_INSERT_BATCH_SIZE'])
+        response = {'success': True, key: ids}
+        if errors:
+            response['errors'] = errors
+        return jsonify(response)
+
+    # shared by DELETE on the collections: ?ids=1,2,3 or column filters,
+    # one capped statement (see bulk.py), ?dry_run=true only counts
+    def bulk_delete_response(model, key):
+        filters = query_filter_args(model, request.args)
+        if dry_run_arg(request.args):
+            return jsonify({
+                'success': True,
+                'dry_run': True,
+                'count': count_matching(db.session, model, filters)
+            })
+
+        ids = [row['id'] for row in bulk_delete(db.session, model, filters,
+                                                app.config['MAX_AFFECTED_ROWS'])]
+        return jsonify({'success': True, key: ids, 'count': len(ids)})
+
+    # shared by PATCH on the collections: {"filter": {...}, "changes": {...}}
+    def bulk_update_response(model, key):
+        body = request.get_json()
+        if not isinstance(body, dict):
+            raise BadRequest
+        filters = filter_args(model, body.get('filter'))
+        changes = change_args(model, body.get('changes'))
+        if dry_run_arg(request.args):
+            return jsonify({
+                'success': True,
+                'dry_run': True,
+                'count': count_matching(db.session, model, filters)
+            })
+
+        ids = [row['id'] for row in bulk_update(db.session, model, filters, changes,
+                                                app.config['MAX_AFFECTED_ROWS'])]
+        return jsonify({'success': True, key: ids, 'count': len(ids)})
+
     # welcome page
     @app.route('/')
     def welcome():
@@ -49,15 +221,13 @@ def create_app(test_config=None):
     # region: movie endpoint
     @app.route('/movies')
     @requires_auth('get:movies')
+    @conditional_get('movies')
     def get_movies(jwt):
         try:
-            movies = [m.json_format() for m in Movie.query.all()]
-            
-            return jsonify({
-                'success': True,
-                'movies': movies
-            })
+            return list_response('movies', Movie)
 
+        except BadRequest:
+            abort(400)
         except AuthError:
             abort(403)
         except:
@@ -67,18 +237,18 @@ def create_app(test_config=None):
 
     @app.route('/movies/<int:movie_id>')
     @requires_auth('get:movies')
+    @conditional_get('movies')
     def get_movie_by_id(jwt,movie_id):
         try:
-            movie = (Movie.query
-                     .filter(Movie.id == movie_id)
-                     .one_or_none())
+            fields, expand = fieldset_args(request.args, Movie)
+            movie = entity_response(Movie, movie_id, fields, expand)
 
             if movie is None:
                 raise BadRequest
 
             return jsonify({
                 'success': True,
-                'movie': movie.json_format()
+                'movie': movie
             })
 
         except BadRequest:
@@ -95,6 +265,8 @@ def create_app(test_config=None):
     def add_movie(jwt):
         try:
             body = request.get_json()
+            if isinstance(body, list):
+                return bulk_create_response(Movie, 'new_movies', body)
 
             insert_movie = Movie(
                 title=body.get('title', None),
@@ -145,18 +317,39 @@ def create_app(test_config=None):
             print(error_msg)
             abort(400)
     
+    # partial update, one UPDATE ... RETURNING (no load first)
+    @app.route('/movies/<int:movie_id>', methods=['PATCH'])
+    @requires_auth('put:movies')
+    def patch_movie(jwt, movie_id):
+        try:
+            changes = change_args(Movie, request.get_json())
+            updated = bulk_update(db.session, Movie, {'id': movie_id}, changes, 1)
+
+            if not updated:
+                raise BadRequest
+
+            return jsonify({
+                'success': True,
+                'updated_movie': updated[0]
+            })
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
     @app.route('/movies/<int:movie_id>', methods=['DELETE'])
     @requires_auth('delete:movies')
     def delete_movie(jwt,movie_id):
         try:
-            movie = (Movie.query
-                     .filter(Movie.id == movie_id)
-                     .one_or_none())
-            
-            if movie is None:
+            # one DELETE ... RETURNING, the database cascades to movie_actor
+            deleted = bulk_delete(db.session, Movie, {'id': movie_id}, 1)
+
+            if not deleted:
                 raise BadRequest
-            
-            movie.delete()
 
             return jsonify({
                 'success': True,
@@ -170,19 +363,73 @@ def create_app(test_config=None):
             err_msg = sys.exc_info()
             print(err_msg)
             abort(422)
+
+    # replace the whole cast of a movie with the posted list
+    @app.route('/movies/<int:movie_id>/cast', methods=['PUT'])
+    @requires_auth('put:movieactors')
+    def replace_movie_cast(jwt, movie_id):
+        try:
+            cast = cast_args(request.get_json())
+            result = replace_cast(db.session, movie_id, cast)
+
+            if result is None:
+                raise BadRequest
+
+            cast_rows, counts = result
+            return jsonify({
+                'success': True,
+                'movie': movie_id,
+                'cast': cast_rows,
+                **counts
+            })
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/movies', methods=['PATCH'])
+    @requires_auth('put:movies')
+    def update_movies(jwt):
+        try:
+            return bulk_update_response(Movie, 'updated_movies')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    def delete_movies(jwt):
+        try:
+            return bulk_delete_response(Movie, 'deleted_movies')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
     # endregion
 
     # region: actor endpoints
     @app.route('/actors')
     @requires_auth('get:actors')
+    @conditional_get('actors')
     def get_actors(jwt):
         try:
-            actors = [a.json_format() for a in Actor.query.all()]
+            return list_response('actors', Actor)
 
-            return jsonify({
-                'success': True,
-                'actors': actors
-            })
+        except BadRequest:
+            abort(400)
         except AuthError:
             abort(403)
         except:
@@ -192,18 +439,18 @@ def create_app(test_config=None):
     
     @app.route('/actors/<int:actor_id>')
     @requires_auth('get:actors')
+    @conditional_get('actors')
     def get_actor_by_id(jwt, actor_id):
         try:
-            actor = (Actor.query
-                     .filter(Actor.id == actor_id)
-                     .one_or_none())
+            fields, expand = fieldset_args(request.args, Actor)
+            actor = entity_response(Actor, actor_id, fields, expand)
             
             if actor is None:
                 raise BadRequest
             
             return jsonify({
                 'success': True,
-                'actor': actor.json_format()
+                'actor': actor
             })
         
         except BadRequest:
@@ -220,6 +467,8 @@ def create_app(test_config=None):
     def add_actor(jwt):
         try:
             body = request.get_json()
+            if isinstance(body, list):
+                return bulk_create_response(Actor, 'new_actors', body)
             new_actor = Actor(
                 name = body.get('name', None),
                 age = body.get('age', None),
@@ -271,18 +520,39 @@ def create_app(test_config=None):
             print(err_msg)
             abort(400)
 
+    # partial update, one UPDATE ... RETURNING (no load first)
+    @app.route('/actors/<int:actor_id>', methods=['PATCH'])
+    @requires_auth('put:actors')
+    def patch_actor(jwt, actor_id):
+        try:
+            changes = change_args(Actor, request.get_json())
+            updated = bulk_update(db.session, Actor, {'id': actor_id}, changes, 1)
+
+            if not updated:
+                raise BadRequest
+
+            return jsonify({
+                'success': True,
+                'updated_actor': updated[0]
+            })
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
     @app.route('/actors/<int:actor_id>', methods=['DELETE'])
     @requires_auth('delete:actors')
     def delete_actor(jwt, actor_id):
         try:
-            actor = (Actor.query
-                     .filter(Actor.id == actor_id)
-                     .one_or_none())
-            
-            if actor is None:
+            # one DELETE ... RETURNING, the database cascades to movie_actor
+            deleted = bulk_delete(db.session, Actor, {'id': actor_id}, 1)
+
+            if not deleted:
                 raise BadRequest
-            
-            actor.delete()
 
             return jsonify({
                 'success': True,
@@ -296,19 +566,46 @@ def create_app(test_config=None):
             err_msg = sys.exc_info()
             print(err_msg)
             abort(422)
+
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth('put:actors')
+    def update_actors(jwt):
+        try:
+            return bulk_update_response(Actor, 'updated_actors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    def delete_actors(jwt):
+        try:
+            return bulk_delete_response(Actor, 'deleted_actors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
     # endregion
 
     # region: director endpoints
     @app.route('/directors')
     @requires_auth('get:directors')
+    @conditional_get('directors')
     def get_directors(jwt):
         try:
-            directors = [d.json_format() for d in Director.query.all()]
+            return list_response('directors', Director)
 
-            return jsonify({
-                'success': True,
-                'directors': directors
-            })
+        except BadRequest:
+            abort(400)
         except AuthError:
             abort(403)
         except:
@@ -318,18 +615,18 @@ def create_app(test_config=None):
 
     @app.route('/directors/<int:director_id>')
     @requires_auth('get:directors')
+    @conditional_get('directors')
     def get_director_by_id(jwt, director_id):
         try:
-            director = (Director.query
-                        .filter(Director.id == director_id)
-                        .one_or_none())
+            fields, expand = fieldset_args(request.args, Director)
+            director = entity_response(Director, director_id, fields, expand)
             
             if director is None:
                 raise BadRequest
             
             return jsonify({
                 'success': True,
-                'director': director.json_format()
+                'director': director
             })
         except BadRequest:
             abort(400)
@@ -345,6 +642,8 @@ def create_app(test_config=None):
     def add_director(jwt):
         try:
             body = request.get_json()
+            if isinstance(body, list):
+                return bulk_create_response(Director, 'new_directors', body)
 
             insert_director = Director(
                 name = body.get('name', None),
@@ -396,18 +695,39 @@ def create_app(test_config=None):
             print(err_msg)
             abort(400)
 
+    # partial update, one UPDATE ... RETURNING (no load first)
+    @app.route('/directors/<int:director_id>', methods=['PATCH'])
+    @requires_auth('put:directors')
+    def patch_director(jwt, director_id):
+        try:
+            changes = change_args(Director, request.get_json())
+            updated = bulk_update(db.session, Director, {'id': director_id}, changes, 1)
+
+            if not updated:
+                raise BadRequest
+
+            return jsonify({
+                'success': True,
+                'updated_director': updated[0]
+            })
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
     @app.route('/directors/<int:director_id>', methods=['DELETE'])
     @requires_auth('delete:directors')
     def delete_director(jwt, director_id):
         try:
-            director = (Director.query
-                     .filter(Director.id == director_id)
-                     .one_or_none())
-            
-            if director is None:
+            # one DELETE ... RETURNING, no load first
+            deleted = bulk_delete(db.session, Director, {'id': director_id}, 1)
+
+            if not deleted:
                 raise BadRequest
-            
-            director.delete()
 
             return jsonify({
                 'success': True,
@@ -421,20 +741,46 @@ def create_app(test_config=None):
             err_msg = sys.exc_info()
             print(err_msg)
             abort(422)
+
+    @app.route('/directors', methods=['PATCH'])
+    @requires_auth('put:directors')
+    def update_directors(jwt):
+        try:
+            return bulk_update_response(Director, 'updated_directors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/directors', methods=['DELETE'])
+    @requires_auth('delete:directors')
+    def delete_directors(jwt):
+        try:
+            return bulk_delete_response(Director, 'deleted_directors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
     # endregion
 
     # region: movie_actor endpoints
     @app.route('/movie_actors')
     @requires_auth('get:movieactors')
+    @conditional_get('movie_actors')
     def get_movie_actors(jwt):
         try:
-            ma = [ma.json_format() for ma in MovieActor.query.all()]
-            print(ma)
-            return jsonify({
-                'success': True,
-                'movie_actors': ma
-            })
+            return list_response('movie_actors', MovieActor)
 
+        except BadRequest:
+            abort(400)
         except AuthError:
             abort(403)
         except:
@@ -447,6 +793,8 @@ def create_app(test_config=None):
     def add_movie_actor(jwt):
         try:
             body = request.get_json()
+            if isinstance(body, list):
+                return bulk_create_response(MovieActor, 'new_movie_actors', body)
 
             insert_ma = MovieActor(
                 actor_id = body.get('actor_id', None),
@@ -479,8 +827,8 @@ def create_app(test_config=None):
             if ma is None:
                 raise BadRequest
             
-            ma.actor_id = body.get('actor_id', None),
-            ma.movie_id = body.get('movie_id', None),
+            ma.actor_id = body.get('actor_id', None)
+            ma.movie_id = body.get('movie_id', None)
             ma.actor_pay = body.get('actor_pay', None)
             ma.update()
 
@@ -497,18 +845,39 @@ def create_app(test_config=None):
             print(error_msg)
             abort(400)
     
+    # partial update, one UPDATE ... RETURNING (no load first)
+    @app.route('/movie_actors/<int:ma_id>', methods=['PATCH'])
+    @requires_auth('put:movieactors')
+    def patch_movie_actor(jwt, ma_id):
+        try:
+            changes = change_args(MovieActor, request.get_json())
+            updated = bulk_update(db.session, MovieActor, {'id': ma_id}, changes, 1)
+
+            if not updated:
+                raise BadRequest
+
+            return jsonify({
+                'success': True,
+                'updated_movie_actor': updated[0]
+            })
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
     @app.route('/movie_actors/<int:ma_id>', methods=['DELETE'])
     @requires_auth('delete:movieactors')
     def delete_movie_actor(jwt, ma_id):
         try:
-            ma = (MovieActor.query
-                     .filter(MovieActor.id == ma_id)
-                     .one_or_none())
+            # one DELETE ... RETURNING, no load first
+            deleted = bulk_delete(db.session, MovieActor, {'id': ma_id}, 1)
 
-            if ma is None:
+            if not deleted:
                 raise BadRequest
-            
-            ma.delete()
 
             return jsonify({
                 'success': True,
@@ -523,6 +892,157 @@ def create_app(test_config=None):
             print(err_msg)
             abort(422)
 
+
+    @app.route('/movie_actors', methods=['PATCH'])
+    @requires_auth('put:movieactors')
+    def update_movie_actors(jwt):
+        try:
+            return bulk_update_response(MovieActor, 'updated_movie_actors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/movie_actors', methods=['DELETE'])
+    @requires_auth('delete:movieactors')
+    def delete_movie_actors(jwt):
+        try:
+            return bulk_delete_response(MovieActor, 'deleted_movie_actors')
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+    # endregion
+
+    # region: search endpoint
+    # ranked full-text search over titles and names (see search.py). each
+    # kind searched needs its get: permission (checked by search_args), so
+    # the visible kinds are part of the etag and the response cache key
+    def search_types():
+        return ','.join(kind for kind, (_, _, permission) in SEARCH_TYPES.items()
+                        if permission in g.get('permissions', ()))
+
+    @app.route('/search')
+    @requires_auth(None)
+    @conditional(db.session, 'search', search_types)
+    def search_catalog(jwt):
+        try:
+            query, types, limit, after = search_args(request.args, jwt.get('permissions', []),
+                                                     app.config['DEFAULT_PAGE_SIZE'],
+                                                     app.config['MAX_PAGE_SIZE'])
+            hits, next_cursor, truncated = search(db.session, query, types, limit, after)
+            return jsonify({
+                'success': True,
+                'results': hits,
+                'next_cursor': next_cursor,
+                'truncated': truncated
+            })
+
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            error_msg = sys.exc_info()
+            print(error_msg)
+            abort(422)
+    # endregion
+
+    # region: stats endpoints
+    # connection pool usage of this worker, with the primary's connection
+    # count to size DB_POOL_SIZE / DB_MAX_OVERFLOW against max_connections,
+    # and the replica pools and routing counters when replicas are set up.
+    # also reports the worker's token, response and entity caches
+    @app.route('/stats/pool')
+    @requires_auth('get:stats')
+    def get_pool_stats(jwt):
+        try:
+            with db.engine.connect() as connection:
+                server = connection.execute(text(
+                    "SELECT current_setting('max_connections')::int AS max_connections, "
+                    "(SELECT count(*) FROM pg_stat_activity "
+                    "WHERE datname = current_database()) AS connections")).mappings().one()
+                # taken while this request still holds its connection
+                pool = pool_stats(db.engine, app.config['DB_MAX_OVERFLOW'])
+            router = app.extensions['replica_router']
+            return jsonify({
+                'success': True,
+                'pool': pool,
+                'server': dict(server),
+                'replicas': {bind: pool_stats(db.get_engine(app, bind=bind),
+                                              app.config['DB_MAX_OVERFLOW'])
+                             for bind in router.binds},
+                'routing': router.stats(),
+                'caches': {
+                    'token': token_cache.stats(),
+                    'response': response_cache.stats(),
+                    'entity': entity_cache.stats()
+                }
+            })
+
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    # payroll totals, averages and percentiles over all roles plus one page
+    # of movies, actors or directors (?by=), largest total first. read from
+    # the payroll_rollup materialized view, as of its refreshed_at
+    @app.route('/stats/payroll')
+    @requires_auth('get:stats')
+    def get_payroll_stats(jwt):
+        try:
+            by = payroll_args(request.args)
+            limit, after = page_args(request.args,
+                                     app.config['DEFAULT_PAGE_SIZE'],
+                                     app.config['MAX_PAGE_SIZE']) or (app.config['DEFAULT_PAGE_SIZE'], 0)
+            overall, groups, next_cursor = payroll_report(db.session, by, limit, after)
+            return jsonify({
+                'success': True,
+                'by': by,
+                'refreshed_at': overall.pop('refreshed_at'),
+                'age_seconds': overall.pop('age_seconds'),
+                'overall': overall,
+                'results': groups,
+                'next_cursor': next_cursor
+            })
+
+        except BadRequest:
+            abort(400)
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
+
+    @app.route('/stats/payroll/refresh', methods=['POST'])
+    @requires_auth('post:stats')
+    def refresh_payroll_stats(jwt):
+        try:
+            with db.engine.begin() as connection:
+                seconds = refresh_payroll(connection)
+            return jsonify({
+                'success': True,
+                'seconds': round(seconds, 3)
+            })
+
+        except AuthError:
+            abort(403)
+        except:
+            err_msg = sys.exc_info()
+            print(err_msg)
+            abort(422)
     # endregion
 
     # region: error_handlers
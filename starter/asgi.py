@@ -0,0 +1,312 @@
+# asgi entry point for the read endpoints
+# serves the GET routes of app.py on one event loop, with asyncpg for the
+# database. bodies are the json_agg documents of json_views.py (the shapes the
+# flask app returns), permissions and the verified-token cache are the ones
+# of auth.py and ETags follow http_cache.py. a request waiting on postgres or
+# on the identity provider holds no thread, so one process keeps thousands of
+# requests in flight while the pool caps the database connections.
+# writes, sparse fieldsets (fields / expand), filters and sort and the
+# in-process response caches stay on the flask app: route GET traffic here
+# and the rest there.
+# run from the starter folder: uvicorn asgi:app --port 8000
+import re
+import sys
+import json
+import asyncio
+from urllib.parse import parse_qsl
+
+import asyncpg
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import BadRequest
+from werkzeug.http import parse_etags, quote_etag
+
+import config
+from auth import (AuthError, token_cache, verify_decode_jwt, check_permissions,
+                  jwks_store, JWKS_BACKGROUND_REFRESH)
+from filtering import LIST_FILTERS
+from http_cache import VIEW_TABLES, etag_for
+from json_views import list_sql, entity_sql, stream_sql, envelope
+from local_issuer import AUTH_LOCAL_ISSUER, install_local_issuer
+from pagination import page_args
+from versions import VERSIONS_SQL
+
+# view -> (permission, response key of one entity, None when there is no
+# by-id GET endpoint)
+ROUTES = {
+    'movies': ('get:movies', 'movie'),
+    'actors': ('get:actors', 'actor'),
+    'directors': ('get:directors', 'director'),
+    'movie_actors': ('get:movieactors', None)
+}
+
+LIST_PATH = re.compile(r'^/(\w+)$')
+ENTITY_PATH = re.compile(r'^/(\w+)/(\d+)$')
+
+# etags differ from the flask app's, the bytes it renders differ too
+REPRESENTATION = 'asgi'
+
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'unprocessable entity',
+    500: 'internal server error'
+}
+
+# same as the flask app's after_request and CORS setup
+CORS_HEADERS = [
+    (b'access-control-allow-origin', b'*'),
+    (b'access-control-allow-headers', b'Content-Type, Authorization, true'),
+    (b'access-control-allow-methods', b'GET, POST, PUT, PATCH, DELETE, OPTIONS'),
+    (b'access-control-allow-credentials', b'true')
+]
+
+
+# NAMED (:name) BIND PARAMETERS TO ASYNCPG'S POSITIONAL $n
+# only the given names are replaced, so casts (::json) and string literals
+# are left alone
+def positional(sql, *names):
+    for n, name in enumerate(names, start=1):
+        sql = re.sub(rf'(?<!:):{name}\b', f'${n}', sql)
+    return sql
+
+
+SQL = {
+    'versions': positional(VERSIONS_SQL, 'tables'),
+    'list': {view: list_sql(view) for view in ROUTES},
+    'page': {view: positional(list_sql(view, paginated=True), 'limit', 'after')
+             for view in ROUTES},
+    'entity': {view: positional(entity_sql(view), 'id') for view in ROUTES},
+    'stream': {view: stream_sql(view) for view in ROUTES}
+}
+
+
+class Request:
+    def __init__(self, scope):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.query_string = scope['query_string'].decode('latin-1')
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        # what flask's request.full_path is, part of the etag
+        self.full_path = f'{self.path}?{self.query_string}'
+
+
+# 1. GET TOKEN FROM AUTH HEADER (same checks as auth.get_token_auth_header)
+def get_token_auth_header(request):
+    if 'authorization' not in request.headers:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Authorization not presented in header'
+        }, 401)
+
+    header_parts = request.headers['authorization'].split(' ')
+    if len(header_parts) < 2 or header_parts[0].lower() != 'bearer':
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Header malformed'
+        }, 401)
+
+    return header_parts[1]
+
+
+# 2. VERIFY AND CHECK THE PERMISSION
+# cached tokens are checked on the loop; a new token is verified on the
+# default executor, since a cold or rotated key set makes jwks_store fetch
+# from the identity provider
+async def requires_auth(request, permission):
+    token = get_token_auth_header(request)
+    payload = token_cache.get(token)
+    if payload is None:
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, verify_decode_jwt, token)
+        token_cache.put(token, payload)
+    check_permissions(permission, payload)
+    return payload
+
+
+class ReadApp:
+    def __init__(self, dsn=config.DB_PATH):
+        self.dsn = dsn
+        self.pool = None
+
+    async def startup(self):
+        if AUTH_LOCAL_ISSUER:
+            install_local_issuer()
+        if JWKS_BACKGROUND_REFRESH:
+            jwks_store.start_refresher()
+
+        # same limits as the flask app's pool (see config.py)
+        max_size = config.DB_POOL_SIZE + max(config.DB_MAX_OVERFLOW, 0)
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=min(config.DB_POOL_SIZE, max_size),
+            max_size=max_size,
+            max_inactive_connection_lifetime=config.DB_POOL_RECYCLE,
+            timeout=config.DB_CONNECT_TIMEOUT,
+            server_settings=({'statement_timeout': str(config.DB_STATEMENT_TIMEOUT)}
+                             if config.DB_STATEMENT_TIMEOUT > 0 else None))
+
+    async def shutdown(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(Request(scope), send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as e:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # ROUTING, WITH THE STATUS CODES OF THE FLASK HANDLERS
+    async def handle(self, request, send):
+        match = LIST_PATH.match(request.path) or ENTITY_PATH.match(request.path)
+        if match is None or match.group(1) not in ROUTES:
+            return await error(send, 404)
+        view = match.group(1)
+        permission, key = ROUTES[view]
+        entity_id = int(match.group(2)) if match.re is ENTITY_PATH else None
+        if entity_id is not None and key is None:
+            return await error(send, 404)
+        if request.method == 'OPTIONS':
+            return await preflight(send)
+        if request.method != 'GET':
+            return await error(send, 405)
+
+        try:
+            await requires_auth(request, permission)
+            if 'fields' in request.args or 'expand' in request.args:
+                raise BadRequest
+            if entity_id is None and ('sort' in request.args or
+                                      any(name in request.args for name in LIST_FILTERS[view])):
+                raise BadRequest
+            async with self.pool.acquire() as connection:
+                etag = await view_etag(connection, view, request)
+                if parse_etags(request.headers.get('if-none-match')).contains_weak(etag):
+                    return await respond(send, 304, headers=etag_header(etag))
+                if entity_id is not None:
+                    body = await entity_body(connection, view, key, entity_id)
+                    return await respond(send, 200, body, etag_header(etag))
+                if request.args.get('stream', 'false').lower() == 'true':
+                    if 'limit' in request.args or 'after' in request.args:
+                        raise BadRequest
+                    return await stream_body(connection, send, view, etag)
+                body = await list_body(connection, view, request.args)
+                return await respond(send, 200, body, etag_header(etag))
+
+        except BadRequest:
+            await error(send, 400)
+        except AuthError as e:
+            await error(send, e.status_code, e.error['description'])
+        except:
+            print(sys.exc_info())
+            await error(send, 500 if entity_id is not None else 404)
+
+
+app = ReadApp()
+
+
+async def view_etag(connection, view, request):
+    tables = VIEW_TABLES[view]
+    versions = dict(await connection.fetch(SQL['versions'], list(tables)))
+    return etag_for(request.full_path, REPRESENTATION,
+                    tuple(versions.get(table, 0) for table in tables))
+
+
+async def list_body(connection, view, args):
+    page = page_args(args, config.DEFAULT_PAGE_SIZE, config.MAX_PAGE_SIZE)
+    if page is None:
+        docs = await connection.fetchval(SQL['list'][view])
+        return envelope(view, docs)
+
+    docs, last_id, has_more = await connection.fetchrow(SQL['page'][view], *page)
+    return envelope(view, docs, True, str(last_id) if has_more else None)
+
+
+async def entity_body(connection, view, key, entity_id):
+    doc = await connection.fetchval(SQL['entity'][view], entity_id)
+    if doc is None:
+        raise BadRequest
+    return envelope(key, doc)
+
+
+# chunked full dump, one message per STREAM_BATCH_SIZE documents
+# (see streaming.py for the same body on the flask app)
+async def stream_body(connection, send, view, etag):
+    batch_size = config.STREAM_BATCH_SIZE
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': json_headers(etag_header(etag))})
+    await send_chunk(send, f'{{"{view}":[')
+
+    separator = ''
+    batch = []
+    try:
+        async with connection.transaction():
+            async for record in connection.cursor(SQL['stream'][view],
+                                                  prefetch=batch_size):
+                batch.append(record[0])
+                if len(batch) >= batch_size:
+                    await send_chunk(send, separator + ','.join(batch))
+                    separator = ','
+                    batch = []
+    except Exception:
+        # the status line is out, an error can only cut the body short
+        print(sys.exc_info())
+        return await send_chunk(send, '', more_body=False)
+    if batch:
+        await send_chunk(send, separator + ','.join(batch))
+
+    await send_chunk(send, '],"success":true}\n', more_body=False)
+
+
+def etag_header(etag):
+    return [(b'etag', quote_etag(etag).encode('latin-1'))]
+
+
+def json_headers(headers=()):
+    return [(b'content-type', b'application/json'), *CORS_HEADERS, *headers]
+
+
+async def send_chunk(send, text, more_body=True):
+    await send({'type': 'http.response.body', 'body': text.encode('utf-8'),
+                'more_body': more_body})
+
+
+async def respond(send, status, body='', headers=()):
+    data = body.encode('utf-8')
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': json_headers([*headers,
+                                         (b'content-length', str(len(data)).encode('latin-1'))])})
+    await send({'type': 'http.response.body', 'body': data})
+
+
+# CORS PREFLIGHT, ANSWERED WITHOUT A TOKEN LIKE THE FLASK APP'S
+async def preflight(send):
+    await send({'type': 'http.response.start', 'status': 204,
+                'headers': [*CORS_HEADERS, (b'allow', b'GET, OPTIONS')]})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def error(send, status, message=None):
+    body = json.dumps({
+        'success': False,
+        'error': status,
+        'message': message or ERROR_MESSAGES[status]
+    })
+    await respond(send, status, body + '\n')
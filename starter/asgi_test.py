@@ -0,0 +1,178 @@
+import json
+import asyncio
+import unittest
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+
+from app import create_app
+from asgi import ReadApp
+from auth import jwks_store
+from config import DB_PATH_TEST
+from local_issuer import LocalIssuer
+from models import CreateEntity
+
+# installed per test and swapped back after it, endpoint_test.py mints its
+# tokens with its own issuer
+issuer = LocalIssuer()
+CLIENT_TOKEN = issuer.bearer('client')
+
+
+# drive the asgi app without a server: one http request, the response
+# status, headers and body collected from the sent messages
+async def asgi_get(app, path, token=CLIENT_TOKEN, headers=(), method='GET'):
+    path, _, query_string = path.partition('?')
+    raw_headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                   for name, value in headers]
+    if token is not None:
+        raw_headers.append((b'authorization', token.encode('latin-1')))
+    scope = {'type': 'http', 'method': method, 'path': path,
+             'query_string': query_string.encode('latin-1'), 'headers': raw_headers}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    await app(scope, receive, send)
+    start = messages[0]
+    body = b''.join(m.get('body', b'') for m in messages[1:])
+    return start['status'], {k.decode(): v.decode() for k, v in start['headers']}, body
+
+
+class ASGIReadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.previous_source = jwks_store._source
+        issuer.install()
+        self.flask_app = create_app()[0]
+        self.flask_app.config['SQLALCHEMY_DATABASE_URI'] = DB_PATH_TEST
+        self.flask_app.config['JSON_AGG_READS'] = True
+        with self.flask_app.app_context():
+            db = SQLAlchemy()
+            CreateEntity(db)
+            db.init_app(self.flask_app)
+            db.create_all()
+            # one movie with a cast, so every document has nested rows
+            director_id = db.session.execute(text(
+                "INSERT INTO director (name, age, gender) VALUES ('asgi_director', 40, 'female') "
+                "RETURNING id")).scalar()
+            movie_id = db.session.execute(text(
+                "INSERT INTO movie (title, release_date, director_id) "
+                "VALUES ('asgi_movie', '2021-09-21', :director_id) RETURNING id"),
+                {'director_id': director_id}).scalar()
+            actor_id = db.session.execute(text(
+                "INSERT INTO actor (name, age, gender) VALUES ('asgi_actor', 30, 'male') "
+                "RETURNING id")).scalar()
+            db.session.execute(text(
+                "INSERT INTO movie_actor (movie_id, actor_id, actor_pay) VALUES (:m, :a, 1000)"),
+                {'m': movie_id, 'a': actor_id})
+            db.session.commit()
+        self.ids = {'movies': movie_id, 'actors': actor_id, 'directors': director_id}
+
+    def tearDown(self):
+        if self.previous_source is not None:
+            jwks_store.use_source(self.previous_source)
+
+    def flask_get(self, path):
+        res = self.flask_app.test_client().get(path, headers={'Authorization': CLIENT_TOKEN})
+        return json.loads(res.data)
+
+    def run_app(self, requests):
+        async def run():
+            app = ReadApp(DB_PATH_TEST)
+            await app.startup()
+            try:
+                return await requests(app)
+            finally:
+                await app.shutdown()
+        return asyncio.run(run())
+
+    def test_same_documents_as_flask(self):
+        paths = ['/movies', '/actors', '/directors', '/movie_actors', '/movies?limit=1',
+                 *(f'/{view}/{entity_id}' for view, entity_id in self.ids.items())]
+        responses = self.run_app(lambda app: asyncio.gather(*(asgi_get(app, p) for p in paths)))
+
+        # assertion
+        for path, (status, headers, body) in zip(paths, responses):
+            self.assertEqual(status, 200, path)
+            self.assertEqual(headers['content-type'], 'application/json')
+            self.assertEqual(json.loads(body), self.flask_get(path), path)
+
+    def test_stream_matches_full_list(self):
+        async def requests(app):
+            return (await asgi_get(app, '/actors?stream=true'),
+                    await asgi_get(app, '/actors'))
+        (status, _, streamed), (_, _, full) = self.run_app(requests)
+
+        # assertion
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(streamed), json.loads(full))
+
+    def test_conditional_get(self):
+        async def requests(app):
+            status, headers, _ = await asgi_get(app, '/directors')
+            return headers['etag'], await asgi_get(app, '/directors',
+                                                   headers=[('If-None-Match', headers['etag'])])
+        etag, (status, headers, body) = self.run_app(requests)
+
+        # assertion
+        self.assertEqual(status, 304)
+        self.assertEqual(headers['etag'], etag)
+        self.assertEqual(body, b'')
+
+    def test_permissions_and_errors(self):
+        async def requests(app):
+            return [await asgi_get(app, '/movies', token=None),
+                    await asgi_get(app, '/movies', token=issuer.bearer(permissions=['get:actors'])),
+                    await asgi_get(app, '/movies/0'),
+                    await asgi_get(app, '/movies?fields=id'),
+                    await asgi_get(app, '/movies?sort=-release_date'),
+                    await asgi_get(app, '/movie_actors/1'),
+                    await asgi_get(app, '/wrong_url')]
+        responses = self.run_app(requests)
+
+        # assertion
+        self.assertEqual([status for status, _, _ in responses], [401, 403, 400, 400, 400, 404, 404])
+        self.assertEqual(json.loads(responses[1][2]),
+                         {'success': False, 'error': 403,
+                          'message': 'Request permission is not authorized'})
+
+    def test_cors_preflight(self):
+        async def requests(app):
+            return [await asgi_get(app, '/movies', token=None, method='OPTIONS',
+                                   headers=[('Origin', 'http://localhost:3000'),
+                                            ('Access-Control-Request-Method', 'GET')]),
+                    await asgi_get(app, '/movies/1', token=None, method='OPTIONS'),
+                    await asgi_get(app, '/movies', method='POST')]
+        responses = self.run_app(requests)
+        flask_headers = self.flask_app.test_client().options('/movies').headers
+
+        # assertion
+        self.assertEqual([status for status, _, _ in responses], [204, 204, 405])
+        status, headers, body = responses[0]
+        self.assertEqual(body, b'')
+        for name in ('Access-Control-Allow-Origin', 'Access-Control-Allow-Headers',
+                     'Access-Control-Allow-Methods', 'Access-Control-Allow-Credentials'):
+            self.assertEqual(headers[name.lower()], flask_headers[name])
+
+    def test_many_requests_in_flight_on_a_small_pool(self):
+        async def requests(app):
+            # hold every pooled connection, then queue far more requests
+            connections = [await app.pool.acquire() for _ in range(app.pool.get_max_size())]
+            pending = [asyncio.ensure_future(asgi_get(app, '/directors')) for _ in range(500)]
+            await asyncio.sleep(0.2)
+            waiting = sum(not p.done() for p in pending)
+            for connection in connections:
+                await app.pool.release(connection)
+            return waiting, await asyncio.gather(*pending)
+        waiting, responses = self.run_app(requests)
+
+        # assertion
+        self.assertEqual(waiting, 500)
+        self.assertEqual({status for status, _, _ in responses}, {200})
+        self.assertEqual(len({headers['etag'] for _, headers, _ in responses}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
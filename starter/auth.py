@@ -1,20 +1,71 @@
-import json
-from flask import request
+import os
+import time
+import hashlib
+from flask import g, request
 from jose import jwt
-from urllib.request import urlopen
 from functools import wraps
+from jwks import JWKSStore, JWKSUnavailable
+from lru_cache import LRUCache
 
 # AUTH DOMAIN AND API AUDIENCE SETUP
 AUTH0_DOMAIN = 'fsndantony.us.auth0.com'
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'udacitycapstone'
 
+# JWKS CACHE SETUP (seconds)
+JWKS_URL = os.getenv('JWKS_URL', f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
+JWKS_CACHE_TTL = int(os.getenv('JWKS_CACHE_TTL', 600))
+JWKS_MIN_REFRESH_INTERVAL = int(os.getenv('JWKS_MIN_REFRESH_INTERVAL', 30))
+JWKS_FETCH_TIMEOUT = float(os.getenv('JWKS_FETCH_TIMEOUT', 5))
+JWKS_FAILURE_THRESHOLD = int(os.getenv('JWKS_FAILURE_THRESHOLD', 3))
+JWKS_BREAKER_COOLDOWN = int(os.getenv('JWKS_BREAKER_COOLDOWN', 60))
+JWKS_BACKGROUND_REFRESH = os.getenv('JWKS_BACKGROUND_REFRESH', 'true').lower() == 'true'
+
+# VERIFIED TOKEN CACHE SETUP (entries, seconds)
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 1024))
+TOKEN_CACHE_MAX_TTL = int(os.getenv('TOKEN_CACHE_MAX_TTL', 300))
+
+jwks_store = JWKSStore(JWKS_URL,
+                       ttl=JWKS_CACHE_TTL,
+                       min_refresh_interval=JWKS_MIN_REFRESH_INTERVAL,
+                       fetch_timeout=JWKS_FETCH_TIMEOUT,
+                       failure_threshold=JWKS_FAILURE_THRESHOLD,
+                       breaker_cooldown=JWKS_BREAKER_COOLDOWN)
+
 # AUTH ERROR CUSTOM EXCEPTION
 class AuthError(Exception):
     def __init__(self, error, status_code):
         self.error = error
         self.status_code = status_code
 
+# VERIFIED TOKEN CACHE
+# bounded LRU of decoded payloads keyed by the sha256 digest of the raw token,
+# so clients reusing one bearer token skip the RS256 check on repeat calls.
+# an entry never outlives the token's exp claim (nor max_ttl)
+class TokenCache:
+    def __init__(self, maxsize=1024, max_ttl=300):
+        self.max_ttl = max_ttl
+        self._cache = LRUCache(maxsize, max_ttl, clock=time.time)
+
+    @staticmethod
+    def digest(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        return self._cache.get(self.digest(token))
+
+    def put(self, token, payload):
+        self._cache.put(self.digest(token), payload, payload.get('exp'))
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+token_cache = TokenCache(maxsize=TOKEN_CACHE_SIZE, max_ttl=TOKEN_CACHE_MAX_TTL)
+
 # 1. GET TOKEN FROM AUTH HEADER
 def get_token_auth_header():
     # CHECK AUTHORIZATION PRESENTED IN HEADERS
@@ -39,66 +90,59 @@ def get_token_auth_header():
 
 # 2. VERIFY JWT
 def verify_decode_jwt(token):
-    # GET PUBLIC KEY FROM AUTH0
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
-
     # GET DATA INSIDE HEADER
     unverified_token = jwt.get_unverified_header(token)
 
-    # CHOOSE THE KEY
-    rsa_key = {},
     if 'kid' not in unverified_token:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Authorization malformed'
         }, 401)
-    
-    for key in jwks['keys']:
-        if key['kid'] == unverified_token['kid']:
-            rsa_key = {
-                'kty': key['kty'],
-                'kid': key['kid'],
-                'use': key['use'],
-                'n': key['n'],
-                'e': key['e']
-            }
-        
-        if rsa_key:
-            try:
-                # USE THE KEY TO VERIFY JWT
-                payload = jwt.decode(
-                    token,
-                    rsa_key,
-                    algorithms=ALGORITHMS,
-                    audience=API_AUDIENCE,
-                    issuer=f'https://{AUTH0_DOMAIN}/'
-                )
-                return payload
-
-            except jwt.ExpiredSignatureError:
-                raise AuthError({
-                    'code': 'token_expired',
-                    'description': 'Token expired'
-                }, 401)
-            
-            except jwt.JWTClaimsError:
-                raise AuthError({
-                    'code': 'invalid_claims',
-                    'description': 'Incorrect claims. Please check the audience and issuer'
-                }, 401)
-            
-            except Exception:
-                raise AuthError({
-                    'code': 'invalid_header',
-                    'description': 'Unable to parse authentication token'
-                }, 400)
-        
+
+    # CHOOSE THE KEY (PUBLIC KEYS ARE CACHED, SEE jwks.py)
+    try:
+        rsa_key = jwks_store.get_key(unverified_token['kid'])
+    except JWKSUnavailable:
+        raise AuthError({
+            'code': 'jwks_unavailable',
+            'description': 'Unable to fetch public keys to verify the token'
+        }, 503)
+
+    if rsa_key is None:
         raise AuthError({
             'code': 'invalid_header',
             'description': 'Unable to find appropriate key.'
         }, 400)
 
+    try:
+        # USE THE KEY TO VERIFY JWT
+        payload = jwt.decode(
+            token,
+            rsa_key,
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer=f'https://{AUTH0_DOMAIN}/'
+        )
+        return payload
+
+    except jwt.ExpiredSignatureError:
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired'
+        }, 401)
+
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims. Please check the audience and issuer'
+        }, 401)
+
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token'
+        }, 400)
+
 # 3. CHECK PERMISSION USE PAYLOAD FROM TOKEN
 def check_permissions(permission, payload):
     # print(permission)
@@ -121,8 +165,19 @@ def requires_auth(permission=''):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = get_token_auth_header()
-            payload = verify_decode_jwt(token)
-            check_permissions(permission, payload)
+            payload = token_cache.get(token)
+            if payload is None:
+                payload = verify_decode_jwt(token)
+                token_cache.put(token, payload)
+            # None: any valid token, the view checks the permissions itself
+            if permission is not None:
+                check_permissions(permission, payload)
+            # part of the response cache key (see http_cache.py)
+            g.permission = permission
+            # keeps this caller's reads on the primary after a write (see routing.py)
+            g.subject = payload.get('sub')
+            # narrows what some views return (see search.py)
+            g.permissions = payload.get('permissions', [])
             return f(payload, *args, **kwargs)
         
         return wrapper
@@ -0,0 +1,233 @@
+import json
+import time
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+
+from jwks import JWKSStore, JWKSUnavailable
+from auth import TokenCache
+
+
+# key store that serves documents from memory instead of the identity provider
+class FakeJWKSStore(JWKSStore):
+    def __init__(self, documents, **kwargs):
+        super().__init__('http://jwks.invalid/.well-known/jwks.json', **kwargs)
+        self.documents = documents
+        self.fetch_count = 0
+
+    def fetch(self):
+        self.fetch_count += 1
+        return self.documents[min(self.fetch_count, len(self.documents)) - 1]
+
+
+def public_jwk(kid):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.public_key().public_bytes(
+        serialization.Encoding.PEM,
+        serialization.PublicFormat.SubjectPublicKeyInfo)
+    key = jwk.construct(pem, 'RS256').to_dict()
+    key.update({'kid': kid, 'use': 'sig'})
+    return key
+
+
+PUBLIC_JWKS = {kid: public_jwk(kid) for kid in ('a', 'b')}
+
+
+def jwks_document(*kids):
+    return {'keys': [PUBLIC_JWKS[kid] for kid in kids]}
+
+
+class JWKSStoreTestCase(unittest.TestCase):
+    def test_key_served_from_cache(self):
+        store = FakeJWKSStore([jwks_document('a')])
+        for _ in range(5):
+            self.assertIsNotNone(store.get_key('a'))
+
+        # assertion
+        self.assertEqual(store.fetch_count, 1)
+        self.assertEqual(store.stats()['hits'], 5)
+        self.assertEqual(store.stats()['refreshes'], 1)
+
+    def test_unknown_kid_triggers_refresh(self):
+        store = FakeJWKSStore([jwks_document('a'), jwks_document('a', 'b')],
+                              min_refresh_interval=0)
+        store.get_key('a')
+        key = store.get_key('b')
+
+        # assertion
+        self.assertIsNotNone(key)
+        self.assertEqual(store.fetch_count, 2)
+        self.assertEqual(store.stats()['misses'], 1)
+
+    def test_unknown_kid_refresh_is_rate_limited(self):
+        store = FakeJWKSStore([jwks_document('a')], min_refresh_interval=60)
+        store.get_key('a')
+        for _ in range(10):
+            self.assertIsNone(store.get_key('forged'))
+
+        # assertion
+        self.assertEqual(store.fetch_count, 1)
+        self.assertEqual(store.stats()['misses'], 10)
+
+    def test_empty_key_set_is_not_refetched_per_request(self):
+        # an issuer publishing no usable key is loaded, not a cold start
+        store = FakeJWKSStore([{'keys': [{'kid': 'enc', 'use': 'enc'}]}],
+                              min_refresh_interval=60)
+        for _ in range(10):
+            self.assertIsNone(store.get_key('a'))
+
+        # assertion
+        self.assertEqual(store.fetch_count, 1)
+        self.assertEqual(store.stats()['keys'], 0)
+        self.assertTrue(store.stats()['loaded'])
+
+    def test_keys_are_prebuilt_verifiers(self):
+        store = FakeJWKSStore([jwks_document('a')])
+
+        # assertion
+        self.assertIsInstance(store.get_key('a'), jwk.Key)
+        self.assertIs(store.get_key('a'), store.get_key('a'))
+
+    def test_expired_key_set_is_served_while_revalidating(self):
+        store = FakeJWKSStore([jwks_document('a')], ttl=0)
+        store.get_key('a')
+
+        # assertion: stale key is returned right away, refetch happens aside
+        self.assertIsNotNone(store.get_key('a'))
+        deadline = time.monotonic() + 2
+        while store.fetch_count < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(store.fetch_count, 2)
+
+
+# local stand-in for the idp's jwks.json endpoint
+class JWKSHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.requests += 1
+        time.sleep(self.server.delay)
+        if self.server.status != 200:
+            self.send_error(self.server.status)
+            return
+        body = json.dumps(self.server.document).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class JWKSRefresherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), JWKSHandler)
+        self.server.document = jwks_document('a')
+        self.server.delay = 0
+        self.server.status = 200
+        self.server.requests = 0
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = (f'http://127.0.0.1:{self.server.server_port}'
+                    '/.well-known/jwks.json')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def wait_for(self, condition, timeout=3):
+        deadline = time.monotonic() + timeout
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_refresher_keeps_key_set_fresh(self):
+        store = JWKSStore(self.url, ttl=0.2)
+        store.start_refresher()
+        try:
+            self.assertTrue(self.wait_for(lambda: store.refreshes >= 3))
+            # assertion: keys were loaded without any request asking for them
+            self.assertEqual(store.stats()['hits'], 0)
+            self.assertIsNotNone(store.get_key('a'))
+        finally:
+            store.stop_refresher()
+
+    def test_fetch_timeout_is_bounded(self):
+        self.server.delay = 1
+        store = JWKSStore(self.url, fetch_timeout=0.2)
+        started = time.monotonic()
+
+        # assertion
+        with self.assertRaises(JWKSUnavailable):
+            store.get_key('a')
+        self.assertLess(time.monotonic() - started, 0.9)
+
+    def test_cold_start_fetch_is_rate_limited(self):
+        self.server.status = 503
+        store = JWKSStore(self.url, min_refresh_interval=60, failure_threshold=2)
+        for _ in range(5):
+            with self.assertRaises(JWKSUnavailable):
+                store.get_key('a')
+
+        # assertion
+        self.assertEqual(self.server.requests, 1)
+        self.assertEqual(store.stats()['failures'], 1)
+        self.assertFalse(store.stats()['loaded'])
+
+    def test_stale_keys_served_while_idp_is_down(self):
+        store = JWKSStore(self.url, ttl=0.1, min_refresh_interval=0,
+                          failure_threshold=2, breaker_cooldown=60)
+        store.get_key('a')
+        self.server.status = 503
+        time.sleep(0.15)
+
+        # assertion: expired keys keep working, failures trip the breaker
+        self.assertIsNotNone(store.get_key('a'))
+        self.assertIsNone(store.get_key('unknown'))
+        self.assertTrue(self.wait_for(store.breaker_open))
+        requests = self.server.requests
+        self.assertIsNone(store.get_key('unknown'))
+        self.assertIsNotNone(store.get_key('a'))
+        self.assertEqual(self.server.requests, requests)
+        self.assertEqual(store.stats()['breaker_trips'], 1)
+
+
+class TokenCacheTestCase(unittest.TestCase):
+    def test_repeat_token_is_served_from_cache(self):
+        cache = TokenCache(maxsize=10)
+        payload = {'exp': time.time() + 60, 'permissions': ['get:movies']}
+        self.assertIsNone(cache.get('token'))
+        cache.put('token', payload)
+
+        # assertion
+        self.assertIs(cache.get('token'), payload)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['hit_rate'], 0.5)
+
+    def test_entry_evicted_at_token_expiry(self):
+        cache = TokenCache(maxsize=10)
+        cache.put('token', {'exp': time.time() - 1})
+
+        # assertion
+        self.assertIsNone(cache.get('token'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = TokenCache(maxsize=2)
+        exp = time.time() + 60
+        cache.put('a', {'exp': exp})
+        cache.put('b', {'exp': exp})
+        cache.get('a')
+        cache.put('c', {'exp': exp})
+
+        # assertion
+        self.assertIsNotNone(cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+# end-to-end request latency under real RS256 verification, fully offline
+# run from the starter folder: python -m benchmarks.api_requests
+import argparse
+import statistics
+import time
+
+from app import app
+from auth import token_cache
+from local_issuer import LocalIssuer
+
+DEFAULT_PATHS = ['/movies', '/actors', '/directors', '/movie_actors']
+
+
+def run(client, path, headers, requests, verify_every_call):
+    timings = []
+    for _ in range(requests):
+        if verify_every_call:
+            token_cache.clear()
+        started = time.perf_counter()
+        res = client.get(path, headers=headers)
+        timings.append((time.perf_counter() - started) * 1000)
+        if res.status_code != 200:
+            raise SystemExit(f'{path} returned {res.status_code}: {res.data}')
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*', default=DEFAULT_PATHS)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--role', default='producer')
+    parser.add_argument('--verify-every-call', action='store_true',
+                        help='clear the verified-token cache before each call')
+    args = parser.parse_args()
+
+    issuer = LocalIssuer()
+    issuer.install()
+    headers = {'Authorization': issuer.bearer(args.role)}
+    client = app.test_client()
+
+    print(f'{"path":<20}{"p50 ms":>10}{"p95 ms":>10}{"req/s":>10}')
+    for path in args.paths:
+        run(client, path, headers, 5, args.verify_every_call)
+        timings = sorted(run(client, path, headers, args.requests,
+                             args.verify_every_call))
+        p50 = statistics.median(timings)
+        p95 = timings[int(len(timings) * 0.95) - 1]
+        rps = len(timings) / (sum(timings) / 1000)
+        print(f'{path:<20}{p50:>10.2f}{p95:>10.2f}{rps:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# GET throughput of the flask app under gunicorn vs the asgi app (asgi.py)
+# under uvicorn, side by side at a growing number of concurrent clients.
+# both servers get the same database, local issuer key and json_agg bodies,
+# with the response cache off so every request reaches postgres.
+# run from the starter folder against a scratch database:
+#   DB_NAME=capstone_movie_test python -m benchmarks.asgi_throughput
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from local_issuer import LocalIssuer
+
+
+def server_commands(args):
+    return {
+        'flask (gunicorn)': [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+                             'app:app',
+                             '-w', str(args.workers), '--threads', str(args.threads),
+                             '-b', f'127.0.0.1:{args.port}', '--log-level', 'warning'],
+        'asgi (uvicorn)': [sys.executable, '-m', 'uvicorn', 'asgi:app',
+                           '--workers', str(args.workers), '--port', str(args.port + 1),
+                           '--log-level', 'warning', '--no-access-log']
+    }
+
+
+async def get(port, path, token):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write((f'GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+                  f'Authorization: {token}\r\nConnection: close\r\n\r\n').encode())
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def wait_until_up(port, token, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await get(port, '/directors?limit=1', token)
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise SystemExit(f'server on port {port} did not start')
+
+
+# CLOSED LOOP: concurrency clients, each sending its next request when the
+# previous one is answered, for the given number of seconds
+async def load(port, paths, token, concurrency, seconds):
+    timings = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def client(n):
+        nonlocal errors
+        i = n
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await get(port, paths[i % len(paths)], token)
+            except OSError:
+                status = None
+            if status == 200:
+                timings.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+            i += 1
+
+    await asyncio.gather(*(client(n) for n in range(concurrency)))
+    timings.sort()
+    return {
+        'rps': len(timings) / seconds,
+        'p50': statistics.median(timings) if timings else 0,
+        'p99': timings[int(len(timings) * 0.99) - 1] if timings else 0,
+        'errors': errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='*', default=['/directors?limit=20', '/movies?limit=20',
+                                                      '/actors?limit=20'])
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--port', type=int, default=8090)
+    args = parser.parse_args()
+
+    key_file = os.path.join(tempfile.mkdtemp(), 'issuer.pem')
+    token = LocalIssuer(key_file=key_file).bearer('client')
+    env = {**os.environ, 'AUTH_LOCAL_ISSUER': 'true', 'LOCAL_ISSUER_KEY_FILE': key_file,
+           'JSON_AGG_READS': 'true', 'RESPONSE_CACHE_SIZE': '0', 'ENTITY_CACHE_SIZE': '0',
+           'CHANGE_FEED': 'false', 'JWKS_BACKGROUND_REFRESH': 'false'}
+
+    results = {}
+    for offset, (name, command) in enumerate(server_commands(args).items()):
+        port = args.port + offset
+        server = subprocess.Popen(command, env=env)
+        try:
+            asyncio.run(wait_until_up(port, token))
+            for concurrency in args.concurrency:
+                results[name, concurrency] = asyncio.run(
+                    load(port, args.paths, token, concurrency, args.seconds))
+        finally:
+            server.terminate()
+            server.wait()
+
+    print(f'{"server":<20}{"clients":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for (name, concurrency), r in results.items():
+        print(f'{name:<20}{concurrency:>8}{r["rps"]:>10.0f}{r["p50"]:>10.1f}'
+              f'{r["p99"]:>10.1f}{r["errors"]:>8}')
+
+
+if __name__ == '__main__':
+    main()
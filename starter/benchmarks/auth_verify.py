@@ -0,0 +1,57 @@
+# micro-benchmark: per-request token verification cost
+# run from the starter folder: python -m benchmarks.auth_verify
+import timeit
+from jose import jwt
+
+from auth import ALGORITHMS, API_AUDIENCE, AUTH0_DOMAIN
+from jwks import JWKSStore
+from local_issuer import LocalIssuer, LOCAL_ISSUER_KID as KID
+
+ROUNDS = 2000
+
+
+def decode(token, key):
+    return jwt.decode(token, key, algorithms=ALGORITHMS,
+                      audience=API_AUDIENCE,
+                      issuer=f'https://{AUTH0_DOMAIN}/')
+
+
+def main():
+    issuer = LocalIssuer()
+    jwks, token = issuer.jwks(), issuer.mint('client')
+
+    # previous code path: rebuild the rsa_key dict, jose builds the key again
+    def dict_path():
+        for key in jwks['keys']:
+            if key['kid'] == KID:
+                rsa_key = {
+                    'kty': key['kty'],
+                    'kid': key['kid'],
+                    'use': key['use'],
+                    'n': key['n'],
+                    'e': key['e']
+                }
+        return decode(token, rsa_key)
+
+    # current code path: dict lookup of the pre-built verifier
+    store = JWKSStore('http://unused')
+    store.load(jwks)
+
+    def prebuilt_path():
+        return decode(token, store.get_key(KID))
+
+    results = {}
+    for name, fn in (('rsa_key dict', dict_path),
+                     ('pre-built key', prebuilt_path)):
+        fn()
+        seconds = min(timeit.repeat(fn, number=ROUNDS, repeat=3))
+        results[name] = seconds / ROUNDS * 1e6
+        print(f'{name:>15}: {results[name]:8.1f} us/verify')
+
+    saved = results['rsa_key dict'] - results['pre-built key']
+    print(f'{"saving":>15}: {saved:8.1f} us/verify '
+          f'({saved / results["rsa_key dict"]:.0%})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# catalog sync cost: one POST (and one commit) per actor vs one json array
+# run from the starter folder against a scratch database:
+#   DB_NAME=capstone_movie_test python -m benchmarks.bulk_insert
+import argparse
+import time
+
+from sqlalchemy import text
+
+from app import app, db
+from local_issuer import LocalIssuer
+
+
+def actors(count, prefix):
+    return [{'name': f'{prefix}_{i}', 'age': 30, 'gender': 'female'}
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=2000)
+    args = parser.parse_args()
+
+    issuer = LocalIssuer()
+    issuer.install()
+    headers = {'Authorization': issuer.bearer('producer')}
+    client = app.test_client()
+    created = []
+
+    started = time.perf_counter()
+    for item in actors(args.rows, 'bench_single'):
+        res = client.post('/actors', json=item, headers=headers)
+        created.append(res.get_json()['new_actor'])
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    res = client.post('/actors', json=actors(args.rows, 'bench_bulk'),
+                      headers=headers)
+    bulk = time.perf_counter() - started
+    if res.status_code != 200:
+        raise SystemExit(f'bulk insert returned {res.status_code}: {res.data}')
+    created += res.get_json()['new_actors']
+
+    with app.app_context():
+        db.session.execute(text('DELETE FROM actor WHERE id = ANY(:ids)'),
+                           {'ids': created})
+        db.session.commit()
+
+    print(f'{"mode":<12}{"rows":>8}{"seconds":>10}{"rows/s":>10}')
+    for mode, seconds in (('per row', single), ('json array', bulk)):
+        print(f'{mode:<12}{args.rows:>8}{seconds:>10.2f}'
+              f'{args.rows / seconds:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
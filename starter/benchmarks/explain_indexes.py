@@ -0,0 +1,45 @@
+# are the relationship queries behind every read planned on an index?
+# seeds a large catalog in one transaction, prints the plan of each hot query
+# (see query_plans.py) and rolls everything back. run from the starter folder
+# against a migrated scratch database:
+#   DB_NAME=capstone_movie_test python -m benchmarks.explain_indexes
+import argparse
+import json
+
+from app import app, db
+from query_plans import seed_catalog, explain_hot_queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--movies', type=int, default=200000)
+    parser.add_argument('--actors', type=int, default=50000)
+    parser.add_argument('--directors', type=int, default=10000)
+    parser.add_argument('--plans', action='store_true',
+                        help='print the full json plans')
+    args = parser.parse_args()
+
+    failed = []
+    with app.app_context():
+        try:
+            ids = seed_catalog(db.session, args.movies, args.actors,
+                               args.directors)
+            report = explain_hot_queries(db.session, ids)
+        finally:
+            db.session.rollback()
+
+    print(f'{"query":<26}{"expected index":<36}{"result":<8}seq scans')
+    for name, (index, used, scans, plan) in report.items():
+        result = 'ok' if index in used else 'MISSING'
+        if result != 'ok':
+            failed.append(name)
+        print(f'{name:<26}{index:<36}{result:<8}{", ".join(sorted(scans)) or "-"}')
+        if args.plans:
+            print(json.dumps(plan, indent=2))
+
+    if failed:
+        raise SystemExit(f'not using their index: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# what does the payroll rollup (payroll.py) save per GET /stats/payroll?
+# seeds a large catalog in one transaction (see query_plans.py), then times
+# the top movies / actors / directors computed live with GROUP BY against a
+# read of the refreshed materialized view, and the refresh itself. rolls
+# everything back and vacuums. run from the starter folder against a migrated scratch
+# database:
+#   DB_NAME=capstone_movie_test python -m benchmarks.payroll_rollup
+import time
+import argparse
+import statistics
+
+from sqlalchemy import text
+
+from app import app, db
+from payroll import PAYROLL_GROUPS, payroll_report, refresh_payroll
+from query_plans import seed_catalog
+
+# the same numbers as one row of the rollup, for one kind, computed per request
+LIVE_SQL = '''
+    SELECT {group} AS id, count(*), sum(ma.actor_pay), avg(ma.actor_pay),
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY ma.actor_pay),
+           percentile_cont(0.9) WITHIN GROUP (ORDER BY ma.actor_pay),
+           min(ma.actor_pay), max(ma.actor_pay)
+    FROM movie_actor ma JOIN movie m ON m.id = ma.movie_id
+    WHERE ma.actor_pay IS NOT NULL
+    GROUP BY {group}
+    ORDER BY sum(ma.actor_pay) DESC, {group}
+    LIMIT :limit
+'''
+
+GROUP_COLUMNS = {'movie': 'ma.movie_id', 'actor': 'ma.actor_id', 'director': 'm.director_id'}
+
+
+def timed(f, runs):
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        f()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--movies', type=int, default=200000)
+    parser.add_argument('--actors', type=int, default=50000)
+    parser.add_argument('--directors', type=int, default=10000)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    results = {}
+    with app.app_context():
+        session = db.session
+        try:
+            seed_catalog(session, args.movies, args.actors, args.directors)
+            # spread the pays, the seed gives every role the same one
+            session.execute(text('UPDATE movie_actor SET actor_pay = 1000 + (id::bigint * 7919) % 99000'))
+            roles = session.execute(text('SELECT count(*) FROM movie_actor')).scalar()
+            refresh_seconds = refresh_payroll(session.connection())
+            for by in PAYROLL_GROUPS:
+                live = text(LIVE_SQL.format(group=GROUP_COLUMNS[by]))
+                results[by] = (
+                    timed(lambda: session.execute(live, {'limit': args.limit}).all(), args.runs),
+                    timed(lambda: payroll_report(session, by, args.limit, 0), args.runs))
+        finally:
+            session.rollback()
+        # dead rows left by the rolled back seed would slow the next run down
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text('VACUUM movie, actor, director, movie_actor'))
+
+    print(f'refresh: {refresh_seconds * 1000:.0f} ms for {roles} roles')
+    print(f'{"by":<10}{"live GROUP BY ms":>18}{"rollup read ms":>16}')
+    for by, (live_ms, rollup_ms) in results.items():
+        print(f'{by:<10}{live_ms:>18.1f}{rollup_ms:>16.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+# does GET /search stay inside its latency budget on a large catalog?
+# seeds millions of made-up titles and names in one transaction, times the
+# search query (see search.py) for a spread of queries, from a two letter
+# prefix matching a large share of the rows to a word and a prefix, and
+# rolls everything back (then vacuums: dead rows left by earlier runs would
+# slow the next one down). run from the starter folder against a migrated
+# scratch database:
+#   DB_NAME=capstone_movie_test python -m benchmarks.search_latency
+import time
+import argparse
+import statistics
+
+from sqlalchemy import text
+
+from app import app, db
+from search import SEARCH_TYPES, search_args, search
+
+# words are three syllables, 64000 of them, so prefixes are spread like
+# real titles: a few letters narrow the catalog quickly
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'ti', 'vo', 'ber', 'dan',
+             'fel', 'gor', 'hal', 'jun', 'kor', 'lin', 'mar', 'nor', 'pel', 'quo',
+             'ros', 'sel', 'tor', 'ul', 'van', 'wel', 'xan', 'yor', 'zel', 'al',
+             'en', 'is', 'or', 'an', 'et', 'im', 'os', 'ar', 'el', 'ix']
+
+
+def word(n):
+    return ' || '.join(
+        f"(ARRAY{SYLLABLES})[1 + ((hashint8(g * 4 + {n}) >> {8 * i}) & 2147483647) % {len(SYLLABLES)}]"
+        for i in range(3))
+
+
+SEED_SQL = {
+    'director': f'''
+        INSERT INTO director (name, age, gender)
+        SELECT initcap({word(0)} || ' ' || {word(1)}), 30 + g % 40, 'female'
+        FROM generate_series(1, :count) g''',
+    'actor': f'''
+        INSERT INTO actor (name, age, gender)
+        SELECT initcap({word(0)} || ' ' || {word(1)}), 20 + g % 50, 'male'
+        FROM generate_series(1, :count) g''',
+    # one to three word titles
+    'movie': f'''
+        INSERT INTO movie (title, release_date, director_id)
+        SELECT initcap({word(0)}
+                       || CASE WHEN g % 3 > 0 THEN ' ' || {word(1)} ELSE '' END
+                       || CASE WHEN g % 3 = 2 THEN ' ' || {word(2)} ELSE '' END),
+               DATE '2000-01-01' + g % 7000, (SELECT min(id) FROM director)
+        FROM generate_series(1, :count) g'''
+}
+
+PERMISSIONS = [permission for _, _, permission in SEARCH_TYPES.values()]
+
+# q -> what it stands for, from broad to narrow
+QUERIES = {
+    'ka': 'two letters',
+    'kor': 'one syllable',
+    'korsel': 'two syllables',
+    'korselvo': 'a full word',
+    'korselvo ka': 'a word and two letters',
+    'korselvo mimi': 'no match'
+}
+
+
+def seed(session, movies, actors, directors):
+    # the large seeds outlast DB_STATEMENT_TIMEOUT
+    session.execute(text('SET LOCAL statement_timeout = 0'))
+    for table, count in (('director', directors), ('actor', actors), ('movie', movies)):
+        started = time.perf_counter()
+        session.execute(text(SEED_SQL[table]), {'count': count})
+        print(f'seeded {count} {table} rows in {time.perf_counter() - started:.1f}s')
+    session.execute(text('ANALYZE director, actor, movie'))
+    session.execute(text('SET LOCAL statement_timeout = DEFAULT'))
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[max(int(len(timings) * p) - 1, 0)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--movies', type=int, default=2000000)
+    parser.add_argument('--actors', type=int, default=500000)
+    parser.add_argument('--directors', type=int, default=100000)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--budget-ms', type=float, default=100,
+                        help='p95 every query must stay under')
+    args = parser.parse_args()
+
+    results = {}
+    with app.app_context():
+        try:
+            seed(db.session, args.movies, args.actors, args.directors)
+            for q in QUERIES:
+                query = search_args({'q': q}, PERMISSIONS, args.limit, args.limit)[0]
+                hits, cursor, truncated = search(db.session, query, list(SEARCH_TYPES), args.limit)
+                timings = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    search(db.session, query, list(SEARCH_TYPES), args.limit)
+                    timings.append((time.perf_counter() - started) * 1000)
+                # a second page, through the keyset cursor
+                page_timings = []
+                if cursor:
+                    after = search_args({'q': q, 'after': cursor}, PERMISSIONS,
+                                        args.limit, args.limit)[3]
+                    for _ in range(args.runs):
+                        started = time.perf_counter()
+                        search(db.session, query, list(SEARCH_TYPES), args.limit, after)
+                        page_timings.append((time.perf_counter() - started) * 1000)
+                matches = db.session.execute(text(
+                    "SELECT (SELECT count(*) FROM movie WHERE to_tsvector('simple', title) @@ q) "
+                    "     + (SELECT count(*) FROM actor WHERE to_tsvector('simple', name) @@ q) "
+                    "     + (SELECT count(*) FROM director WHERE to_tsvector('simple', name) @@ q) "
+                    "FROM to_tsquery('simple', :query) q"), {'query': query}).scalar()
+                results[q] = (matches, truncated, timings, page_timings)
+        finally:
+            db.session.rollback()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.execute(text('VACUUM director, actor, movie'))
+
+    failed = []
+    print(f'{"q":<14}{"":<22}{"matches":>9}{"truncated":>11}{"p50 ms":>9}{"p95 ms":>9}{"page 2 p95":>12}{"":>6}')
+    for q, (matches, truncated, timings, page_timings) in results.items():
+        p95 = percentile(timings, 0.95)
+        page_p95 = percentile(page_timings, 0.95) if page_timings else 0
+        ok = max(p95, page_p95) <= args.budget_ms
+        if not ok:
+            failed.append(q)
+        print(f'{q:<14}{QUERIES[q]:<22}{matches:>9}{"yes" if truncated else "no":>11}{statistics.median(timings):>9.1f}'
+              f'{p95:>9.1f}{page_p95:>12.1f}{"ok" if ok else "SLOW":>6}')
+
+    if failed:
+        raise SystemExit(f'over the {args.budget_ms:g} ms budget: {", ".join(failed)}')
+
+
+if __name__ == '__main__':
+    main()
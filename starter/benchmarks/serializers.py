@@ -0,0 +1,97 @@
+# serialization benchmark: hand-built json_format dicts + flask's encoder
+# vs the compiled serializers + FastJSONEncoder, on in-memory movies
+# run from the starter folder: python -m benchmarks.serializers
+import datetime
+import time
+
+from flask import Flask, jsonify
+from flask.json import JSONEncoder
+from flask_sqlalchemy import SQLAlchemy
+
+from models import CreateEntity
+from serializers import serializer, FastJSONEncoder
+
+SIZES = (1000, 10000, 100000)
+CAST_SIZE = 3
+
+
+# the per-model json_format the compiled serializers replaced
+def legacy_movie_json(movie):
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'release_date': movie.release_date,
+        'director': {
+            'id': movie.director.id,
+            'name': movie.director.name,
+            'age': movie.director.age,
+            'gender': movie.director.gender
+        },
+        'actors': [{
+            'id': ma.ma_actor.id,
+            'name': ma.ma_actor.name,
+            'age': ma.ma_actor.age,
+            'gender': ma.ma_actor.gender,
+            'pay': ma.actor_pay
+        } for ma in movie.movie_actor],
+    }
+
+
+def build_movies(count, Movie, Actor, Director, MovieActor):
+    director = Director('director', 50, 'female')
+    director.id, director.name, director.age = 1, 'director', 50
+    actors = []
+    for i in range(CAST_SIZE):
+        actor = Actor('actor', 30, 'male')
+        actor.id, actor.name = i + 1, f'actor {i}'
+        actors.append(actor)
+
+    movies = []
+    for i in range(count):
+        movie = Movie('movie', None, director.id)
+        movie.id, movie.title = i + 1, f'movie {i}'
+        movie.release_date = datetime.date(2021, 9, 1) + datetime.timedelta(days=i % 365)
+        movie.director = director
+        for actor in actors:
+            ma = MovieActor(actor.id, movie.id, 10000)
+            ma.ma_actor = actor
+            movie.movie_actor.append(ma)
+        movies.append(movie)
+    return movies
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main():
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'postgresql://'
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    Movie, Actor, Director, MovieActor, _ = CreateEntity(SQLAlchemy(app))
+    serialize = serializer(Movie)
+
+    print(f'{"rows":>8}{"legacy ms":>12}{"compiled ms":>14}{"speedup":>10}')
+    for size in SIZES:
+        movies = build_movies(size, Movie, Actor, Director, MovieActor)
+        with app.test_request_context():
+            app.json_encoder = JSONEncoder
+            legacy, legacy_res = timed(lambda: jsonify({
+                'success': True,
+                'movies': [legacy_movie_json(m) for m in movies]
+            }))
+            app.json_encoder = FastJSONEncoder
+            compiled, compiled_res = timed(lambda: jsonify({
+                'success': True,
+                'movies': [serialize(m) for m in movies]
+            }))
+
+        assert legacy_res.get_json() == compiled_res.get_json()
+        print(f'{size:>8}{legacy * 1000:>12.1f}{compiled * 1000:>14.1f}'
+              f'{legacy / compiled:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+# set-based writes for the collection endpoints
+# a json array posted to a collection is inserted in one transaction with
+# multi-row INSERT ... SELECT FROM unnest(...) statements of batch_size
+# rows each, instead of one add + commit per row.
+# a movie's cast is replaced with one upsert and one delete, and bulk
+# updates / deletes by id list or filter are single UPDATE / DELETE
+# statements with RETURNING
+import datetime
+from sqlalchemy import Date, Integer, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import DBAPIError
+from werkzeug.exceptions import BadRequest
+
+from versions import bump_versions
+
+# atomic: every item is inserted or none is
+# per_item: bad items are reported and skipped, the others are inserted
+BULK_MODES = ('atomic', 'per_item')
+
+# foreign keys to rows whose cached views list the written row
+# (see entity_cache.py)
+PARENT_COLUMNS = {
+    'movie': {'director_id': 'director'},
+    'actor': {},
+    'director': {},
+    'movie_actor': {'movie_id': 'movie', 'actor_id': 'actor'}
+}
+
+
+def bulk_args(args):
+    mode = args.get('mode', 'atomic')
+    if mode not in BULK_MODES:
+        raise BadRequest(f'mode must be one of {", ".join(BULK_MODES)}')
+    return mode
+
+
+# column values of one posted item, missing columns are null like in the
+# single item endpoints. values are typed like a filter's (column_value), so
+# a bad one is reported for its item instead of failing the whole
+# multi-row insert in postgres
+def item_values(model, item):
+    if not isinstance(item, dict):
+        raise BadRequest('each item must be a json object')
+    return {column: column_value(model, column, item.get(column))
+            for column in model.FIELDS if column != 'id'}
+
+
+def error_message(error):
+    if isinstance(error, DBAPIError) and error.orig is not None:
+        return str(error.orig).strip().splitlines()[0]
+    return getattr(error, 'description', None) or str(error)
+
+
+def changed_rows(model, values, ids):
+    table = model.__tablename__
+    parents = PARENT_COLUMNS[table]
+    rows = []
+    for row, row_id in zip(values, ids):
+        rows.append((table, row_id))
+        rows += [(parent, row[column]) for column, parent in parents.items()]
+    return rows
+
+
+# RETURNING gives no row order, so each row draws its id from the sequence
+# next to its position in the posted array and the ids are read back by it
+INSERT_ROWS_SQL = '''
+    WITH item AS MATERIALIZED (
+        SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id, item.*
+        FROM unnest({arrays}) WITH ORDINALITY AS item({columns}, ord)
+    ), inserted AS (
+        INSERT INTO {table} (id, {columns})
+        SELECT id, {columns} FROM item
+    )
+    SELECT id FROM item ORDER BY ord
+'''
+
+
+# one multi-row insert, returns the ids in values order
+def insert_rows(session, model, values):
+    table = model.__table__
+    columns = [column for column in model.FIELDS if column != 'id']
+    arrays = ', '.join(
+        f'CAST(:{column} AS {table.c[column].type.compile(dialect=postgresql.dialect())}[])'
+        for column in columns)
+    statement = text(INSERT_ROWS_SQL.format(table=table.name, columns=', '.join(columns),
+                                            arrays=arrays))
+    params = {column: [row[column] for row in values] for column in columns}
+    return session.execute(statement, params).scalars().all()
+
+
+# INSERT THE ITEMS AND COMMIT
+# returns the new ids in item order (None for skipped items) and the
+# per-item errors as [{'index': i, 'message': ...}]
+def bulk_insert(session, model, items, mode='atomic', batch_size=500):
+    try:
+        if mode == 'atomic':
+            ids, errors = _insert_atomic(session, model, items, batch_size)
+        else:
+            ids, errors = _insert_per_item(session, model, items, batch_size)
+
+        inserted = [(values, row_id) for values, row_id in ids if row_id is not None]
+        if inserted:
+            bump_versions(session, model.__tablename__,
+                          rows=changed_rows(model, *zip(*inserted)))
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    return [row_id for _, row_id in ids], errors
+
+
+def _insert_atomic(session, model, items, batch_size):
+    values = []
+    for index, item in enumerate(items):
+        try:
+            values.append(item_values(model, item))
+        except BadRequest as e:
+            raise BadRequest(f'item {index}: {error_message(e)}')
+    ids = []
+    for start in range(0, len(values), batch_size):
+        batch = values[start:start + batch_size]
+        ids += zip(batch, insert_rows(session, model, batch))
+    return ids, []
+
+
+def _insert_per_item(session, model, items, batch_size):
+    ids = [(None, None)] * len(items)
+    errors = []
+
+    valid = []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, item_values(model, item)))
+        except BadRequest as e:
+            errors.append({'index': index, 'message': error_message(e)})
+
+    for start in range(0, len(valid), batch_size):
+        batch = valid[start:start + batch_size]
+        # whole batch first, row by row only when something in it fails
+        try:
+            with session.begin_nested():
+                new_ids = insert_rows(session, model, [v for _, v in batch])
+        except DBAPIError:
+            new_ids = []
+            for index, values in batch:
+                try:
+                    with session.begin_nested():
+                        new_ids += insert_rows(session, model, [values])
+                except DBAPIError as e:
+                    new_ids.append(None)
+                    errors.append({'index': index, 'message': error_message(e)})
+
+        for (index, values), row_id in zip(batch, new_ids):
+            ids[index] = (values, row_id)
+
+    errors.sort(key=lambda error: error['index'])
+    return ids, errors
+
+
+LOCK_MOVIE_SQL = 'SELECT id FROM movie WHERE id = :movie_id FOR UPDATE'
+
+# actors no longer in the cast
+REMOVE_CAST_SQL = '''
+    DELETE FROM movie_actor
+    WHERE movie_id = :movie_id AND actor_id <> ALL(:actor_ids)
+    RETURNING id, actor_id
+'''
+
+# new actors are added, actors whose pay changed are updated, unchanged rows
+# are left alone (xmax = 0 marks a freshly inserted row)
+UPSERT_CAST_SQL = '''
+    INSERT INTO movie_actor (movie_id, actor_id, actor_pay)
+    SELECT :movie_id, cast_row.actor_id, cast_row.actor_pay
+    FROM unnest(CAST(:actor_ids AS integer[]), CAST(:actor_pays AS integer[]))
+         AS cast_row(actor_id, actor_pay)
+    ON CONFLICT ON CONSTRAINT uq_movie_actor_movie_id_actor_id
+    DO UPDATE SET actor_pay = EXCLUDED.actor_pay
+    WHERE movie_actor.actor_pay IS DISTINCT FROM EXCLUDED.actor_pay
+    RETURNING id, actor_id, xmax = 0
+'''
+
+CAST_SQL = '''
+    SELECT id, actor_id, actor_pay FROM movie_actor
+    WHERE movie_id = :movie_id ORDER BY id
+'''
+
+
+# desired cast of a movie, [{'actor_id': 1, 'actor_pay': 100}, ...]
+def cast_args(body):
+    if not isinstance(body, list):
+        raise BadRequest('the cast must be a json array')
+
+    cast = {}
+    for item in body:
+        if not isinstance(item, dict) or type(item.get('actor_id')) is not int:
+            raise BadRequest('each cast member needs an integer actor_id')
+        pay = item.get('actor_pay')
+        if pay is not None and type(pay) is not int:
+            raise BadRequest('actor_pay must be an integer')
+        if item['actor_id'] in cast:
+            raise BadRequest('an actor can only be cast once')
+        cast[item['actor_id']] = pay
+    return cast
+
+
+# REPLACE THE CAST OF A MOVIE AND COMMIT
+# returns the resulting cast rows and how many were added, updated and
+# removed, or None when there is no such movie
+def replace_cast(session, movie_id, cast):
+    try:
+        # one cast replacement per movie at a time
+        if session.execute(text(LOCK_MOVIE_SQL),
+                           {'movie_id': movie_id}).first() is None:
+            session.rollback()
+            return None
+
+        params = {'movie_id': movie_id,
+                  'actor_ids': list(cast),
+                  'actor_pays': list(cast.values())}
+        removed = session.execute(text(REMOVE_CAST_SQL), params).all()
+        upserted = session.execute(text(UPSERT_CAST_SQL), params).all()
+
+        if removed or upserted:
+            rows = [('movie', movie_id)]
+            for row_id, actor_id, *_ in removed + upserted:
+                rows += [('movie_actor', row_id), ('actor', actor_id)]
+            bump_versions(session, 'movie_actor', rows=rows)
+
+        result = session.execute(text(CAST_SQL), {'movie_id': movie_id}).all()
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+    added = sum(1 for *_, inserted in upserted if inserted)
+    return ([{'id': row_id, 'actor_id': actor_id, 'actor_pay': actor_pay}
+             for row_id, actor_id, actor_pay in result],
+            {'added': added,
+             'updated': len(upserted) - added,
+             'removed': len(removed)})
+
+
+# tables a delete cascades to (ON DELETE CASCADE on the movie_actor keys)
+DELETE_CASCADE = {
+    'movie': ('movie_actor',),
+    'actor': ('movie_actor',)
+}
+
+# the matching rows, capped and locked. limit is one more than the cap, so
+# a statement that would touch too many rows is detected after touching at
+# most cap + 1 of them
+TARGET_SQL = '''
+    SELECT {columns} FROM {table} WHERE {where}
+    ORDER BY id LIMIT :limit FOR UPDATE
+'''
+
+BULK_DELETE_SQL = '''
+    WITH target AS ({target})
+    DELETE FROM {table} WHERE id IN (SELECT id FROM target)
+    RETURNING {returning}
+'''
+
+BULK_UPDATE_SQL = '''
+    WITH target AS ({target})
+    UPDATE {table} SET {changes} FROM target WHERE {table}.id = target.id
+    RETURNING {returning}
+'''
+
+COUNT_SQL = 'SELECT count(*) FROM {table} WHERE {where}'
+
+
+# python value of one filter or change, typed after the model column
+def column_value(model, column, value):
+    if value is None:
+        return None
+    column_type = model.__table__.c[column].type
+    if isinstance(column_type, Integer):
+        if type(value) is not int:
+            raise BadRequest(f'{column} must be an integer')
+    elif isinstance(column_type, Date):
+        try:
+            return datetime.date.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise BadRequest(f'{column} must be a yyyy-mm-dd date')
+    elif not isinstance(value, str):
+        raise BadRequest(f'{column} must be a string')
+    return value
+
+
+# {column: value or [values]} matching rows, `ids` is short for `id`
+def filter_args(model, filters):
+    if not isinstance(filters, dict):
+        raise BadRequest('filter must be a json object')
+    filters = dict(filters)
+    if 'ids' in filters:
+        filters['id'] = filters.pop('ids')
+    if not filters:
+        raise BadRequest('an empty filter would match every row')
+
+    result = {}
+    for column, value in filters.items():
+        if column not in model.FIELDS:
+            raise BadRequest(f'unknown filter {column}')
+        if isinstance(value, list):
+            if not value:
+                raise BadRequest(f'empty {column} list')
+            result[column] = [column_value(model, column, v) for v in value]
+        else:
+            result[column] = column_value(model, column, value)
+    return result
+
+
+# the same filter from a query string, ?ids=1,2,3&director_id=4. integer
+# and date values may be comma-separated, string values are taken whole
+# (?name=Smith, John) and repeated for a list (?name=a&name=b)
+def query_filter_args(model, args):
+    filters = {}
+    for name in args.keys():
+        if name == 'dry_run':
+            continue
+        column = 'id' if name == 'ids' else name
+        if column not in model.FIELDS:
+            raise BadRequest(f'unknown filter {name}')
+        values = args.getlist(name)
+        column_type = model.__table__.c[column].type
+        if isinstance(column_type, (Integer, Date)):
+            values = [v.strip() for value in values for v in value.split(',') if v.strip()]
+        if isinstance(column_type, Integer):
+            try:
+                values = [int(v) for v in values]
+            except ValueError:
+                raise BadRequest(f'{name} must be integers')
+        filters[column] = values
+    return filter_args(model, filters)
+
+
+def change_args(model, changes):
+    if not isinstance(changes, dict) or not changes:
+        raise BadRequest('changes must be a non-empty json object')
+    if any(column == 'id' or column not in model.FIELDS for column in changes):
+        raise BadRequest('changes may only set the entity columns')
+    return {column: column_value(model, column, value)
+            for column, value in changes.items()}
+
+
+def dry_run_arg(args):
+    return args.get('dry_run', 'false').lower() == 'true'
+
+
+def where_sql(filters):
+    conditions, params = [], {}
+    for column, value in filters.items():
+        name = f'f_{column}'
+        if value is None:
+            conditions.append(f'{column} IS NULL')
+            continue
+        conditions.append(f'{column} = ANY(:{name})' if isinstance(value, list)
+                          else f'{column} = :{name}')
+        params[name] = value
+    return ' AND '.join(conditions), params
+
+
+def _run_capped(session, sql, params, max_rows):
+    params['limit'] = max_rows + 1
+    try:
+        rows = session.execute(text(sql), params).mappings().all()
+        if len(rows) > max_rows:
+            raise BadRequest(f'matches more than {max_rows} rows')
+    except Exception:
+        session.rollback()
+        raise
+    return rows
+
+
+def _commit(session, tables, rows):
+    try:
+        if rows:
+            bump_versions(session, *tables, rows=rows)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def count_matching(session, model, filters):
+    where, params = where_sql(filters)
+    count = session.execute(
+        text(COUNT_SQL.format(table=model.__tablename__, where=where)),
+        params).scalar()
+    session.rollback()
+    return count
+
+
+# DELETE THE MATCHING ROWS AND COMMIT, RETURNS THEM AS DICTS
+# BadRequest (nothing deleted) when more than max_rows rows match
+def bulk_delete(session, model, filters, max_rows):
+    table = model.__tablename__
+    parents = PARENT_COLUMNS[table]
+    where, params = where_sql(filters)
+
+    sql = BULK_DELETE_SQL.format(
+        target=TARGET_SQL.format(columns='id', table=table, where=where),
+        table=table, returning=', '.join(model.FIELDS))
+    deleted = [dict(row) for row in _run_capped(session, sql, params, max_rows)]
+
+    rows = []
+    for row in deleted:
+        rows.append((table, row['id']))
+        rows += [(parent, row[column]) for column, parent in parents.items()]
+    _commit(session, (table, *DELETE_CASCADE.get(table, ())), rows)
+    return deleted
+
+
+# APPLY THE CHANGES TO THE MATCHING ROWS AND COMMIT, RETURNS THEM AS DICTS
+# BadRequest (nothing updated) when more than max_rows rows match
+def bulk_update(session, model, filters, changes, max_rows):
+    table = model.__tablename__
+    parents = PARENT_COLUMNS[table]
+    where, params = where_sql(filters)
+    params.update({f'c_{column}': value for column, value in changes.items()})
+
+    # parent keys before and after the update, both lists show the row
+    sql = BULK_UPDATE_SQL.format(
+        target=TARGET_SQL.format(columns=', '.join(('id', *parents)),
+                                 table=table, where=where),
+        table=table,
+        changes=', '.join(f'{column} = :c_{column}' for column in changes),
+        returning=', '.join((*(f'{table}.{column}' for column in model.FIELDS),
+                             *(f'target.{column} AS old_{column}'
+                               for column in parents))))
+    updated = [dict(row) for row in _run_capped(session, sql, params, max_rows)]
+
+    rows = []
+    for row in updated:
+        rows.append((table, row['id']))
+        for column, parent in parents.items():
+            rows += [(parent, row[column]), (parent, row.pop(f'old_{column}'))]
+    _commit(session, (table,), rows)
+    return updated
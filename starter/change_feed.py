@@ -0,0 +1,150 @@
+# cross-worker cache coherence over postgres LISTEN / NOTIFY
+# every transaction that bumped table versions (see versions.py) also sends a
+# NOTIFY with the written tables and rows. postgres delivers it when, and
+# only if, the transaction commits. a listener thread in each worker passes
+# the other workers' changes to the cache invalidation listeners
+import os
+import json
+import select
+import socket
+import threading
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from versions import changed
+
+CHANGE_FEED = os.getenv('CHANGE_FEED', 'true').lower() == 'true'
+CHANGE_FEED_CHANNEL = os.getenv('CHANGE_FEED_CHANNEL', 'entity_changes')
+
+# notify payloads must stay under 8000 bytes, bigger changes are sent as
+# tables only (receivers then evict by table)
+MAX_PAYLOAD = 7900
+
+
+# unique per process, also when workers are forked from one preloaded app
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def change_payload(tables, rows):
+    payload = json.dumps({'worker': worker_id(), 'tables': sorted(tables),
+                          'rows': list(rows)})
+    if len(payload) > MAX_PAYLOAD:
+        payload = json.dumps({'worker': worker_id(), 'tables': sorted(tables),
+                              'rows': None})
+    return payload
+
+
+@event.listens_for(Session, 'before_commit')
+def _publish(session):
+    tables = session.info.get('changed_tables')
+    if not CHANGE_FEED or not tables:
+        return
+    session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                    {'channel': CHANGE_FEED_CHANNEL,
+                     'payload': change_payload(tables,
+                                               session.info.get('changed_rows', ()))})
+
+
+# LISTENER THREAD
+# holds one dedicated connection out of the pool. after (re)connecting it
+# reports a change of everything, since notifications sent while it was not
+# listening are lost
+class ChangeListener:
+    def __init__(self, engine, channel=CHANGE_FEED_CHANNEL, poll_interval=5,
+                 retry_interval=1, max_retry_interval=30):
+        self.engine = engine
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+
+        self._thread = None
+        self._stopping = threading.Event()
+        self.listening = threading.Event()
+
+        # counters
+        self.received = 0
+        self.applied = 0
+        self.reconnects = 0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='change-feed',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    def connect(self):
+        # detached from the pool, it is never handed to a request
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.connection
+        dbapi_connection.autocommit = True
+        with dbapi_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+        return dbapi_connection
+
+    def dispatch(self, payload):
+        self.received += 1
+        change = json.loads(payload)
+        if change.get('worker') == worker_id():
+            # already applied right after our own commit
+            return
+        self.applied += 1
+        changed(change['tables'], change['rows'])
+
+    def _run(self):
+        delay = self.retry_interval
+        while not self._stopping.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                self.listening.set()
+                changed(None)
+                delay = self.retry_interval
+                while not self._stopping.is_set():
+                    if select.select([connection], [], [],
+                                     self.poll_interval) == ([], [], []):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.dispatch(connection.notifies.pop(0).payload)
+            except Exception:
+                self.listening.clear()
+                self.reconnects += 1
+                self._stopping.wait(delay)
+                delay = min(delay * 2, self.max_retry_interval)
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+
+    def stats(self):
+        return {
+            'listening': self.listening.is_set(),
+            'received': self.received,
+            'applied': self.applied,
+            'reconnects': self.reconnects
+        }
+
+
+_listener = None
+
+
+# one listener per worker process, called from create_app
+def start_change_listener(engine):
+    global _listener
+    if _listener is None:
+        _listener = ChangeListener(engine)
+    _listener.start()
+    return _listener
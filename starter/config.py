@@ -1,4 +1,5 @@
 import os
+from db_pool import TimedQueuePool
 SECRET_KEY = os.urandom(32)
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -15,8 +16,60 @@ DB_PATH_TEST = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}/{DB_NAME_TEST}'
 
 
 SQLALCHEMY_DATABASE_URI = DB_PATH
+
+# read replicas, comma separated uris, bound as replica_0, replica_1, ...
+# GET requests read from them (see routing.py)
+DB_REPLICA_URIS = [uri.strip() for uri in os.getenv('DB_REPLICA_URIS', '').split(',')
+                   if uri.strip()]
+SQLALCHEMY_BINDS = {f'replica_{i}': uri for i, uri in enumerate(DB_REPLICA_URIS)}
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# connection pool, per worker process (see db_pool.py)
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# seconds to open a connection, milliseconds a statement may run (0 = the
+# server's own statement_timeout, by default no limit)
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
+DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'poolclass': TimedQueuePool,
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    'connect_args': {
+        'connect_timeout': DB_CONNECT_TIMEOUT
+    }
+}
+if DB_STATEMENT_TIMEOUT > 0:
+    SQLALCHEMY_ENGINE_OPTIONS['connect_args']['options'] = f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'
+
+# read path: let postgres build list documents with json_agg (see json_views.py)
+JSON_AGG_READS = os.getenv('JSON_AGG_READS', 'false').lower() == 'true'
+
+# keyset pagination on list endpoints (see pagination.py)
+DEFAULT_PAGE_SIZE = int(os.getenv('DEFAULT_PAGE_SIZE', 20))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 100))
+
+# list endpoints may sort on a column no index leads while the table has at
+# most this many rows (see filtering.py)
+SORT_GUARD_ROWS = int(os.getenv('SORT_GUARD_ROWS', 10000))
+
+# rows fetched per round trip by ?stream=true full dumps (see streaming.py)
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 500))
+
+# json arrays posted to the collection endpoints (see bulk.py)
+MAX_BULK_ITEMS = int(os.getenv('MAX_BULK_ITEMS', 5000))
+BULK_INSERT_BATCH_SIZE = int(os.getenv('BULK_INSERT_BATCH_SIZE', 500))
+
+# most rows one bulk PATCH / DELETE on a collection may touch (see bulk.py)
+MAX_AFFECTED_ROWS = int(os.getenv('MAX_AFFECTED_ROWS', 1000))
+
 
 # AUTH TOKEN
 CLIENT_TOKEN = os.getenv('CLIENT_TOKEN', None)
@@ -0,0 +1,84 @@
+# connection pool with checkout timing
+# the engine options live in config.py (SQLALCHEMY_ENGINE_OPTIONS). every
+# worker process has its own pool, so a deployment can open up to
+# workers * (pool_size + max_overflow) connections, plus one per worker for
+# the change feed (see change_feed.py). pool_stats() reports what a worker
+# actually uses, to size the pools against postgres max_connections
+import time
+import threading
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+
+class CheckoutStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # counters
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def stats(self):
+        return {
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'wait_seconds': round(self.wait_seconds, 6),
+            'max_wait_seconds': round(self.max_wait_seconds, 6),
+            'avg_wait_seconds': (round(self.wait_seconds / self.checkouts, 6)
+                                 if self.checkouts else 0.0)
+        }
+
+
+# QUEUE POOL THAT TIMES EVERY CHECKOUT
+# the wait covers queueing for a free connection and opening a new one when
+# the pool grows; checkouts that give up after pool_timeout count as timeouts
+class TimedQueuePool(QueuePool):
+    def __init__(self, creator, **kw):
+        super().__init__(creator, **kw)
+        self.checkout_stats = CheckoutStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.checkout_stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.checkout_stats.record(time.perf_counter() - started)
+        return connection
+
+    # engine.dispose() swaps in a new pool, keep counting across it
+    def recreate(self):
+        pool = super().recreate()
+        pool.checkout_stats = self.checkout_stats
+        return pool
+
+
+# POOL USAGE OF ONE ENGINE
+# max_overflow as configured (DB_MAX_OVERFLOW), the pool doesn't expose it
+def pool_stats(engine, max_overflow):
+    pool = engine.pool
+    stats = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'max_overflow': max_overflow,
+            'capacity': pool.size() + max(max_overflow, 0),
+            'in_use': pool.checkedout(),
+            'idle': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0)
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.checkout_stats.stats())
+    return stats
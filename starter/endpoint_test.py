@@ -1,13 +1,38 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Engine
 from werkzeug.http import parse_accept_header
 from app import create_app
 from models import CreateEntity
 import unittest
 import json
 import copy
+import time
+from contextlib import contextmanager
+from unittest import mock
 
 from app import create_app
 from config import DB_PATH_TEST, CLIENT_TOKEN, ASSISTANT_TOKEN, PRODUCER_TOKEN
+from local_issuer import LocalIssuer
+from auth import AuthError
+from http_cache import response_cache
+from entity_cache import entity_cache
+from change_feed import CHANGE_FEED_CHANNEL, start_change_listener
+from query_plans import seed_catalog, explain_hot_queries, plan_indexes, plan_seq_scans
+from routing import ReplicaRouter
+from search import search_sql, search_args
+from filtering import Sort
+from json_views import list_sql, keyset_runs
+from payroll import PayrollRefresher
+
+# without live auth0 tokens, run offline against a local issuer
+if not all((CLIENT_TOKEN, ASSISTANT_TOKEN, PRODUCER_TOKEN)):
+    issuer = LocalIssuer()
+    issuer.install()
+    CLIENT_TOKEN = issuer.bearer('client')
+    ASSISTANT_TOKEN = issuer.bearer('assistant')
+    PRODUCER_TOKEN = issuer.bearer('producer')
 
 # disable test sort
 unittest.TestLoader.sortTestMethodsUsing = None
@@ -55,6 +80,72 @@ class CapstoneTestCase(unittest.TestCase):
     def tearDown(self) -> None:
         pass
 
+    # sort nested lists of documents by id so two read paths can be compared
+    def normalize(self, value):
+        if isinstance(value, list):
+            items = [self.normalize(v) for v in value]
+            if all(isinstance(v, dict) and 'id' in v for v in items):
+                items.sort(key=lambda v: v['id'])
+            return items
+        if isinstance(value, dict):
+            return {k: self.normalize(v) for k, v in value.items()}
+        return value
+
+    # sql statements issued while serving one request uncached
+    # (minus the etag version lookup, see http_cache.py)
+    def capture_queries(self, path, token, headers=()):
+        statements = []
+        response_cache.clear()
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            if 'entity_version' not in statement:
+                statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().get(path, headers={('Content-Type', 'application/json'),
+                                                   ('Authorization', f'{token}'), *headers})
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+        self.assertIn(res.status_code, (200, 304))
+        return statements
+
+    def count_queries(self, path, token):
+        return len(self.capture_queries(path, token))
+
+    # COMMITTED ROWS FOR ONE TEST, DELETED AGAIN AFTERWARDS
+    # director, movies and actors are column dicts (the movies get the
+    # director), roles are (movie index, actor index, actor_pay).
+    # yields (director_id, movie_ids, actor_ids)
+    @contextmanager
+    def seeded_rows(self, director, movies=(), actors=(), roles=()):
+        with self.app.app_context():
+            session = self.db.session
+            director_id = session.execute(text(
+                'INSERT INTO director (name, age, gender) VALUES (:name, :age, :gender) '
+                'RETURNING id'), director).scalar()
+            movie_ids = [session.execute(text(
+                'INSERT INTO movie (title, release_date, director_id) '
+                'VALUES (:title, :release_date, :director_id) RETURNING id'),
+                {**movie, 'director_id': director_id}).scalar() for movie in movies]
+            actor_ids = [session.execute(text(
+                'INSERT INTO actor (name, age, gender) VALUES (:name, :age, :gender) '
+                'RETURNING id'), actor).scalar() for actor in actors]
+            for movie, actor, pay in roles:
+                session.execute(text(
+                    'INSERT INTO movie_actor (movie_id, actor_id, actor_pay) VALUES (:m, :a, :pay)'),
+                    {'m': movie_ids[movie], 'a': actor_ids[actor], 'pay': pay})
+            session.commit()
+            try:
+                yield director_id, movie_ids, actor_ids
+            finally:
+                session.rollback()
+                session.execute(text('DELETE FROM movie WHERE id = ANY(:ids)'), {'ids': movie_ids})
+                session.execute(text('DELETE FROM actor WHERE id = ANY(:ids)'), {'ids': actor_ids})
+                session.execute(text('DELETE FROM director WHERE id = :id'), {'id': director_id})
+                session.commit()
+
     # test cases (post >> get >> put >> delete)
     # region: post
     def test_aa_add_director(self):
@@ -153,6 +244,73 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'],False)
         self.assertEqual(data['message'], "bad request")
 
+    def test_ae_bulk_add_actors(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        names = [f'bulk_actor_{i}' for i in range(5)]
+        self.app.config['BULK_INSERT_BATCH_SIZE'] = 2
+        res = self.client().post('/actors', json=[dict(self.new_actor, name=name) for name in names],
+                                 headers=headers)
+        data = json.loads(res.data)
+        created = [json.loads(self.client().get(f'/actors/{actor_id}', headers=headers).data)['actor']
+                   for actor_id in data['new_actors']]
+        for actor_id in data['new_actors']:
+            self.client().delete(f'/actors/{actor_id}', headers=headers)
+
+        # assertion
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['success'], True)
+        self.assertEqual([a['name'] for a in created], names)
+        self.assertEqual(data['new_actors'], sorted(data['new_actors']))
+
+    def test_af_bulk_add_movies_per_item(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        items = [self.new_movie, dict(self.new_movie, director_id=1000000000), 'not a movie', self.new_movie]
+        res = self.client().post('/movies?mode=per_item', json=items, headers=headers)
+        data = json.loads(res.data)
+        for movie_id in data['new_movies']:
+            if movie_id is not None:
+                self.client().delete(f'/movies/{movie_id}', headers=headers)
+
+        # assertion
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([movie_id is None for movie_id in data['new_movies']], [False, True, True, False])
+        self.assertEqual([e['index'] for e in data['errors']], [1, 2])
+
+    def test_ag_bulk_add_reports_bad_values_per_item(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        items = [self.new_actor, dict(self.new_actor, age='old'), dict(self.new_actor, name=7),
+                 self.new_actor]
+        res = self.client().post('/actors?mode=per_item', json=items, headers=headers)
+        data = json.loads(res.data)
+        for actor_id in data['new_actors']:
+            if actor_id is not None:
+                self.client().delete(f'/actors/{actor_id}', headers=headers)
+        atomic = self.client().post('/actors', json=items, headers=headers)
+
+        # assertion
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual([actor_id is None for actor_id in data['new_actors']], [False, True, True, False])
+        self.assertEqual(data['errors'], [{'index': 1, 'message': 'age must be an integer'},
+                                          {'index': 2, 'message': 'name must be a string'}])
+        self.assertEqual(atomic.status_code, 400)
+
+    def test_400_atomic_bulk_add_rolls_back(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        before = json.loads(self.client().get('/movies', headers=headers).data)['movies']
+        res = self.client().post('/movies', json=[self.new_movie, dict(self.new_movie, director_id=1000000000)],
+                                 headers=headers)
+        data = json.loads(res.data)
+        after = json.loads(self.client().get('/movies', headers=headers).data)['movies']
+
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+        self.assertEqual(len(after), len(before))
+
     # endregion
 
     # region: get
@@ -192,6 +350,653 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'],True)
         self.assertTrue(data['movie_actors'])
 
+    def test_bh_get_movies_query_count_is_constant(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        get_actors_res = self.client().get('/actors', headers=headers)
+        actor_ids = [a['id'] for a in json.loads(get_actors_res.data)['actors']][:2]
+        before = self.count_queries('/movies', self.client_token)
+
+        # grow the catalog: movies with a cast each
+        new_movie_ids = []
+        for _ in range(3):
+            res = self.client().post('/movies', json=self.new_movie, headers=headers)
+            movie_id = json.loads(res.data)['new_movie']
+            new_movie_ids.append(movie_id)
+            for actor_id in actor_ids:
+                self.client().post('/movie_actors', headers=headers, json={
+                    'movie_id': movie_id, 'actor_id': actor_id, 'actor_pay': 100})
+
+        after = self.count_queries('/movies', self.client_token)
+        by_id = self.count_queries(f'/movies/{new_movie_ids[0]}', self.client_token)
+        for movie_id in new_movie_ids:
+            self.client().delete(f'/movies/{movie_id}', headers=headers)
+
+        # assertion
+        self.assertEqual(before, after)
+        self.assertLessEqual(after, 2)
+        self.assertLessEqual(by_id, 2)
+
+    def test_bi_json_agg_reads_match_orm(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.client_token}')}
+        for path, key in (('/movies', 'movies'), ('/actors', 'actors'),
+                          ('/directors', 'directors'), ('/movie_actors', 'movie_actors')):
+            self.app.config['JSON_AGG_READS'] = False
+            orm_res = self.client().get(path, headers=headers)
+            self.app.config['JSON_AGG_READS'] = True
+            agg_res = self.client().get(path, headers=headers)
+
+            # assertion
+            self.assertEqual(agg_res.status_code, 200)
+            self.assertEqual(agg_res.mimetype, 'application/json')
+            self.assertTrue(json.loads(agg_res.data)[key])
+            self.assertEqual(self.normalize(json.loads(agg_res.data)),
+                             self.normalize(json.loads(orm_res.data)))
+
+    def test_bj_keyset_pagination(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.client_token}')}
+        for json_agg in (False, True):
+            self.app.config['JSON_AGG_READS'] = json_agg
+            for path, key in (('/movies', 'movies'), ('/actors', 'actors'),
+                              ('/directors', 'directors'), ('/movie_actors', 'movie_actors')):
+                full = json.loads(self.client().get(path, headers=headers).data)[key]
+                ids, cursor = [], ''
+                while cursor is not None:
+                    res = self.client().get(f'{path}?limit=1&after={cursor or 0}', headers=headers)
+                    data = json.loads(res.data)
+                    # assertion
+                    self.assertEqual(res.status_code, 200)
+                    self.assertLessEqual(len(data[key]), 1)
+                    ids += [row['id'] for row in data[key]]
+                    cursor = data['next_cursor']
+
+                self.assertEqual(ids, sorted(row['id'] for row in full))
+
+    def test_bk_page_size_is_capped(self):
+        self.app.config['MAX_PAGE_SIZE'] = 1
+        res = self.client().get('/actors?limit=1000' ,headers={('Content-Type', 'application/json'),
+                                                             ('Authorization', f'{self.client_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(len(data['actors']), 1)
+
+    def test_400_get_movies_with_invalid_limit(self):
+        res = self.client().get('/movies?limit=abc' ,headers={('Content-Type', 'application/json'),
+                                                            ('Authorization', f'{self.client_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_bl_streamed_full_dump(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.client_token}')}
+        self.app.config['STREAM_BATCH_SIZE'] = 1
+        for json_agg in (False, True):
+            self.app.config['JSON_AGG_READS'] = json_agg
+            for path, key in (('/movies', 'movies'), ('/actors', 'actors'),
+                              ('/directors', 'directors'), ('/movie_actors', 'movie_actors')):
+                full = json.loads(self.client().get(path, headers=headers).data)
+                res = self.client().get(f'{path}?stream=true', headers=headers)
+                # assertion
+                self.assertEqual(res.status_code, 200)
+                self.assertTrue(res.is_streamed)
+                self.assertEqual(self.normalize(json.loads(res.data)), self.normalize(full))
+
+    def test_400_stream_with_limit(self):
+        res = self.client().get('/movies?stream=true&limit=5' ,headers={('Content-Type', 'application/json'),
+                                                                      ('Authorization', f'{self.client_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_bm_sparse_fieldsets(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.client_token}')}
+        statements = self.capture_queries('/actors?fields=id,name', self.client_token)
+        actors = json.loads(self.client().get('/actors?fields=id,name', headers=headers).data)['actors']
+        movies = json.loads(self.client().get('/movies?fields=id,title&expand=director',
+                                              headers=headers).data)['movies']
+        movie = json.loads(self.client().get(f'/movies/{movies[0]["id"]}?expand=actors',
+                                             headers=headers).data)['movie']
+
+        # assertion
+        self.assertEqual(len(statements), 1)
+        self.assertNotIn('actor.age', statements[0])
+        self.assertTrue(actors)
+        self.assertTrue(all(set(a) == {'id', 'name'} for a in actors))
+        self.assertTrue(all(set(m) == {'id', 'title', 'director'} for m in movies))
+        self.assertEqual(set(movie), {'id', 'title', 'release_date', 'director_id', 'actors'})
+
+    def test_bm_expanded_director_needs_no_lazy_load(self):
+        with self.seeded_rows(**self.LIST_ROWS) as (_, movie_ids, _):
+            listed = self.capture_queries('/movies?fields=title&expand=director', self.client_token)
+            entity_cache.clear()
+            by_id = self.capture_queries(f'/movies/{movie_ids[0]}?fields=title&expand=director',
+                                         self.client_token)
+
+        # assertion: director_id comes with the movie row, not a query per row
+        self.assertEqual(len(listed), 1)
+        self.assertEqual(len(by_id), 1)
+
+    def test_bn_conditional_get(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        first = self.client().get('/movies', headers=headers)
+        etag = first.headers['ETag']
+        statements = self.capture_queries('/movies', self.client_token,
+                                          headers=[('If-None-Match', etag)])
+        not_modified = self.client().get('/movies', headers=headers | {('If-None-Match', etag)})
+        other_view = self.client().get('/movies?fields=id', headers=headers | {('If-None-Match', etag)})
+
+        # any write to a table the view reads changes the etag
+        actor_id = json.loads(self.client().get('/actors', headers=headers).data)['actors'][-1]['id']
+        self.client().put(f'/actors/{actor_id}', json=self.new_actor, headers=headers)
+        changed = self.client().get('/movies', headers=headers | {('If-None-Match', etag)})
+
+        # assertion
+        self.assertEqual(first.status_code, 200)
+        self.assertFalse(first.headers['ETag'].startswith('W/'))
+        self.assertEqual(statements, [])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.headers['ETag'], etag)
+        self.assertEqual(not_modified.data, b'')
+        self.assertEqual(other_view.status_code, 200)
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+
+    def test_bo_response_cache(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        self.client().get('/directors', headers=headers)
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            cached = self.client().get('/directors', headers=headers)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+
+        # a movie write evicts the director views that embed movies
+        invalidations = response_cache.stats()['invalidations']
+        res = self.client().post('/movies', json=self.new_movie, headers=headers)
+        movie_id = json.loads(res.data)['new_movie']
+        directors = json.loads(self.client().get('/directors', headers=headers).data)['directors']
+        self.client().delete(f'/movies/{movie_id}', headers=headers)
+
+        # assertion
+        self.assertEqual(cached.status_code, 200)
+        self.assertEqual(statements, [])
+        self.assertGreater(response_cache.stats()['invalidations'], invalidations)
+        self.assertIn(movie_id, [m['id'] for d in directors for m in d['movies']])
+
+    def test_bp_entity_cache_follows_change_feed(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.client_token}')}
+        actor_id = json.loads(self.client().get('/actors', headers=headers).data)['actors'][0]['id']
+        self.client().get(f'/actors/{actor_id}', headers=headers)
+        statements = self.capture_queries(f'/actors/{actor_id}', self.client_token)
+        key = ('actor', actor_id, None, None)
+
+        # a write from another worker arrives as a notification
+        with self.app.app_context():
+            listener = start_change_listener(self.db.engine)
+            self.assertTrue(listener.listening.wait(5))
+            self.db.session.execute(
+                text('SELECT pg_notify(:channel, :payload)'),
+                {'channel': CHANGE_FEED_CHANNEL,
+                 'payload': json.dumps({'worker': 'other-host:1', 'tables': ['movie_actor'],
+                                        'rows': [['actor', actor_id]]})})
+            self.db.session.commit()
+        deadline = time.monotonic() + 5
+        while entity_cache.get(key) is not None and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        # assertion
+        self.assertFalse([s for s in statements if 'FROM actor' in s])
+        self.assertIsNone(entity_cache.get(key))
+        self.assertGreaterEqual(listener.stats()['applied'], 1)
+
+    def test_bq_relationship_queries_use_indexes(self):
+        with self.app.app_context():
+            try:
+                ids = seed_catalog(self.db.session, movies=20000, actors=5000, directors=2000)
+                report = explain_hot_queries(self.db.session, ids)
+            finally:
+                self.db.session.rollback()
+
+        # assertion
+        for name, (index, used, scans, _) in report.items():
+            self.assertIn(index, used, name)
+            self.assertFalse(scans & {'movie', 'movie_actor'}, name)
+
+    def test_br_pool_stats(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        self.client().get('/movies', headers=headers)
+        res = self.client().get('/stats/pool', headers=headers)
+        data = json.loads(res.data)
+
+        # assertion
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['pool']['pool'], 'TimedQueuePool')
+        self.assertEqual(data['pool']['size'], self.app.config['DB_POOL_SIZE'])
+        self.assertEqual(data['pool']['max_overflow'], self.app.config['DB_MAX_OVERFLOW'])
+        self.assertGreaterEqual(data['pool']['checkouts'], 2)
+        self.assertGreaterEqual(data['pool']['in_use'], 1)
+        self.assertGreater(data['server']['max_connections'], 0)
+        self.assertEqual(set(data['caches']), {'token', 'response', 'entity'})
+        self.assertGreaterEqual(data['caches']['token']['hits'], 1)
+        self.assertEqual(data['caches']['response']['maxsize'], response_cache.stats()['maxsize'])
+
+    def test_403_pool_stats_for_client(self):
+        res = self.client().get('/stats/pool', headers={('Content-Type', 'application/json'),
+                                                        ('Authorization', f'{self.client_token}')})
+        # assertion
+        self.assertEqual(res.status_code, 403)
+
+    # points replica binds at the test database (or nowhere)
+    def use_replicas(self, **binds):
+        self.app.config['SQLALCHEMY_BINDS'] = binds
+        self.app.extensions['replica_router'] = ReplicaRouter(sorted(binds))
+        return self.app.extensions['replica_router']
+
+    def routed_get(self, path, token, headers=()):
+        response_cache.clear()
+        res = self.client().get(path, headers={('Content-Type', 'application/json'),
+                                               ('Authorization', f'{token}'), *headers})
+        self.assertEqual(res.status_code, 200)
+        return res.headers['X-DB-Route']
+
+    def test_bt_replica_routing(self):
+        router = self.use_replicas(replica_0=DB_PATH_TEST, replica_1=DB_PATH_TEST)
+        reads = {self.routed_get('/movies', self.client_token) for _ in range(4)}
+        forced = self.routed_get('/movies', self.client_token, {('X-DB-Route', 'primary')})
+        res = self.client().post('/directors', json=self.new_director, headers={('Content-Type', 'application/json'),
+                                                                                ('Authorization', f'{self.producer_token}')})
+        writer_read = self.routed_get('/movies', self.producer_token)
+        other_read = self.routed_get('/movies', self.client_token)
+
+        # assertion
+        self.assertEqual(reads, {'replica_0; reason=read', 'replica_1; reason=read'})
+        self.assertEqual(forced, 'primary; reason=requested')
+        self.assertEqual(res.headers['X-DB-Route'], 'primary; reason=write')
+        self.assertEqual(writer_read, 'primary; reason=read-your-writes')
+        self.assertTrue(other_read.startswith('replica_'))
+        self.assertEqual(router.stats()['routes']['primary:write'], 1)
+
+    def test_bu_unhealthy_replica_is_ejected(self):
+        router = self.use_replicas(replica_0=DB_PATH_TEST,
+                                   replica_1=DB_PATH_TEST.rsplit('/', 1)[0] + '/capstone_no_such_db')
+        routes = [self.routed_get('/actors', self.client_token) for _ in range(4)]
+        self.use_replicas(replica_1=DB_PATH_TEST.rsplit('/', 1)[0] + '/capstone_no_such_db')
+        fallback = self.routed_get('/actors', self.client_token)
+
+        # assertion
+        self.assertEqual(set(routes), {'replica_0; reason=read'})
+        self.assertEqual(router.stats()['ejected'], ['replica_1'])
+        self.assertEqual(fallback, 'primary; reason=replicas-down')
+
+    def test_bv_lagging_replica_read_is_not_cached(self):
+        self.use_replicas(replica_0=DB_PATH_TEST)
+        client = {('Content-Type', 'application/json'), ('Authorization', f'{self.client_token}')}
+        producer = {('Content-Type', 'application/json'), ('Authorization', f'{self.producer_token}')}
+        actor = json.loads(self.client().get('/actors', headers=client).data)['actors'][-1]
+        original = {k: actor[k] for k in ('name', 'age', 'gender')}
+
+        # the replica lags: its reads see a snapshot taken before the write
+        holder = create_engine(DB_PATH_TEST)
+        snapshot_connection = holder.connect()
+        snapshot_connection.execute(text('BEGIN ISOLATION LEVEL REPEATABLE READ'))
+        snapshot = snapshot_connection.execute(text('SELECT pg_export_snapshot()')).scalar()
+
+        def lagging(connection):
+            cursor = connection.connection.cursor()
+            cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            cursor.execute('SET TRANSACTION SNAPSHOT %s', (snapshot,))
+
+        with self.app.app_context():
+            replica = self.db.get_engine(self.app, bind='replica_0')
+        replica.dispose()
+        event.listen(replica, 'begin', lagging)
+        try:
+            self.client().put(f'/actors/{actor["id"]}', json={**original, 'name': 'lagging_actor'},
+                              headers=producer)
+            stale = self.client().get(f'/actors/{actor["id"]}', headers=client)
+        finally:
+            event.remove(replica, 'begin', lagging)
+            snapshot_connection.close()
+            holder.dispose()
+            replica.dispose()
+        caught_up = self.client().get(f'/actors/{actor["id"]}', headers=client)
+        self.client().put(f'/actors/{actor["id"]}', json=original, headers=producer)
+
+        # assertion
+        self.assertTrue(stale.headers['X-DB-Route'].startswith('replica_0'))
+        self.assertEqual(json.loads(stale.data)['actor']['name'], original['name'])
+        self.assertIsNone(entity_cache.get(('actor', actor['id'], None, None)))
+        self.assertEqual(json.loads(caught_up.data)['actor']['name'], 'lagging_actor')
+
+    def test_bs_statement_timeout(self):
+        options = self.app.config['SQLALCHEMY_ENGINE_OPTIONS']
+        engine = create_engine(DB_PATH_TEST, **{
+            **options,
+            'connect_args': {**options['connect_args'], 'options': '-c statement_timeout=50'}
+        })
+        try:
+            with engine.connect() as connection:
+                with self.assertRaises(OperationalError):
+                    connection.execute(text('SELECT pg_sleep(1)'))
+            with engine.connect() as connection:
+                timeout = connection.execute(text('SHOW statement_timeout')).scalar()
+        finally:
+            engine.dispose()
+
+        # assertion
+        self.assertEqual(timeout, '50ms')
+        self.assertEqual(engine.pool.checkout_stats.stats()['checkouts'], 2)
+
+    # rows with a made-up word (see seeded_rows)
+    SEARCH_ROWS = {
+        'director': {'name': 'Vexa Holm', 'age': 50, 'gender': 'female'},
+        'movies': [{'title': title, 'release_date': '2021-09-21'}
+                   for title in ('Vexa', 'The Long Return of Vexa', 'Vexation')],
+        'actors': [{'name': name, 'age': 30, 'gender': 'male'}
+                   for name in ('Vexa Marr', 'Lio Vexan')]
+    }
+
+    def search_get(self, path, token):
+        res = self.client().get(path, headers={('Content-Type', 'application/json'),
+                                               ('Authorization', f'{token}')})
+        return res.status_code, json.loads(res.data)
+
+    def test_bv_search(self):
+        with self.seeded_rows(**self.SEARCH_ROWS):
+            status, data = self.search_get('/search?q=vexa', self.client_token)
+            hits = [(hit['type'], hit['name']) for hit in data['results']]
+
+            # assertion
+            self.assertEqual(status, 200)
+            self.assertEqual(set(hits), {('movie', 'Vexa'), ('movie', 'The Long Return of Vexa'),
+                                         ('movie', 'Vexation'), ('actor', 'Vexa Marr'),
+                                         ('actor', 'Lio Vexan'), ('director', 'Vexa Holm')})
+            # the exact one-word title first, the longer title after the
+            # two-word names
+            self.assertEqual(hits[0], ('movie', 'Vexa'))
+            self.assertLess(hits.index(('actor', 'Vexa Marr')),
+                            hits.index(('movie', 'The Long Return of Vexa')))
+            ranks = [hit['rank'] for hit in data['results']]
+            self.assertEqual(ranks, sorted(ranks, reverse=True))
+            self.assertEqual(set(data['results'][0]), {'type', 'id', 'name', 'rank'})
+            self.assertIsNone(data['next_cursor'])
+
+            status, data = self.search_get('/search?q=vexa%20ret', self.client_token)
+            self.assertEqual([hit['name'] for hit in data['results']], ['The Long Return of Vexa'])
+
+    def test_bw_search_pages_and_types(self):
+        with self.seeded_rows(**self.SEARCH_ROWS):
+            _, full = self.search_get('/search?q=vex', self.client_token)
+            pages = []
+            path = '/search?q=vex&limit=2'
+            while path:
+                status, data = self.search_get(path, self.client_token)
+                self.assertEqual(status, 200)
+                pages.append(data['results'])
+                path = data['next_cursor'] and f'/search?q=vex&limit=2&after={data["next_cursor"]}'
+            _, actors = self.search_get('/search?q=vex&type=actor', self.client_token)
+
+            # assertion
+            self.assertEqual(len(pages), 3)
+            self.assertEqual([hit for page in pages for hit in page], full['results'])
+            self.assertEqual({hit['type'] for hit in actors['results']}, {'actor'})
+            self.assertEqual(len(actors['results']), 2)
+            # kinds without their get: permission are left out, unless named
+            self.assertEqual(search_args({'q': 'vex'}, ['get:movies'], 10, 100)[1], ['movie'])
+            self.assertEqual(search_args({'q': 'vex', 'type': 'actor'}, ['get:actors'], 10, 100)[1],
+                             ['actor'])
+            with self.assertRaises(AuthError):
+                search_args({'q': 'vex', 'type': 'movie,actor'}, ['get:actors'], 10, 100)
+            with self.assertRaises(AuthError):
+                search_args({'q': 'vex'}, ['get:movieactors'], 10, 100)
+
+    def test_by_search_ranks_every_match_on_every_page(self):
+        # the best ranked title is the latest movie, every page ranks all
+        # matches rather than the earliest ones
+        rows = dict(self.SEARCH_ROWS, movies=[
+            {'title': f'Vexation {n}', 'release_date': '2021-09-21'} for n in range(4)
+        ] + [{'title': 'Vexa', 'release_date': '2021-09-21'}])
+        with self.seeded_rows(**rows) as (_, movie_ids, _):
+            _, full = self.search_get('/search?q=vex&type=movie', self.client_token)
+            pages = []
+            path = '/search?q=vex&type=movie&limit=1'
+            while path:
+                _, data = self.search_get(path, self.client_token)
+                pages.append(data['results'])
+                path = data['next_cursor'] and f'/search?q=vex&type=movie&limit=1&after={data["next_cursor"]}'
+
+        # assertion
+        self.assertEqual(pages[0][0]['id'], movie_ids[-1])
+        self.assertEqual({hit['id'] for hit in full['results']}, set(movie_ids))
+        self.assertEqual([hit for page in pages for hit in page], full['results'])
+        self.assertFalse(full['truncated'])
+
+    def test_bz_search_over_max_matches_is_truncated(self):
+        with self.seeded_rows(**self.SEARCH_ROWS) as (_, movie_ids, _):
+            with mock.patch('search.SEARCH_MAX_MATCHES', 2):
+                response_cache.clear()
+                _, full = self.search_get('/search?q=vex&type=movie', self.client_token)
+                pages = []
+                path = '/search?q=vex&type=movie&limit=1'
+                while path:
+                    _, data = self.search_get(path, self.client_token)
+                    pages.append(data)
+                    path = data['next_cursor'] and f'/search?q=vex&type=movie&limit=1&after={data["next_cursor"]}'
+                response_cache.clear()
+                _, narrow = self.search_get('/search?q=vexa%20ret&type=movie', self.client_token)
+
+        # assertion
+        # the two lowest ids are ranked, on every page, and flagged
+        self.assertEqual({hit['id'] for hit in full['results']}, set(movie_ids[:2]))
+        self.assertEqual([hit for page in pages for hit in page['results']], full['results'])
+        self.assertTrue(full['truncated'])
+        self.assertTrue(all(page['truncated'] for page in pages))
+        self.assertFalse(narrow['truncated'])
+
+    def test_400_search_with_bad_query(self):
+        paths = ['/search', '/search?q=', '/search?q=a', '/search?q=vexa&type=studio',
+                 '/search?q=vexa&limit=0', '/search?q=vexa&after=oops',
+                 '/search?q=vexa&after=0.5,studio,1']
+        statuses = [self.search_get(path, self.client_token)[0] for path in paths]
+        # assertion
+        self.assertEqual(statuses, [400] * len(paths))
+
+    def test_bx_search_uses_fts_indexes(self):
+        with self.app.app_context():
+            try:
+                self.db.session.execute(text('SET LOCAL enable_seqscan = off'))
+                plan = self.db.session.execute(
+                    text(f'EXPLAIN (FORMAT JSON) {search_sql(["movie", "actor", "director"], "actor")}'),
+                    {'query': 'vexa:*', 'limit': 20, 'max_matches': 100, 'rank': 0.5, 'id': 1}).scalar()[0]['Plan']
+            finally:
+                self.db.session.rollback()
+
+        # assertion
+        self.assertEqual(plan_indexes(plan) & {'ix_movie_title_fts', 'ix_actor_name_fts',
+                                               'ix_director_name_fts'},
+                         {'ix_movie_title_fts', 'ix_actor_name_fts', 'ix_director_name_fts'})
+
+    # rows with distinct dates and ages, and missing ones (see seeded_rows)
+    LIST_ROWS = {
+        'director': {'name': 'list_director', 'age': 61, 'gender': 'female'},
+        'movies': [{'title': 'list_movie', 'release_date': release_date}
+                   for release_date in ('1995-06-01', None, '1990-01-01')],
+        'actors': [{'name': 'list_actor', 'age': age, 'gender': 'female'}
+                   for age in (172, None, 171)]
+    }
+
+    # ids of every page, following next_cursor
+    def list_pages(self, path, view):
+        pages = []
+        while path:
+            res = self.client().get(path, headers={('Content-Type', 'application/json'),
+                                                   ('Authorization', f'{self.client_token}')})
+            self.assertEqual(res.status_code, 200, path)
+            data = json.loads(res.data)
+            pages.append([doc['id'] for doc in data[view]])
+            cursor = data.get('next_cursor')
+            path = cursor and f'{path.split("&after=")[0]}&after={cursor}'
+        return pages
+
+    def test_by_filter_and_sort_lists(self):
+        with self.seeded_rows(**self.LIST_ROWS) as (director_id, movie_ids, actor_ids):
+            newest, undated, oldest = movie_ids
+            older, ageless, younger = actor_ids
+            for json_agg in (False, True):
+                self.app.config['JSON_AGG_READS'] = json_agg
+                response_cache.clear()
+                movies = f'/movies?director_id={director_id}'
+
+                # assertion
+                self.assertEqual(self.list_pages(movies + '&sort=release_date', 'movies'),
+                                 [[oldest, newest, undated]])
+                self.assertEqual(self.list_pages(movies + '&sort=-release_date&limit=1', 'movies'),
+                                 [[undated], [newest], [oldest]])
+                self.assertEqual(self.list_pages(movies + '&sort=release_date&limit=2', 'movies'),
+                                 [[oldest, newest], [undated]])
+                self.assertEqual(self.list_pages(movies + '&release_date_from=1991-01-01'
+                                                 '&release_date_to=1999-12-31', 'movies'),
+                                 [[newest]])
+                self.assertEqual(self.list_pages('/actors?age_min=170&sort=-age&limit=1', 'actors'),
+                                 [[older], [younger]])
+                self.assertEqual(self.list_pages('/directors?age_min=61&age_max=61&gender=female'
+                                                 '&limit=5', 'directors'), [[director_id]])
+
+    def test_400_list_with_bad_filter_or_sort(self):
+        paths = ['/movies?sort=budget', '/movies?sort=-', '/movies?release_date_from=yesterday',
+                 '/actors?age_min=old', '/movies?sort=release_date&after=12',
+                 '/movies?sort=release_date&after=[12,%2212%22]', '/actors?sort=age&after=[%22x%22,1]']
+        statuses = [self.client().get(path, headers={('Content-Type', 'application/json'),
+                                                     ('Authorization', f'{self.client_token}')}).status_code
+                    for path in paths]
+        # assertion
+        self.assertEqual(statuses, [400] * len(paths))
+
+    def test_bz_sort_guard(self):
+        headers = {('Content-Type', 'application/json'), ('Authorization', f'{self.client_token}')}
+        small = self.client().get('/movies?sort=title', headers=headers)
+        self.app.config['SORT_GUARD_ROWS'] = 1
+        large = self.client().get('/movies?sort=title&limit=5', headers=headers)
+        indexed = self.client().get('/movies?sort=-release_date&limit=5', headers=headers)
+
+        # assertion
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(large.status_code, 400)
+        self.assertEqual(indexed.status_code, 200)
+
+    def test_ca_sorted_pages_use_indexes(self):
+        sort = Sort('release_date', True)
+        with self.app.app_context():
+            try:
+                seed_catalog(self.db.session, movies=20000, actors=5000, directors=2000)
+                plans = [self.db.session.execute(
+                    text(f'EXPLAIN (FORMAT JSON) {list_sql("movies", True, "", sort, keyset_runs(sort, after))}'),
+                    {'limit': 20, 'after_value': after and after[0], 'after_id': after and after[1]}
+                ).scalar()[0]['Plan'] for after in (None, ('2005-01-01', 10**6), (None, 10**6))]
+            finally:
+                self.db.session.rollback()
+
+        # assertion
+        for plan in plans:
+            self.assertIn('ix_movie_release_date_id', plan_indexes(plan))
+            self.assertNotIn('movie', plan_seq_scans(plan))
+
+    # roles with known pays (see seeded_rows)
+    PAYROLL_ROWS = {
+        'director': {'name': 'payroll_director', 'age': 50, 'gender': 'male'},
+        'movies': [{'title': 'payroll_movie', 'release_date': '2021-09-21'}] * 2,
+        'actors': [{'name': 'payroll_actor', 'age': 30, 'gender': 'male'}] * 3,
+        'roles': [(0, 0, 1000), (0, 1, 2000), (1, 0, 3000), (1, 2, 10000)]
+    }
+
+    def payroll_get(self, path):
+        res = self.client().get(path, headers={('Content-Type', 'application/json'),
+                                               ('Authorization', f'{self.producer_token}')})
+        self.assertEqual(res.status_code, 200, path)
+        return json.loads(res.data)
+
+    def test_cb_payroll_stats(self):
+        with self.seeded_rows(**self.PAYROLL_ROWS) as (director_id, movie_ids, actor_ids):
+            stale = self.payroll_get('/stats/payroll?by=director&limit=100')
+            res = self.client().post('/stats/payroll/refresh', headers={('Content-Type', 'application/json'),
+                                                                         ('Authorization', f'{self.producer_token}')})
+            directors = self.payroll_get('/stats/payroll?by=director&limit=100')
+            actors = self.payroll_get('/stats/payroll?by=actor&limit=100')
+            pages = []
+            path = '/stats/payroll?limit=1'
+            while path:
+                data = self.payroll_get(path)
+                pages += data['results']
+                path = data['next_cursor'] and f'/stats/payroll?limit=1&after={data["next_cursor"]}'
+
+            # assertion
+            self.assertEqual(res.status_code, 200)
+            self.assertNotIn(director_id, [group['id'] for group in stale['results']])
+            ours = next(group for group in directors['results'] if group['id'] == director_id)
+            self.assertAlmostEqual(ours.pop('p90'), 7900)
+            self.assertEqual(ours, {'rank': ours['rank'], 'id': director_id, 'name': 'payroll_director',
+                                    'roles': 4, 'total': 16000, 'average': 4000.0, 'p50': 2500.0,
+                                    'min_pay': 1000, 'max_pay': 10000})
+            self.assertEqual({group['id']: group['total'] for group in actors['results']
+                              if group['id'] in actor_ids},
+                             dict(zip(actor_ids, (4000, 2000, 10000))))
+            totals = [group['total'] for group in pages]
+            self.assertEqual(totals, sorted(totals, reverse=True))
+            self.assertEqual({group['id']: group['total'] for group in pages if group['id'] in movie_ids},
+                             dict(zip(movie_ids, (3000, 13000))))
+            self.assertEqual(directors['overall']['total'], sum(totals))
+            self.assertLess(directors['age_seconds'], 60)
+
+    def test_cc_payroll_scheduled_refresh(self):
+        with self.app.app_context():
+            fresh = PayrollRefresher(self.db.engine, interval=3600).refresh_if_stale()
+            refresher = PayrollRefresher(self.db.engine, interval=0)
+            stale = refresher.refresh_if_stale()
+
+        # assertion
+        self.assertFalse(fresh)
+        self.assertTrue(stale)
+        self.assertEqual(refresher.stats()['refreshes'], 1)
+
+    def test_403_payroll_stats(self):
+        get = self.client().get('/stats/payroll', headers={('Content-Type', 'application/json'),
+                                                           ('Authorization', f'{self.client_token}')})
+        refresh = self.client().post('/stats/payroll/refresh', headers={('Content-Type', 'application/json'),
+                                                                         ('Authorization', f'{self.assistant_token}')})
+        # assertion
+        self.assertEqual(get.status_code, 403)
+        self.assertEqual(refresh.status_code, 403)
+
+    def test_400_payroll_stats_by_unknown_group(self):
+        res = self.client().get('/stats/payroll?by=studio', headers={('Content-Type', 'application/json'),
+                                                                      ('Authorization', f'{self.producer_token}')})
+        # assertion
+        self.assertEqual(res.status_code, 400)
+
+    def test_400_get_actors_with_unknown_field(self):
+        res = self.client().get('/actors?fields=id,salary' ,headers={('Content-Type', 'application/json'),
+                                                                   ('Authorization', f'{self.client_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     def test_404_movies_actors_directors_movieactors_not_found(self):
         res = self.client().get('/wrong_url')
         data = json.loads(res.data)
@@ -442,6 +1247,124 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'], 'bad request')
 
+    def test_ce_replace_movie_cast(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        actor_ids = json.loads(self.client().post('/actors', json=[self.new_actor] * 3,
+                                                  headers=headers).data)['new_actors']
+        movie_id = json.loads(self.client().post('/movies', json=self.new_movie,
+                                                 headers=headers).data)['new_movie']
+
+        first = json.loads(self.client().put(f'/movies/{movie_id}/cast', headers=headers, json=[
+            {'actor_id': actor_ids[0], 'actor_pay': 100},
+            {'actor_id': actor_ids[1], 'actor_pay': 200}]).data)
+        second = json.loads(self.client().put(f'/movies/{movie_id}/cast', headers=headers, json=[
+            {'actor_id': actor_ids[1], 'actor_pay': 250},
+            {'actor_id': actor_ids[2], 'actor_pay': 300}]).data)
+        unchanged = json.loads(self.client().put(f'/movies/{movie_id}/cast', headers=headers, json=[
+            {'actor_id': actor_ids[1], 'actor_pay': 250},
+            {'actor_id': actor_ids[2], 'actor_pay': 300}]).data)
+        movie = json.loads(self.client().get(f'/movies/{movie_id}', headers=headers).data)['movie']
+
+        self.client().delete(f'/movies/{movie_id}', headers=headers)
+        for actor_id in actor_ids:
+            self.client().delete(f'/actors/{actor_id}', headers=headers)
+
+        # assertion
+        self.assertEqual((first['added'], first['updated'], first['removed']), (2, 0, 0))
+        self.assertEqual((second['added'], second['updated'], second['removed']), (1, 1, 1))
+        self.assertEqual((unchanged['added'], unchanged['updated'], unchanged['removed']), (0, 0, 0))
+        # the kept actor keeps its movie_actor row
+        self.assertEqual(second['cast'][0]['id'], first['cast'][1]['id'])
+        self.assertEqual(sorted((a['id'], a['pay']) for a in movie['actors']),
+                         [(actor_ids[1], 250), (actor_ids[2], 300)])
+
+    def test_400_replace_cast_with_duplicate_actor(self):
+        res = self.client().put('/movies/1/cast', json=[{'actor_id': 1}, {'actor_id': 1}],
+                                headers={('Content-Type', 'application/json'),
+                                         ('Authorization', f'{self.producer_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_403_replace_cast_as_assistant(self):
+        res = self.client().put('/movies/1/cast', json=[],
+                                headers={('Content-Type', 'application/json'),
+                                         ('Authorization', f'{self.assistant_token}')})
+        # assertion
+        self.assertEqual(res.status_code, 403)
+
+    def test_cf_bulk_update_actors(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        actor_ids = json.loads(self.client().post('/actors', json=[self.new_actor] * 3,
+                                                  headers=headers).data)['new_actors']
+        body = {'filter': {'ids': actor_ids}, 'changes': {'age': 40, 'gender': 'female'}}
+
+        dry_run = json.loads(self.client().patch('/actors?dry_run=true', json=body, headers=headers).data)
+        self.app.config['MAX_AFFECTED_ROWS'] = 2
+        capped = self.client().patch('/actors', json=body, headers=headers)
+        unchanged = json.loads(self.client().get(f'/actors/{actor_ids[0]}', headers=headers).data)['actor']
+        self.app.config['MAX_AFFECTED_ROWS'] = 3
+        res = self.client().patch('/actors', json=body, headers=headers)
+        data = json.loads(res.data)
+        updated = [json.loads(self.client().get(f'/actors/{actor_id}', headers=headers).data)['actor']
+                   for actor_id in actor_ids]
+        self.client().delete('/actors?ids=' + ','.join(map(str, actor_ids)), headers=headers)
+
+        # assertion
+        self.assertEqual(dry_run['count'], 3)
+        self.assertEqual(capped.status_code, 400)
+        self.assertEqual(unchanged['age'], self.new_actor['age'])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated_actors'], actor_ids)
+        self.assertTrue(all((a['age'], a['gender']) == (40, 'female') for a in updated))
+
+    def test_400_bulk_update_without_filter(self):
+        res = self.client().patch('/actors', json={'filter': {}, 'changes': {'age': 1}},
+                                  headers={('Content-Type', 'application/json'),
+                                           ('Authorization', f'{self.producer_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
+    def test_cg_patch_movie(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        movie_id = json.loads(self.client().post('/movies', json=self.new_movie,
+                                                 headers=headers).data)['new_movie']
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            res = self.client().patch(f'/movies/{movie_id}', json={'title': 'patched_movie'}, headers=headers)
+        finally:
+            event.remove(Engine, 'before_cursor_execute', before_cursor_execute)
+        data = json.loads(res.data)
+        movie = json.loads(self.client().get(f'/movies/{movie_id}', headers=headers).data)['movie']
+        self.client().delete(f'/movies/{movie_id}', headers=headers)
+
+        # assertion: a single statement reads and writes the movie
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['updated_movie']['title'], 'patched_movie')
+        self.assertEqual(data['updated_movie']['release_date'], movie['release_date'])
+        self.assertEqual(movie['title'], 'patched_movie')
+        self.assertEqual(len([s for s in statements if 'movie' in s and 'entity_version' not in s]), 1)
+
+    def test_400_patch_movie_with_invalid_id(self):
+        res = self.client().patch('/movies/1000000000', json={'title': 'patched_movie'},
+                                  headers={('Content-Type', 'application/json'),
+                                           ('Authorization', f'{self.producer_token}')})
+        data = json.loads(res.data)
+        # assertion
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(data['success'], False)
+
     # endregion
 
     # region: RBAC
@@ -486,13 +1409,15 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(data['message'], "Request permission is not authorized")
 
     def test_da_producer_add_movie_actor(self):
-        # get movie and actor id just created
-        get_actors_res = self.client().get('/actors' ,headers={('Content-Type', 'application/json'),
-                                                   ('Authorization', f'{self.producer_token}')})
-        actor_id = json.loads(get_actors_res.data)['actors'][-1]['id']
+        # get movie just created and an actor not cast in it yet
         get_movies_res = self.client().get('/movies' ,headers={('Content-Type', 'application/json'),
                                                    ('Authorization', f'{self.producer_token}')})
-        movie_id = json.loads(get_movies_res.data)['movies'][-1]['id']
+        movie = json.loads(get_movies_res.data)['movies'][-1]
+        movie_id = movie['id']
+        cast_ids = {a['id'] for a in movie['actors']}
+        get_actors_res = self.client().get('/actors' ,headers={('Content-Type', 'application/json'),
+                                                   ('Authorization', f'{self.producer_token}')})
+        actor_id = [a['id'] for a in json.loads(get_actors_res.data)['actors'] if a['id'] not in cast_ids][-1]
 
         mock = copy.copy(self.new_movie_actor)
         mock["actor_id"] = actor_id
@@ -615,7 +1540,56 @@ class CapstoneTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 400)
         self.assertEqual(data['success'], False)
         self.assertTrue(data['message'], 'bad request')
-    
+
+    def test_ee_bulk_delete_movies_with_cast(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        actor_id = json.loads(self.client().post('/actors', json=self.new_actor,
+                                                 headers=headers).data)['new_actor']
+        movie_ids = json.loads(self.client().post('/movies', json=[self.new_movie] * 2,
+                                                  headers=headers).data)['new_movies']
+        for movie_id in movie_ids:
+            self.client().put(f'/movies/{movie_id}/cast', json=[{'actor_id': actor_id}], headers=headers)
+        actor = json.loads(self.client().get(f'/actors/{actor_id}', headers=headers).data)['actor']
+
+        path = '/movies?ids=' + ','.join(map(str, movie_ids))
+        dry_run = json.loads(self.client().delete(path + '&dry_run=true', headers=headers).data)
+        res = self.client().delete(path, headers=headers)
+        data = json.loads(res.data)
+        gone = self.client().get(f'/movies/{movie_ids[0]}', headers=headers)
+        actor_after = json.loads(self.client().get(f'/actors/{actor_id}', headers=headers).data)['actor']
+        self.client().delete(f'/actors/{actor_id}', headers=headers)
+
+        # assertion
+        self.assertEqual(len(actor['movies']), 2)
+        self.assertEqual(dry_run['count'], 2)
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(data['deleted_movies'], movie_ids)
+        self.assertEqual(gone.status_code, 400)
+        self.assertEqual(actor_after['movies'], [])
+
+    def test_ef_bulk_delete_filter_keeps_commas_in_names(self):
+        headers = {('Content-Type', 'application/json'),
+                   ('Authorization', f'{self.producer_token}')}
+        actor_ids = json.loads(self.client().post('/actors', json=[
+            dict(self.new_actor, name='Smith, John'), dict(self.new_actor, name='Smith'),
+            dict(self.new_actor, name='John')], headers=headers).data)['new_actors']
+        comma = json.loads(self.client().delete('/actors?name=Smith,%20John&dry_run=true',
+                                                headers=headers).data)
+        repeated = json.loads(self.client().delete('/actors?name=Smith&name=John&dry_run=true',
+                                                   headers=headers).data)
+        res = self.client().delete('/actors?ids=' + ','.join(map(str, actor_ids)), headers=headers)
+
+        # assertion
+        self.assertEqual(comma['count'], 1)
+        self.assertEqual(repeated['count'], 2)
+        self.assertEqual(json.loads(res.data)['count'], 3)
+
+    def test_403_bulk_delete_as_assistant(self):
+        res = self.client().delete('/actors?ids=1', headers={('Content-Type', 'application/json'),
+                                                             ('Authorization', f'{self.assistant_token}')})
+        # assertion
+        self.assertEqual(res.status_code, 403)
 
     # endregion
 if __name__ == '__main__':
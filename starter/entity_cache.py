@@ -0,0 +1,106 @@
+# read-through cache of serialized entities for the by-id GET endpoints
+# each entry remembers the rows it was built from (the entity itself plus the
+# rows it embeds), so a write only evicts the entries that show the written
+# rows. writes in this worker evict right after commit, writes in the other
+# workers arrive through the postgres change feed (see change_feed.py)
+import os
+
+from versions import on_change
+from lru_cache import LRUCache
+
+# ENTITY CACHE SETUP (entries, seconds), size 0 turns it off
+ENTITY_CACHE_SIZE = int(os.getenv('ENTITY_CACHE_SIZE', 1024))
+ENTITY_CACHE_TTL = int(os.getenv('ENTITY_CACHE_TTL', 300))
+
+
+# (table, id) pairs a cached view of obj is built from, keyed by table
+# then relationship name (see RELATIONS on the models)
+EMBEDDED_ROWS = {
+    'movie': {
+        'director': lambda obj: [('director', obj.director_id)],
+        'actors': lambda obj: [row for ma in obj.movie_actor
+                               for row in (('movie_actor', ma.id),
+                                           ('actor', ma.actor_id))]
+    },
+    'actor': {
+        'movies': lambda obj: [row for ma in obj.movie_actor
+                               for row in (('movie_actor', ma.id),
+                                           ('movie', ma.movie_id))]
+    },
+    'director': {
+        'movies': lambda obj: [('movie', m.id) for m in obj.movies]
+    },
+    'movie_actor': {}
+}
+
+
+def entity_rows(obj, expand=None):
+    table = obj.__tablename__
+    if expand is None:
+        expand = type(obj).RELATIONS
+    rows = [(table, obj.id)]
+    for relation in expand:
+        rows += EMBEDDED_ROWS[table][relation](obj)
+    return rows
+
+
+class EntityCache:
+    def __init__(self, maxsize=1024, ttl=300):
+        # entries are (doc, rows it was built from)
+        self._cache = LRUCache(maxsize, ttl, on_remove=self._forget)
+        self._keys_by_row = {}
+        self._generation = 0
+
+    # bumped by every eviction, put() drops values loaded before it
+    def generation(self):
+        return self._generation
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, rows, generation):
+        with self._cache.lock:
+            if generation != self._generation:
+                return
+            self._cache.put(key, (value, rows))
+            for row in rows:
+                self._keys_by_row.setdefault(row, set()).add(key)
+
+    # on_remove of the lru, whether expired, evicted or invalidated
+    def _forget(self, key, entry):
+        for row in entry[1]:
+            keys = self._keys_by_row.get(row)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_row[row]
+
+    # EVICT EVERY ENTRY BUILT FROM ONE OF THE ROWS
+    # writes that don't name their rows evict everything built from the
+    # tables, and a change feed resync (tables None) clears the cache
+    def invalidate(self, tables, rows=None):
+        with self._cache.lock:
+            self._generation += 1
+            if tables is None:
+                self._cache.clear()
+                return
+
+            if rows:
+                stale = {key for row in rows
+                         for key in self._keys_by_row.get(tuple(row), ())}
+            else:
+                stale = {key for row, keys in self._keys_by_row.items()
+                         if row[0] in tables for key in keys}
+            self._cache.invalidate(stale)
+
+    def clear(self):
+        self.invalidate(None)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+entity_cache = EntityCache(ENTITY_CACHE_SIZE, ENTITY_CACHE_TTL)
+
+on_change(entity_cache.invalidate)
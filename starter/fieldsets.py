@@ -0,0 +1,46 @@
+# sparse fieldsets and relationship expansion for the GET endpoints
+# ?fields=id,name         only these columns (others are not even selected)
+# ?expand=movies          add these relationships (others are never loaded)
+# without either parameter the full json_format shape is returned
+from sqlalchemy.orm import load_only
+from werkzeug.exceptions import BadRequest
+
+
+# columns a relationship is reached through, loaded with it even when not
+# picked in fields: entity_rows (entity_cache.py) reads them off the row,
+# and a column left out by load_only would be loaded by a query of its own
+RELATION_COLUMNS = {
+    ('movie', 'director'): ('director_id',)
+}
+
+
+def split_names(value):
+    return tuple(name.strip() for name in value.split(',') if name.strip())
+
+
+# READ fields / expand FROM THE QUERY STRING
+# returns (None, None) for the full shape, otherwise the validated
+# (fields, expand) tuples for the model
+def fieldset_args(args, model):
+    if 'fields' not in args and 'expand' not in args:
+        return None, None
+
+    fields = split_names(args.get('fields', '')) or model.FIELDS
+    expand = split_names(args.get('expand', ''))
+
+    if (any(field not in model.FIELDS for field in fields)
+            or any(relation not in model.RELATIONS for relation in expand)):
+        raise BadRequest
+
+    return fields, expand
+
+
+# COLUMN-ONLY LOAD PLUS EAGER LOADING OF THE EXPANDED RELATIONSHIPS ONLY
+def fieldset_query(model, fields, expand):
+    if fields is None and expand is None:
+        return model.eager_query()
+
+    columns = [column for relation in expand
+               for column in RELATION_COLUMNS.get((model.__tablename__, relation), ())
+               if column not in fields]
+    return model.eager_query(expand).options(load_only(*fields, *columns))
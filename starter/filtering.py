@@ -0,0 +1,106 @@
+# server-side filters and sort for the list endpoints
+# ?director_id=3&release_date_from=2000-01-01&sort=-release_date
+# filters are whitelisted per view and become WHERE conditions on indexed
+# columns. sort=<column> or sort=-<column> orders by (column, id), paged
+# with a keyset cursor on both (see pagination.py), and is read in index
+# order. a column no index leads can only be sorted on while its table is
+# small (SORT_GUARD_ROWS): past that every page would sort the whole table
+import datetime
+from collections import namedtuple
+from sqlalchemy import Date, Integer, UniqueConstraint, text
+from werkzeug.exceptions import BadRequest
+
+# view -> {query parameter: (column, operator)}
+LIST_FILTERS = {
+    'movies': {
+        'director_id': ('director_id', '='),
+        'release_date_from': ('release_date', '>='),
+        'release_date_to': ('release_date', '<=')
+    },
+    'actors': {
+        'age_min': ('age', '>='),
+        'age_max': ('age', '<='),
+        'gender': ('gender', '=')
+    },
+    'directors': {
+        'age_min': ('age', '>='),
+        'age_max': ('age', '<='),
+        'gender': ('gender', '=')
+    },
+    'movie_actors': {
+        'movie_id': ('movie_id', '='),
+        'actor_id': ('actor_id', '=')
+    }
+}
+
+Sort = namedtuple('Sort', ('column', 'descending'))
+
+ROWS_SQL = 'SELECT count(*) FROM (SELECT 1 FROM {table} LIMIT :rows) t'
+
+
+# query string value of one filter, typed after the model column
+def parse_value(model, column, value):
+    column_type = model.__table__.c[column].type
+    try:
+        if isinstance(column_type, Integer):
+            return int(value)
+        if isinstance(column_type, Date):
+            return datetime.date.fromisoformat(value)
+    except ValueError:
+        raise BadRequest
+    return value
+
+
+# READ THE FILTERS AND sort FROM THE QUERY STRING
+# returns ([(parameter, column, operator, value)], Sort or None), None
+# for the default order by id
+def list_args(view, model, args):
+    filters = [(name, column, operator, parse_value(model, column, args[name]))
+               for name, (column, operator) in LIST_FILTERS[view].items()
+               if name in args]
+
+    key = args.get('sort')
+    if key is None:
+        return filters, None
+    descending = key.startswith('-')
+    column = key[1:] if descending else key
+    if column not in model.FIELDS:
+        raise BadRequest
+    if column == 'id' and not descending:
+        return filters, None
+    return filters, Sort(column, descending)
+
+
+def filter_query(query, model, filters):
+    for _, column, operator, value in filters:
+        query = query.filter(getattr(model, column).op(operator)(value))
+    return query
+
+
+# the same filters as sql text on the given table alias, with their params
+def filter_sql(filters, alias):
+    conditions = [f'{alias}.{column} {operator} :{name}'
+                  for name, column, operator, _ in filters]
+    return ' AND '.join(conditions), {name: value for name, _, _, value in filters}
+
+
+# does an index (or the primary key / a unique constraint) start with the column?
+def indexed(model, column):
+    table = model.__table__
+    leading = [list(table.primary_key.columns)]
+    leading += [list(index.columns) for index in table.indexes]
+    leading += [list(constraint.columns) for constraint in table.constraints
+                if isinstance(constraint, UniqueConstraint)]
+    return any(columns and columns[0].name == column for columns in leading)
+
+
+# GUARD: REJECT A SORT THAT WOULD SORT A LARGE TABLE ON EVERY PAGE
+# counts at most max_rows + 1 rows, only for sorts on unindexed columns
+def check_sort(session, model, sort, max_rows):
+    if sort is None or indexed(model, sort.column):
+        return
+    rows = session.execute(text(ROWS_SQL.format(table=model.__tablename__)),
+                           {'rows': max_rows + 1}).scalar()
+    if rows > max_rows:
+        raise BadRequest(f'sort on {sort.column} needs an index, '
+                         f'{model.__tablename__} has over {max_rows} rows')
@@ -0,0 +1,149 @@
+# conditional GET support and the in-process response cache for the read
+# endpoints
+# the ETag of a response is derived from the request (path + query string)
+# and the change versions of every table the view reads, so If-None-Match
+# can be answered with a 304 before any serialization query runs.
+# rendered responses are also kept per worker, tagged with the same tables,
+# and dropped as soon as a commit writes to one of them (see versions.py)
+import os
+import hashlib
+from functools import wraps
+from flask import g, request, Response
+
+from versions import read_versions, on_change
+from routing import read_from_replica
+from lru_cache import LRUCache
+
+# RESPONSE CACHE SETUP (entries, seconds, bytes), size 0 turns it off
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 512))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 30))
+RESPONSE_CACHE_MAX_BODY = int(os.getenv('RESPONSE_CACHE_MAX_BODY', 1024 * 1024))
+
+# tables each view reads, a write to any of them changes the view
+# (a movie write changes the actor and director views that embed movies)
+VIEW_TABLES = {
+    'movies': ('movie', 'director', 'actor', 'movie_actor'),
+    'actors': ('actor', 'movie_actor', 'movie'),
+    'directors': ('director', 'movie'),
+    'movie_actors': ('movie_actor',),
+    'search': ('movie', 'actor', 'director')
+}
+
+
+# RENDERED RESPONSE CACHE
+# bounded LRU keyed by route, arguments and permission. each entry carries the
+# tables it was built from; invalidate() drops every entry tagged with a
+# written table. a per-table generation makes put() discard responses that
+# were rendered from data a concurrent commit has since replaced
+class ResponseCache:
+    def __init__(self, maxsize=512, ttl=30, max_body=1024 * 1024):
+        self.max_body = max_body
+
+        # entries are (response, tables it was built from)
+        self._cache = LRUCache(maxsize, ttl)
+        self._epoch = 0
+        self._generations = {}
+
+    def _generation(self, tables):
+        return (self._epoch,
+                *(self._generations.get(table, 0) for table in tables))
+
+    def generation(self, tables):
+        with self._cache.lock:
+            return self._generation(tables)
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, tables, generation):
+        with self._cache.lock:
+            if generation != self._generation(tables):
+                return
+            self._cache.put(key, (value, tables))
+
+    # rows are ignored, responses are only tracked per table
+    def invalidate(self, tables, rows=None):
+        if tables is None:
+            self.clear()
+            return
+
+        tables = set(tables)
+        with self._cache.lock:
+            for table in tables:
+                self._generations[table] = self._generations.get(table, 0) + 1
+            self._cache.invalidate([key for key, (_, tags) in self._cache.items()
+                                    if tables.intersection(tags)])
+
+    def clear(self):
+        with self._cache.lock:
+            self._epoch += 1
+            self._cache.clear()
+
+    def stats(self):
+        return self._cache.stats()
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL,
+                               RESPONSE_CACHE_MAX_BODY)
+
+# write-through invalidation: every commit that bumped a table version, here
+# or in another worker
+on_change(response_cache.invalidate)
+
+
+# shared with the asgi read path (see asgi.py)
+def etag_for(full_path, representation, versions):
+    key = f'{full_path}|{representation}|{versions}'
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def view_etag(session, view, representation=''):
+    versions = read_versions(session, VIEW_TABLES[view])
+    return etag_for(request.full_path, representation, versions)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+# DECORATOR FOR GET HANDLERS (PUT IT UNDER requires_auth)
+# representation tells apart settings that change the response bytes
+def conditional(session, view, representation=lambda: ''):
+    def conditional_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            tables = VIEW_TABLES[view]
+            key = (request.full_path, g.get('permission'), representation())
+
+            cached = response_cache.get(key)
+            if cached is not None:
+                etag, body, mimetype = cached
+                if request.if_none_match.contains_weak(etag):
+                    return not_modified(etag)
+                response = Response(body, mimetype=mimetype)
+                response.set_etag(etag)
+                return response
+
+            generation = response_cache.generation(tables)
+            etag = view_etag(session, view, key[2])
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+
+            response = f(*args, **kwargs)
+            if response.status_code == 200:
+                response.set_etag(etag)
+                # replica rows may predate the last eviction (see routing.py)
+                if (not response.is_streamed
+                        and not read_from_replica()
+                        and response.content_length is not None
+                        and response.content_length <= response_cache.max_body):
+                    response_cache.put(key, (etag, response.get_data(),
+                                             response.mimetype),
+                                       tables, generation)
+            return response
+
+        return wrapper
+    return conditional_decorator
@@ -0,0 +1,236 @@
+# build the list endpoint documents inside postgres
+# json_build_object / json_agg produce the same shapes as the models'
+# json_format, so the read path skips orm hydration and python dict building
+# and the result text goes straight into the response body
+import json
+from sqlalchemy import text
+
+from filtering import filter_sql
+from pagination import keyset_runs, sort_cursor
+
+# flask's json encoder renders dates as http dates
+# e.g. 'Tue, 21 Sep 2021 00:00:00 GMT'
+HTTP_DATE = '''to_char({}, 'Dy, DD Mon YYYY "00:00:00 GMT"')'''
+
+MOVIE_DOC = f'''json_build_object(
+    'id', m.id,
+    'title', m.title,
+    'release_date', {HTTP_DATE.format('m.release_date')},
+    'director', json_build_object(
+        'id', d.id,
+        'name', d.name,
+        'age', d.age,
+        'gender', d.gender
+    ),
+    'actors', coalesce((
+        SELECT json_agg(json_build_object(
+            'id', a.id,
+            'name', a.name,
+            'age', a.age,
+            'gender', a.gender,
+            'pay', ma.actor_pay
+        ) ORDER BY ma.id)
+        FROM movie_actor ma JOIN actor a ON a.id = ma.actor_id
+        WHERE ma.movie_id = m.id
+    ), '[]'::json)
+)'''
+
+ACTOR_DOC = f'''json_build_object(
+    'id', a.id,
+    'name', a.name,
+    'age', a.age,
+    'gender', a.gender,
+    'movies', coalesce((
+        SELECT json_agg(json_build_object(
+            'id', m.id,
+            'title', m.title,
+            'release_date', {HTTP_DATE.format('m.release_date')}
+        ) ORDER BY ma.id)
+        FROM movie_actor ma JOIN movie m ON m.id = ma.movie_id
+        WHERE ma.actor_id = a.id
+    ), '[]'::json)
+)'''
+
+DIRECTOR_DOC = f'''json_build_object(
+    'id', d.id,
+    'name', d.name,
+    'age', d.age,
+    'gender', d.gender,
+    'movies', coalesce((
+        SELECT json_agg(json_build_object(
+            'id', m.id,
+            'title', m.title,
+            'release_date', {HTTP_DATE.format('m.release_date')}
+        ) ORDER BY m.id)
+        FROM movie m
+        WHERE m.director_id = d.id
+    ), '[]'::json)
+)'''
+
+MOVIE_ACTOR_DOC = '''json_build_object(
+    'id', ma.id,
+    'actor_id', ma.actor_id,
+    'movie_id', ma.movie_id,
+    'actor_pay', ma.actor_pay
+)'''
+
+# view name -> (document expression, from clause, id column)
+VIEWS = {
+    'movies': (MOVIE_DOC, 'movie m JOIN director d ON d.id = m.director_id', 'm.id'),
+    'actors': (ACTOR_DOC, 'actor a', 'a.id'),
+    'directors': (DIRECTOR_DOC, 'director d', 'd.id'),
+    'movie_actors': (MOVIE_ACTOR_DOC, 'movie_actor ma', 'ma.id')
+}
+
+
+def view_alias(view):
+    return VIEWS[view][2].split('.')[0]
+
+
+def list_sql(view, paginated=False, where='', sort=None, runs=()):
+    doc, from_clause, id_column = VIEWS[view]
+    if sort is not None:
+        return sorted_list_sql(view, paginated, where, sort, runs)
+    if not paginated:
+        return f'''
+            SELECT coalesce(json_agg(docs.doc ORDER BY docs.id), '[]'::json)::text
+            FROM (
+                SELECT {id_column} AS id, {doc} AS doc
+                FROM {from_clause}
+                {f'WHERE {where}' if where else ''}
+            ) docs
+        '''
+
+    # keyset page: one extra row tells if there is a next page
+    return f'''
+        SELECT coalesce(json_agg(docs.doc ORDER BY docs.id)
+                        FILTER (WHERE docs.n <= :limit), '[]'::json)::text,
+               max(docs.id) FILTER (WHERE docs.n <= :limit),
+               count(*) > :limit
+        FROM (
+            SELECT {id_column} AS id, {doc} AS doc,
+                   row_number() OVER (ORDER BY {id_column}) AS n
+            FROM {from_clause}
+            WHERE {id_column} > :after {f'AND {where}' if where else ''}
+            ORDER BY {id_column}
+            LIMIT :limit + 1
+        ) docs
+    '''
+
+
+def order_sql(view, sort):
+    alias = view_alias(view)
+    direction = 'DESC' if sort.descending else 'ASC'
+    return f'{alias}.{sort.column} {direction}, {alias}.id {direction}'
+
+
+# ids of the next page of a sorted list, one index-ordered query per keyset
+# run (see pagination.keyset_runs)
+def keyset_sql(view, where, sort, runs):
+    table, alias = VIEWS[view][1].split()[:2]
+    column, id_column = f'{alias}.{sort.column}', f'{alias}.id'
+    direction, op = ('DESC', '<') if sort.descending else ('ASC', '>')
+    branches = []
+    for nulls, start in runs:
+        if nulls:
+            conditions = [f'{column} IS NULL']
+            if start is not None:
+                conditions.append(f'{id_column} {op} :after_id')
+            order = f'{id_column} {direction}'
+        else:
+            conditions = [f'({column}, {id_column}) {op} (:after_value, :after_id)'
+                          if start is not None else f'{column} IS NOT NULL']
+            order = order_sql(view, sort)
+        if where:
+            conditions.append(where)
+        branches.append(f'''(SELECT {id_column} FROM {table} {alias}
+                             WHERE {' AND '.join(conditions)}
+                             ORDER BY {order} LIMIT :limit + 1)''')
+    return ' UNION ALL '.join(branches)
+
+
+def sorted_list_sql(view, paginated, where, sort, runs):
+    doc, from_clause, id_column = VIEWS[view]
+    order = order_sql(view, sort)
+    if not paginated:
+        return f'''
+            SELECT coalesce(json_agg(docs.doc ORDER BY docs.n), '[]'::json)::text
+            FROM (
+                SELECT {doc} AS doc, row_number() OVER (ORDER BY {order}) AS n
+                FROM {from_clause}
+                {f'WHERE {where}' if where else ''}
+            ) docs
+        '''
+
+    # the page is the first limit rows of the runs' candidates, the value
+    # and id of its last row make the next cursor
+    return f'''
+        SELECT coalesce(json_agg(docs.doc ORDER BY docs.n)
+                        FILTER (WHERE docs.n <= :limit), '[]'::json)::text,
+               min(docs.value) FILTER (WHERE docs.n = :limit),
+               max(docs.id) FILTER (WHERE docs.n = :limit),
+               count(*) > :limit
+        FROM (
+            SELECT {id_column} AS id, {view_alias(view)}.{sort.column} AS value, {doc} AS doc,
+                   row_number() OVER (ORDER BY {order}) AS n
+            FROM {from_clause}
+            WHERE {id_column} IN ({keyset_sql(view, where, sort, runs)})
+            ORDER BY {order}
+            LIMIT :limit + 1
+        ) docs
+    '''
+
+
+# one document by id, for the by-id endpoints of the asgi app (see asgi.py)
+def entity_sql(view):
+    doc, from_clause, id_column = VIEWS[view]
+    return f'SELECT {doc}::text FROM {from_clause} WHERE {id_column} = :id'
+
+
+# json array text of the documents in the view, plus the next page cursor
+# page is None for the full list or (limit, after) as from pagination.page_args,
+# filters and sort as from filtering.list_args
+def list_json(session, view, page=None, filters=(), sort=None):
+    where, params = filter_sql(filters, view_alias(view))
+    if page is None:
+        return session.execute(text(list_sql(view, where=where, sort=sort)), params).scalar(), None
+
+    limit, after = page
+    if sort is None:
+        docs, last_id, has_more = session.execute(
+            text(list_sql(view, paginated=True, where=where)),
+            {**params, 'limit': limit, 'after': after}).one()
+        return docs, str(last_id) if has_more else None
+
+    runs = keyset_runs(sort, after)
+    if after is not None:
+        params.update(after_value=after[0], after_id=after[1])
+    docs, last_value, last_id, has_more = session.execute(
+        text(list_sql(view, True, where, sort, runs)), {**params, 'limit': limit}).one()
+    return docs, sort_cursor(last_value, last_id) if has_more else None
+
+
+def stream_sql(view, where='', sort=None):
+    doc, from_clause, id_column = VIEWS[view]
+    order = id_column if sort is None else order_sql(view, sort)
+    return (f'SELECT {doc}::text FROM {from_clause} '
+            f'{f"WHERE {where} " if where else ""}ORDER BY {order}')
+
+
+# one json text per document, read through a server-side cursor in batches
+def stream_json(session, view, batch_size, filters=(), sort=None):
+    where, params = filter_sql(filters, view_alias(view))
+    result = session.execute(text(stream_sql(view, where, sort)), params,
+                             execution_options={'stream_results': True})
+    for partition in result.partitions(batch_size):
+        for row in partition:
+            yield row[0]
+
+
+# wrap a json array text in the usual {'success': True, key: [...]} envelope
+def envelope(key, docs, paginated=False, next_cursor=None):
+    if not paginated:
+        return f'{{"{key}":{docs},"success":true}}\n'
+
+    # sort cursors are json arrays, quoted like any other string
+    return f'{{"{key}":{docs},"next_cursor":{json.dumps(next_cursor)},"success":true}}\n'
@@ -0,0 +1,238 @@
+import json
+import time
+import threading
+from urllib.request import urlopen
+from jose import jwk
+
+
+# RAISED WHEN NO KEY SET WAS EVER LOADED AND THE IDP CAN'T BE REACHED
+class JWKSUnavailable(Exception):
+    pass
+
+
+# PROCESS-WIDE JWKS KEY STORE
+# keeps the identity provider's signing keys in memory so the request path
+# does not pay an https round trip on every authenticated call.
+# once a key set has been loaded, requests keep using it (even past its ttl)
+# while a background refresher fetches the next one
+class JWKSStore:
+    def __init__(self, url, ttl=600, min_refresh_interval=30,
+                 fetch_timeout=5, failure_threshold=3, breaker_cooldown=60):
+        self.url = url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.fetch_timeout = fetch_timeout
+        self.failure_threshold = failure_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self._source = None
+        self._keys = {}
+        self._fetched_at = None
+        self._last_refresh_attempt = None
+        self._lock = threading.Lock()
+
+        # circuit breaker state
+        self._consecutive_failures = 0
+        self._breaker_open_until = 0
+
+        # background refresher
+        self._refresher = None
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._refresh_in_flight = False
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.breaker_trips = 0
+
+    # FETCH THE JWKS DOCUMENT FROM THE IDENTITY PROVIDER
+    def fetch(self):
+        if self._source is not None:
+            return self._source()
+        jsonurl = urlopen(self.url, timeout=self.fetch_timeout)
+        return json.loads(jsonurl.read())
+
+    # SERVE KEYS FROM A CALLABLE INSTEAD OF THE URL (SEE local_issuer.py)
+    def use_source(self, source):
+        with self._lock:
+            self._source = source
+            self.load(source())
+
+    # REPLACE THE KEY SET WITH A FRESHLY FETCHED DOCUMENT
+    # each jwk is turned into a ready-made verifier once here, so the request
+    # path is a dict lookup plus the signature check
+    def load(self, jwks):
+        keys = {}
+        for key in jwks.get('keys', []):
+            if 'kid' not in key or key.get('use', 'sig') != 'sig':
+                continue
+            try:
+                keys[key['kid']] = jwk.construct(key, key.get('alg', 'RS256'))
+            except Exception:
+                # skip keys we can't use rather than dropping the whole set
+                continue
+
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    # FETCH AND LOAD, GUARDED BY THE CIRCUIT BREAKER
+    # on failure the last good key set is kept and the error is re-raised
+    def refresh(self, needed=None):
+        with self._lock:
+            # another thread may have refreshed while we waited on the lock
+            if needed is not None and not needed():
+                return
+            if self.breaker_open():
+                raise JWKSUnavailable('jwks circuit breaker is open')
+
+            self._last_refresh_attempt = time.monotonic()
+            try:
+                jwks = self.fetch()
+                self.load(jwks)
+            except Exception:
+                self._record_failure()
+                raise
+
+            self._consecutive_failures = 0
+            self.refreshes += 1
+
+    def _record_failure(self):
+        self.failures += 1
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= self.failure_threshold:
+            self._breaker_open_until = time.monotonic() + self.breaker_cooldown
+            self._consecutive_failures = 0
+            self.breaker_trips += 1
+
+    def breaker_open(self):
+        return time.monotonic() < self._breaker_open_until
+
+    def is_expired(self):
+        return (self._fetched_at is None
+                or time.monotonic() - self._fetched_at >= self.ttl)
+
+    def can_refresh(self):
+        # rate limit refreshes triggered by unknown kids, so a stream of
+        # forged tokens can't hammer the identity provider
+        return (self._last_refresh_attempt is None
+                or time.monotonic() - self._last_refresh_attempt
+                >= self.min_refresh_interval)
+
+    # STALE-WHILE-REVALIDATE
+    # hand the refresh to the background refresher (or a one-off thread when
+    # none is running) and keep serving the current keys meanwhile
+    def revalidate(self):
+        if self._refresher is not None and self._refresher.is_alive():
+            self._wakeup.set()
+            return
+
+        with self._lock:
+            if self._refresh_in_flight:
+                return
+            self._refresh_in_flight = True
+
+        def run():
+            try:
+                self.refresh(needed=self.is_expired)
+            except Exception:
+                pass
+            finally:
+                self._refresh_in_flight = False
+
+        threading.Thread(target=run, name='jwks-revalidate', daemon=True).start()
+
+    def loaded(self):
+        return self._fetched_at is not None
+
+    # GET KEY BY KID
+    def get_key(self, kid):
+        if not self.loaded():
+            # cold start: nothing to serve yet, fetch on the request path.
+            # rate limited like an unknown kid, so requests arriving while
+            # the idp is down don't each wait on a fetch of their own
+            if self.can_refresh():
+                try:
+                    self.refresh(needed=lambda: not self.loaded() and self.can_refresh())
+                except Exception as e:
+                    raise JWKSUnavailable(str(e)) from e
+            if not self.loaded():
+                raise JWKSUnavailable('jwks not loaded yet, refresh rate limited')
+        elif self.is_expired():
+            self.revalidate()
+
+        key = self._keys.get(kid)
+        if key is not None:
+            self.hits += 1
+            return key
+
+        # unknown kid: the idp may have rotated its keys, fetch once (bounded
+        # by fetch_timeout and the rate limit) before giving up
+        self.misses += 1
+        if self.can_refresh():
+            try:
+                self.refresh(needed=lambda: (kid not in self._keys
+                                             and self.can_refresh()))
+            except Exception:
+                return None
+            return self._keys.get(kid)
+
+        return None
+
+    # BACKGROUND REFRESHER
+    # refreshes the key set ahead of its ttl so requests never wait on the
+    # idp, backing off while the circuit breaker is open
+    def start_refresher(self):
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._stopping.clear()
+            self._refresher = threading.Thread(target=self._run_refresher,
+                                               name='jwks-refresher',
+                                               daemon=True)
+            self._refresher.start()
+
+    def stop_refresher(self, timeout=None):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout)
+        self._refresher = None
+
+    def _next_refresh_delay(self):
+        if self.breaker_open():
+            return self._breaker_open_until - time.monotonic()
+        if self._fetched_at is None:
+            return 0
+        # refresh a little before the ttl runs out
+        return max(0, self._fetched_at + self.ttl * 0.9 - time.monotonic())
+
+    def _run_refresher(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self._next_refresh_delay())
+            self._wakeup.clear()
+            if self._stopping.is_set():
+                break
+            if self.breaker_open():
+                continue
+            try:
+                self.refresh(needed=lambda: self._next_refresh_delay() <= 0)
+            except Exception:
+                # keep the last good key set, retry after a short pause
+                self._stopping.wait(min(self.fetch_timeout, self.ttl))
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'breaker_trips': self.breaker_trips,
+            'breaker_open': self.breaker_open(),
+            'refresher_running': (self._refresher is not None
+                                  and self._refresher.is_alive()),
+            'loaded': self.loaded(),
+            'keys': len(self._keys)
+        }
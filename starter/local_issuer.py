@@ -0,0 +1,163 @@
+'''
+Local offline token issuer
+
+Generates an RSA key pair, publishes the matching JWKS and mints RS256 tokens
+with the same issuer, audience and permission strings as the Auth0 tenant, so
+the whole request path (including real signature checks) can be tested and
+benchmarked without the network.
+
+# commands:
+1. python local_issuer.py (serve jwks.json on port 8081 and print one token per role)
+2. export JWKS_URL=http://127.0.0.1:8081/.well-known/jwks.json (point the api at it)
+3. or set AUTH_LOCAL_ISSUER=true to inject the keys from LOCAL_ISSUER_KEY_FILE
+   straight into auth.py instead of serving them
+
+Never enable this against a production deployment.
+'''
+import os
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+
+from auth import AUTH0_DOMAIN, API_AUDIENCE, jwks_store
+
+LOCAL_ISSUER_KID = 'local-issuer'
+LOCAL_ISSUER_KEY_FILE = os.getenv('LOCAL_ISSUER_KEY_FILE', None)
+AUTH_LOCAL_ISSUER = os.getenv('AUTH_LOCAL_ISSUER', 'false').lower() == 'true'
+
+# same permission sets as the auth0 roles (see README: RBAC)
+ROLE_PERMISSIONS = {
+    'client': [
+        'get:movies', 'get:actors', 'get:directors', 'get:movieactors'
+    ],
+    'assistant': [
+        'get:movies', 'get:actors', 'get:directors', 'get:movieactors',
+        'post:movies', 'post:actors', 'post:directors',
+        'put:movies', 'put:actors', 'put:directors'
+    ],
+    'producer': [
+        'get:movies', 'get:actors', 'get:directors', 'get:movieactors',
+        'post:movies', 'post:actors', 'post:directors', 'post:movieactors',
+        'put:movies', 'put:actors', 'put:directors', 'put:movieactors',
+        'delete:movies', 'delete:actors', 'delete:directors',
+        'delete:movieactors', 'get:stats', 'post:stats'
+    ]
+}
+
+
+class LocalIssuer:
+    def __init__(self, key_file=None, kid=LOCAL_ISSUER_KID):
+        self.kid = kid
+        self.private_key = self._load_or_generate(key_file)
+        self.private_pem = self.private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption())
+
+        public_pem = self.private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo)
+        self.public_jwk = jwk.construct(public_pem, 'RS256').to_dict()
+        self.public_jwk.update({'kid': kid, 'use': 'sig'})
+
+    @staticmethod
+    def _load_or_generate(key_file):
+        if key_file and os.path.exists(key_file):
+            with open(key_file, 'rb') as f:
+                return serialization.load_pem_private_key(f.read(), None)
+
+        private_key = rsa.generate_private_key(public_exponent=65537,
+                                               key_size=2048)
+        if key_file:
+            # share the key between the issuer cli and the api workers
+            with open(key_file, 'wb') as f:
+                f.write(private_key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption()))
+        return private_key
+
+    def jwks(self):
+        return {'keys': [self.public_jwk]}
+
+    # MINT A TOKEN FOR A ROLE (OR AN EXPLICIT PERMISSION LIST)
+    def mint(self, role='client', permissions=None, ttl=3600, **claims):
+        now = int(time.time())
+        payload = {
+            'iss': f'https://{AUTH0_DOMAIN}/',
+            'sub': f'local|{role}',
+            'aud': API_AUDIENCE,
+            'iat': now,
+            'exp': now + ttl,
+            'permissions': (ROLE_PERMISSIONS[role] if permissions is None
+                            else permissions)
+        }
+        payload.update(claims)
+        return jwt.encode(payload, self.private_pem, algorithm='RS256',
+                          headers={'kid': self.kid})
+
+    def bearer(self, role='client', **kwargs):
+        return f'Bearer {self.mint(role, **kwargs)}'
+
+    # INJECT THE KEYS INTO auth.py
+    def install(self, store=jwks_store):
+        store.use_source(self.jwks)
+
+    # SERVE /.well-known/jwks.json OVER HTTP
+    def serve(self, host='127.0.0.1', port=8081):
+        document = json.dumps(self.jwks()).encode('utf-8')
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/.well-known/jwks.json':
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(document)))
+                self.end_headers()
+                self.wfile.write(document)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever,
+                         name='local-issuer', daemon=True).start()
+        return server
+
+
+# called from create_app when AUTH_LOCAL_ISSUER=true
+def install_local_issuer():
+    issuer = LocalIssuer(key_file=LOCAL_ISSUER_KEY_FILE)
+    issuer.install()
+    return issuer
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local offline token issuer')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--key-file', default=LOCAL_ISSUER_KEY_FILE)
+    parser.add_argument('--ttl', type=int, default=3600)
+    args = parser.parse_args()
+
+    issuer = LocalIssuer(key_file=args.key_file)
+    server = issuer.serve(args.host, args.port)
+
+    print(f"export JWKS_URL=http://{args.host}:{server.server_port}"
+          "/.well-known/jwks.json")
+    for role, env_name in (('client', 'CLIENT_TOKEN'),
+                           ('assistant', 'ASSISTANT_TOKEN'),
+                           ('producer', 'PRODUCER_TOKEN')):
+        print(f"export {env_name}='{issuer.bearer(role, ttl=args.ttl)}'")
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,95 @@
+# bounded lru cache with a deadline per entry, the storage behind the token
+# cache (auth.py), the response cache (http_cache.py) and the entity cache
+# (entity_cache.py). they add what they key and invalidate on
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    # clock gives the time deadlines are kept in, on_remove(key, value) is
+    # called for every entry that leaves the cache
+    def __init__(self, maxsize=1024, ttl=300, clock=time.monotonic, on_remove=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.on_remove = on_remove
+
+        self._entries = OrderedDict()
+        # reentrant, the wrappers hold it around checks of their own
+        self.lock = threading.RLock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires_at = entry
+            if self.clock() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    # expires_at (clock time) cuts the entry's ttl short
+    def put(self, key, value, expires_at=None):
+        if self.maxsize <= 0:
+            return
+
+        deadline = self.clock() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self.lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, deadline)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        if self.on_remove is not None:
+            self.on_remove(key, value)
+
+    # (key, value) pairs, take the lock while using them
+    def items(self):
+        return [(key, value) for key, (value, _) in self._entries.items()]
+
+    # DROP THE GIVEN KEYS, COUNTED AS INVALIDATIONS
+    def invalidate(self, keys):
+        with self.lock:
+            stale = [key for key in keys if key in self._entries]
+            for key in stale:
+                self._remove(key)
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self.lock:
+            self.invalidate(list(self._entries))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -73,6 +73,9 @@ def run_migrations_online():
     connectable = current_app.extensions['migrate'].db.engine
 
     with connectable.connect() as connection:
+        # schema changes (e.g. concurrent index builds) may outlast the
+        # app's statement timeout
+        connection.execute('SET statement_timeout = 0')
         context.configure(
             connection=connection,
             target_metadata=target_metadata,
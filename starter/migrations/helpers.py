@@ -0,0 +1,27 @@
+# shared by the revisions that build indexes on live tables
+# (revision files can't import each other, this module they can)
+from alembic import op
+import sqlalchemy as sa
+
+INVALID_INDEX_SQL = ('SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                     'WHERE c.relname = :name AND NOT i.indisvalid')
+
+
+# BUILD INDEXES WITHOUT BLOCKING WRITES
+# indexes are (name, definition) pairs, the definition is what follows ON:
+# 'movie (director_id)'. CONCURRENTLY can't run inside a transaction, and a
+# failed concurrent build leaves an invalid index behind that IF NOT EXISTS
+# would keep, so it is dropped first
+def create_indexes_concurrently(indexes):
+    with op.get_context().autocommit_block():
+        for name, definition in indexes:
+            invalid = op.get_bind().execute(sa.text(INVALID_INDEX_SQL), {'name': name}).first()
+            if invalid:
+                op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
+            op.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}')
+
+
+def drop_indexes_concurrently(names):
+    with op.get_context().autocommit_block():
+        for name in names:
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
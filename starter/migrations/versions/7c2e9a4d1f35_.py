@@ -0,0 +1,35 @@
+"""unique (movie_id, actor_id) on movie_actor
+
+Revision ID: 7c2e9a4d1f35
+Revises: 3b8d1f6e2a47
+Create Date: 2026-10-18 11:02:17.540192
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9a4d1f35'
+down_revision = '3b8d1f6e2a47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # an actor can only be cast once per movie: keep the oldest row of each
+    # duplicate pair before adding the constraint
+    op.execute('''
+        DELETE FROM movie_actor ma
+        USING movie_actor keep
+        WHERE keep.movie_id = ma.movie_id
+          AND keep.actor_id = ma.actor_id
+          AND keep.id < ma.id
+    ''')
+    op.create_unique_constraint('uq_movie_actor_movie_id_actor_id',
+                                'movie_actor', ['movie_id', 'actor_id'])
+
+
+def downgrade():
+    op.drop_constraint('uq_movie_actor_movie_id_actor_id', 'movie_actor',
+                       type_='unique')
@@ -0,0 +1,36 @@
+"""on delete cascade for the movie_actor foreign keys
+
+Revision ID: 9e41c7b2d8a3
+Revises: 7c2e9a4d1f35
+Create Date: 2026-10-18 11:47:03.918226
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e41c7b2d8a3'
+down_revision = '7c2e9a4d1f35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # deleting a movie or an actor removes its cast rows in the database,
+    # so deletes don't have to load them first
+    op.drop_constraint('movie_actor_movie_id_fkey', 'movie_actor', type_='foreignkey')
+    op.drop_constraint('movie_actor_actor_id_fkey', 'movie_actor', type_='foreignkey')
+    op.create_foreign_key('movie_actor_movie_id_fkey', 'movie_actor', 'movie',
+                          ['movie_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('movie_actor_actor_id_fkey', 'movie_actor', 'actor',
+                          ['actor_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('movie_actor_actor_id_fkey', 'movie_actor', type_='foreignkey')
+    op.drop_constraint('movie_actor_movie_id_fkey', 'movie_actor', type_='foreignkey')
+    op.create_foreign_key('movie_actor_actor_id_fkey', 'movie_actor', 'actor',
+                          ['actor_id'], ['id'])
+    op.create_foreign_key('movie_actor_movie_id_fkey', 'movie_actor', 'movie',
+                          ['movie_id'], ['id'])
@@ -0,0 +1,51 @@
+"""payroll rollup materialized view over movie_actor.actor_pay
+
+Revision ID: a7d3f1c9e5b2
+Revises: f4c9e2a7b1d3
+Create Date: 2026-10-18 19:41:52.207316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d3f1c9e5b2'
+down_revision = 'f4c9e2a7b1d3'
+branch_labels = None
+depends_on = None
+
+
+# per movie / actor / director and over all roles (see payroll.py), the
+# unique (kind, id) index allows REFRESH MATERIALIZED VIEW CONCURRENTLY
+def upgrade():
+    op.execute('''
+        CREATE MATERIALIZED VIEW IF NOT EXISTS payroll_rollup AS
+        WITH groups AS (
+            SELECT CASE WHEN GROUPING(ma.movie_id) = 0 THEN 'movie'
+                        WHEN GROUPING(ma.actor_id) = 0 THEN 'actor'
+                        WHEN GROUPING(m.director_id) = 0 THEN 'director'
+                        ELSE 'all' END AS kind,
+                   COALESCE(ma.movie_id, ma.actor_id, m.director_id, 0) AS id,
+                   count(*) AS roles,
+                   sum(ma.actor_pay) AS total,
+                   avg(ma.actor_pay)::float8 AS average,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY ma.actor_pay) AS p50,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY ma.actor_pay) AS p90,
+                   min(ma.actor_pay) AS min_pay,
+                   max(ma.actor_pay) AS max_pay
+            FROM movie_actor ma JOIN movie m ON m.id = ma.movie_id
+            WHERE ma.actor_pay IS NOT NULL
+            GROUP BY GROUPING SETS ((ma.movie_id), (ma.actor_id), (m.director_id), ())
+        )
+        SELECT groups.*,
+               rank() OVER (PARTITION BY kind ORDER BY total DESC, id) AS rank,
+               now() AS refreshed_at
+        FROM groups
+    ''')
+    op.create_index('ux_payroll_rollup_kind_id', 'payroll_rollup', ['kind', 'id'], unique=True)
+    op.create_index('ix_payroll_rollup_kind_rank', 'payroll_rollup', ['kind', 'rank'])
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW IF EXISTS payroll_rollup')
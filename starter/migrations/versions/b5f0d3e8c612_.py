@@ -0,0 +1,30 @@
+"""indexes on the relationship foreign keys
+
+Revision ID: b5f0d3e8c612
+Revises: 9e41c7b2d8a3
+Create Date: 2026-10-18 12:20:55.301847
+
+"""
+from migrations.helpers import create_indexes_concurrently, drop_indexes_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5f0d3e8c612'
+down_revision = '9e41c7b2d8a3'
+branch_labels = None
+depends_on = None
+
+# movie_actor.movie_id needs no index of its own: it is the leading column
+# of uq_movie_actor_movie_id_actor_id (revision 7c2e9a4d1f35)
+INDEXES = (
+    ('ix_movie_director_id', 'movie', 'director_id'),
+    ('ix_movie_actor_actor_id', 'movie_actor', 'actor_id'),
+)
+
+
+def upgrade():
+    create_indexes_concurrently((name, f'{table} ({column})') for name, table, column in INDEXES)
+
+
+def downgrade():
+    drop_indexes_concurrently(name for name, _, _ in INDEXES)
@@ -0,0 +1,33 @@
+"""full-text search indexes on movie titles and actor / director names
+
+Revision ID: d2a6c8f4e1b7
+Revises: b5f0d3e8c612
+Create Date: 2026-10-18 15:02:41.118204
+
+"""
+from migrations.helpers import create_indexes_concurrently, drop_indexes_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a6c8f4e1b7'
+down_revision = 'b5f0d3e8c612'
+branch_labels = None
+depends_on = None
+
+# the 'simple' configuration lowercases words without stemming or stop
+# words, names and titles are matched as typed (see search.py)
+INDEXES = (
+    ('ix_movie_title_fts', 'movie', 'title'),
+    ('ix_actor_name_fts', 'actor', 'name'),
+    ('ix_director_name_fts', 'director', 'name'),
+)
+
+
+def upgrade():
+    create_indexes_concurrently(
+        (name, f"{table} USING gin (to_tsvector('simple', {column}))")
+        for name, table, column in INDEXES)
+
+
+def downgrade():
+    drop_indexes_concurrently(name for name, _, _ in INDEXES)
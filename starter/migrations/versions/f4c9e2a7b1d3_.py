@@ -0,0 +1,34 @@
+"""indexes behind the list endpoint filters and sort keys
+
+Revision ID: f4c9e2a7b1d3
+Revises: d2a6c8f4e1b7
+Create Date: 2026-10-18 17:26:09.530417
+
+"""
+from migrations.helpers import create_indexes_concurrently, drop_indexes_concurrently
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c9e2a7b1d3'
+down_revision = 'd2a6c8f4e1b7'
+branch_labels = None
+depends_on = None
+
+# (column, id) serves the range filters and the sorted keyset pages on
+# (column, id) in index order, both ways (see filtering.py). gender has
+# few values, its index serves the pages of one, read in id order
+INDEXES = (
+    ('ix_movie_release_date_id', 'movie', 'release_date'),
+    ('ix_actor_age_id', 'actor', 'age'),
+    ('ix_director_age_id', 'director', 'age'),
+    ('ix_actor_gender_id', 'actor', 'gender'),
+    ('ix_director_gender_id', 'director', 'gender'),
+)
+
+
+def upgrade():
+    create_indexes_concurrently((name, f'{table} ({column}, id)') for name, table, column in INDEXES)
+
+
+def downgrade():
+    drop_indexes_concurrently(name for name, _, _ in INDEXES)
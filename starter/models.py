@@ -1,60 +1,89 @@
 # wrap models creation in functio and pass to app
-from sqlalchemy.orm import backref
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import backref, joinedload, selectinload
+from sqlalchemy.orm.attributes import get_history
+from serializers import serializer
+from versions import bump_versions
+from payroll import PAYROLL_VIEW_SQL, DROP_PAYROLL_VIEW_SQL
 
 
 def CreateEntity(db):
     # basic model
     class Movie(db.Model):
         __tablename__ = 'movie'
+        # full-text search over titles (see search.py), release date
+        # filters and sort (see filtering.py)
+        __table_args__ = (
+            db.Index('ix_movie_title_fts', db.text("to_tsvector('simple', title)"),
+                     postgresql_using='gin'),
+            db.Index('ix_movie_release_date_id', 'release_date', 'id'),
+        )
 
         id = db.Column(db.Integer, primary_key=True)
         title = db.Column(db.String)
         release_date = db.Column(db.Date)
-        director_id = db.Column(db.Integer, db.ForeignKey('director.id'), nullable=False)
+        director_id = db.Column(db.Integer, db.ForeignKey('director.id'), nullable=False, index=True)
         actors = db.relationship('Actor', secondary="movie_actor", viewonly=True)
+
+        # columns and relationships a client can pick with ?fields= / ?expand=
+        FIELDS = ('id', 'title', 'release_date', 'director_id')
+        RELATIONS = ('director', 'actors')
         
         def __repr__(self):
             return f'<Movie_{self.id}: {self.title}>'
+
+        # load director, cast rows and cast actors in a fixed number of
+        # queries (no n+1 when json_format walks the relationships)
+        @classmethod
+        def eager_query(cls, relations=RELATIONS):
+            query = cls.query
+            options = []
+            if 'director' in relations:
+                options.append(joinedload(cls.director))
+            if 'actors' in relations:
+                options.append(selectinload(cls.movie_actor).joinedload(MovieActor.ma_actor))
+            return query.options(*options)
         
-        def json_format(self):
-            return {
-                'id': self.id,
-                'title': self.title,
-                'release_date': self.release_date,
-                'director': {
-                    'id': self.director.id,
-                    'name': self.director.name,
-                    'age': self.director.age,
-                    'gender': self.director.gender
-                },
-                'actors': [{
-                    'id': ma.ma_actor.id,
-                    'name':ma.ma_actor.name,
-                    'age': ma.ma_actor.age,
-                    'gender': ma.ma_actor.gender,
-                    'pay': ma.actor_pay
-                } for ma in self.movie_actor],
-            }
+        # compiled once per view, see serializers.py
+        def json_format(self, fields=None, expand=None):
+            return serializer(type(self), fields, expand)(self)
 
         def __init__(self, title, release_date, director_id):
             self.title = title,
             self.release_date = release_date,
             self.director_id = director_id
         
+        # rows whose cached views a write to this movie changes (see
+        # entity_cache.py): the movie and its old and new director
+        def changed_rows(self):
+            return [('movie', self.id), ('director', self.director_id)] + [
+                ('director', d) for d in get_history(self, 'director_id').deleted]
+
         def insert(self):
             db.session.add(self)
+            db.session.flush()
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def update(self):
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def delete(self):
+            rows = self.changed_rows()
             db.session.delete(self)
+            bump_versions(db.session, self.__tablename__, 'movie_actor', rows=rows)
             db.session.commit()
 
 
     class Actor(db.Model):
         __tablename__ = 'actor'
+        __table_args__ = (
+            db.Index('ix_actor_name_fts', db.text("to_tsvector('simple', name)"),
+                     postgresql_using='gin'),
+            db.Index('ix_actor_age_id', 'age', 'id'),
+            db.Index('ix_actor_gender_id', 'gender', 'id'),
+        )
 
         id = db.Column(db.Integer, primary_key=True)
         name = db.Column(db.String)
@@ -62,41 +91,57 @@ def CreateEntity(db):
         gender = db.Column(db.String)
         movies = db.relationship('Movie', secondary='movie_actor', viewonly=True)
 
+        FIELDS = ('id', 'name', 'age', 'gender')
+        RELATIONS = ('movies',)
+
         def __repr__(self):
             return f'<Actor_{self.id}: {self.name}>'
+
+        @classmethod
+        def eager_query(cls, relations=RELATIONS):
+            query = cls.query
+            options = []
+            if 'movies' in relations:
+                options.append(selectinload(cls.movie_actor).joinedload(MovieActor.ma_movie))
+            return query.options(*options)
         
-        def json_format(self):
-            return {
-                'id': self.id,
-                'name': self.name,
-                'age': self.age,
-                'gender': self.gender,
-                'movies': [{
-                    'id': ma.ma_movie.id,
-                    'title': ma.ma_movie.title,
-                    'release_date': ma.ma_movie.release_date
-                } for ma in self.movie_actor]
-            }
+        # compiled once per view, see serializers.py
+        def json_format(self, fields=None, expand=None):
+            return serializer(type(self), fields, expand)(self)
 
         def __init__(self, name, age, gender):
             self.name = name,
             self.age = age
             self.gender = gender
 
+        def changed_rows(self):
+            return [('actor', self.id)]
+
         def insert(self):
             db.session.add(self)
+            db.session.flush()
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def update(self):
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def delete(self):
+            rows = self.changed_rows()
             db.session.delete(self)
+            bump_versions(db.session, self.__tablename__, 'movie_actor', rows=rows)
             db.session.commit()
 
 
     class Director(db.Model):
         __tablename__ = 'director'
+        __table_args__ = (
+            db.Index('ix_director_name_fts', db.text("to_tsvector('simple', name)"),
+                     postgresql_using='gin'),
+            db.Index('ix_director_age_id', 'age', 'id'),
+            db.Index('ix_director_gender_id', 'gender', 'id'),
+        )
 
         id = db.Column(db.Integer,primary_key=True)
         name = db.Column(db.String)
@@ -104,36 +149,46 @@ def CreateEntity(db):
         gender = db.Column(db.String)
         movies = db.relationship('Movie', backref='director')
 
+        FIELDS = ('id', 'name', 'age', 'gender')
+        RELATIONS = ('movies',)
+
         def __repr__(self):
             return f'<Director_{self.id}: {self.name}>'
+
+        @classmethod
+        def eager_query(cls, relations=RELATIONS):
+            query = cls.query
+            options = []
+            if 'movies' in relations:
+                options.append(selectinload(cls.movies))
+            return query.options(*options)
         
-        def json_format(self):
-            return {
-                'id': self.id,
-                'name': self.name,
-                'age': self.age,
-                'gender': self.gender,
-                'movies': [{
-                    'id': m.id,
-                    'title': m.title,
-                    'release_date': m.release_date
-                } for m in self.movies]
-            }
-        
+        # compiled once per view, see serializers.py
+        def json_format(self, fields=None, expand=None):
+            return serializer(type(self), fields, expand)(self)
+
         def __init__(self, name, age, gender):
             self.name = name,
             self.age = age,
             self.gender = gender
         
+        def changed_rows(self):
+            return [('director', self.id)]
+
         def insert(self):
             db.session.add(self)
+            db.session.flush()
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def update(self):
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def delete(self):
+            rows = self.changed_rows()
             db.session.delete(self)
+            bump_versions(db.session, self.__tablename__, rows=rows)
             db.session.commit()
     
 
@@ -143,14 +198,23 @@ def CreateEntity(db):
     # the foreign keys of two tables but a third attribute "actor_pay"
     class MovieActor(db.Model):
         __tablename__ = 'movie_actor'
+        __table_args__ = (
+            db.UniqueConstraint('movie_id', 'actor_id',
+                                name='uq_movie_actor_movie_id_actor_id'),
+        )
 
         id = db.Column(db.Integer, primary_key=True)
-        actor_id = db.Column(db.Integer, db.ForeignKey('actor.id'), nullable=False)
-        movie_id = db.Column(db.Integer, db.ForeignKey('movie.id'), nullable=False)
+        actor_id = db.Column(db.Integer, db.ForeignKey('actor.id', ondelete='CASCADE'), nullable=False, index=True)
+        # indexed through the leading column of the (movie_id, actor_id) constraint
+        movie_id = db.Column(db.Integer, db.ForeignKey('movie.id', ondelete='CASCADE'), nullable=False)
         actor_pay = db.Column(db.Integer)
-        # back ref
-        ma_actor = db.relationship('Actor', backref=backref('movie_actor', cascade='all, delete-orphan'))
-        ma_movie = db.relationship('Movie', backref=backref('movie_actor', cascade='all, delete-orphan'))
+        # back ref (the database deletes the cast rows with their movie or
+        # actor, passive_deletes keeps the orm from loading them first)
+        ma_actor = db.relationship('Actor', backref=backref('movie_actor', cascade='all, delete-orphan', passive_deletes=True))
+        ma_movie = db.relationship('Movie', backref=backref('movie_actor', cascade='all, delete-orphan', passive_deletes=True))
+
+        FIELDS = ('id', 'actor_id', 'movie_id', 'actor_pay')
+        RELATIONS = ()
 
         def __repr__(self):
             return (f'<MovieActor_{self.id}\n>'
@@ -159,31 +223,58 @@ def CreateEntity(db):
             "Actor Pay: {self.actor_pay}"
             )
         
-        def json_format(self):
-            return{
-                'id': self.id,
-                'actor_id': self.actor_id,
-                'movie_id': self.movie_id,
-                'actor_pay': self.actor_pay
-            }
-        
+        @classmethod
+        def eager_query(cls, relations=RELATIONS):
+            return cls.query
+
+        # compiled once per view, see serializers.py
+        def json_format(self, fields=None, expand=None):
+            return serializer(type(self), fields, expand)(self)
+
         def __init__(self, actor_id, movie_id, actor_pay):
             self.actor_id = actor_id
             self.movie_id = movie_id
             self.actor_pay = actor_pay
         
+        # the cast row and the movies and actors it links (before and after)
+        def changed_rows(self):
+            rows = [('movie_actor', self.id), ('movie', self.movie_id),
+                    ('actor', self.actor_id)]
+            rows += [('movie', m) for m in get_history(self, 'movie_id').deleted]
+            rows += [('actor', a) for a in get_history(self, 'actor_id').deleted]
+            return rows
+
         def insert(self):
             db.session.add(self)
+            db.session.flush()
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def update(self):
+            bump_versions(db.session, self.__tablename__, rows=self.changed_rows())
             db.session.commit()
         
         def delete(self):
+            rows = self.changed_rows()
             db.session.delete(self)
+            bump_versions(db.session, self.__tablename__, rows=rows)
             db.session.commit()
 
 
+    # change counter per table, bumped by the write methods above in the same
+    # transaction as the write (see versions.py, http_cache.py)
+    class EntityVersion(db.Model):
+        __tablename__ = 'entity_version'
+
+        table_name = db.Column(db.String, primary_key=True)
+        version = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+    # payroll rollup materialized view over movie_actor (see payroll.py),
+    # created and dropped with the tables so create_all matches the migrations
+    event.listen(db.Model.metadata, 'after_create', DDL(PAYROLL_VIEW_SQL))
+    event.listen(db.Model.metadata, 'before_drop', DDL(DROP_PAYROLL_VIEW_SQL))
+
     return Movie, Actor, Director, MovieActor, db
 
 '''
@@ -0,0 +1,114 @@
+# keyset (cursor) pagination on id for the list endpoints
+# ?limit=20&after=<next_cursor of the previous page>
+# the cost of a page does not grow with its depth, unlike OFFSET
+# sorted lists (see filtering.py) page on (sort column, id), their cursor is
+# the json array [value, id] of the last row
+import json
+import datetime
+from sqlalchemy import tuple_
+from werkzeug.exceptions import BadRequest
+
+from bulk import column_value
+
+
+# READ limit / after FROM THE QUERY STRING
+# returns None when the client didn't ask for a page (full list),
+# otherwise (limit, after) with limit capped at max_page_size. after is an
+# id, or with a sort the (value, id) of a sort cursor (None on page one)
+def page_args(args, default_page_size, max_page_size, model=None, sort=None):
+    if 'limit' not in args and 'after' not in args:
+        return None
+
+    try:
+        limit = int(args.get('limit', default_page_size))
+        if sort is None:
+            after = int(args.get('after', 0))
+        else:
+            after = parse_sort_cursor(model, sort, args['after']) if 'after' in args else None
+    except ValueError:
+        raise BadRequest
+
+    if limit < 1 or (sort is None and after < 0):
+        raise BadRequest
+
+    return min(limit, max_page_size), after
+
+
+def sort_cursor(value, last_id):
+    if isinstance(value, datetime.date):
+        value = value.isoformat()
+    return json.dumps([value, last_id])
+
+
+def parse_sort_cursor(model, sort, cursor):
+    try:
+        value, last_id = json.loads(cursor)
+    except (TypeError, ValueError):
+        raise BadRequest
+    if type(last_id) is not int:
+        raise BadRequest
+    return column_value(model, sort.column, value), last_id
+
+
+# KEYSET RUNS OF A SORTED LIST
+# rows without a value come after the others in ascending order and before
+# them in descending order (postgres' default), so the remaining rows are up
+# to two runs, each read in index order: (nulls, after), after the cursor to
+# continue from inside the run or None to read it from its start
+def keyset_runs(sort, after):
+    runs = [True, False] if sort.descending else [False, True]
+    if after is None:
+        return [(nulls, None) for nulls in runs]
+    at = runs.index(after[0] is None)
+    return [(runs[at], after)] + [(nulls, None) for nulls in runs[at + 1:]]
+
+
+def sort_order(model, sort):
+    if sort is None:
+        return (model.id,)
+    column = getattr(model, sort.column)
+    if sort.descending:
+        return column.desc(), model.id.desc()
+    return column, model.id
+
+
+# FETCH ONE PAGE, ONE EXTRA ROW TELLS IF THERE IS A NEXT PAGE
+def paginate(query, id_column, limit, after):
+    rows = (query
+            .filter(id_column > after)
+            .order_by(id_column)
+            .limit(limit + 1)
+            .all())
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, str(rows[-1].id)
+    return rows, None
+
+
+# ONE PAGE OF A SORTED LIST, ONE QUERY PER KEYSET RUN IT REACHES
+def paginate_sorted(query, model, sort, limit, after):
+    column = getattr(model, sort.column)
+    before = sort.descending
+    rows = []
+    for nulls, start in keyset_runs(sort, after):
+        if len(rows) > limit:
+            break
+        if nulls:
+            run = query.filter(column.is_(None))
+            if start is not None:
+                run = run.filter(model.id < start[1] if before else model.id > start[1])
+            order = (model.id.desc() if before else model.id,)
+        else:
+            if start is None:
+                run = query.filter(column.isnot(None))
+            else:
+                key = tuple_(column, model.id)
+                run = query.filter(key < tuple_(*start) if before else key > tuple_(*start))
+            order = sort_order(model, sort)
+        rows += run.order_by(*order).limit(limit + 1 - len(rows)).all()
+
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, sort_cursor(getattr(rows[-1], sort.column), rows[-1].id)
+    return rows, None
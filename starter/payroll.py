@@ -0,0 +1,175 @@
+# payroll analytics over movie_actor.actor_pay (GET /stats/payroll)
+# totals, averages and percentiles per movie, per actor and per director,
+# plus one row over all roles, are rolled up with GROUP BY GROUPING SETS
+# into the payroll_rollup materialized view and ranked by total with a
+# window function. reads are index lookups on the view. it is refreshed
+# on demand (POST /stats/payroll/refresh) and every PAYROLL_REFRESH_SECONDS
+# by one of the workers, REFRESH ... CONCURRENTLY keeps it readable meanwhile
+import os
+import time
+import threading
+from sqlalchemy import text
+from werkzeug.exceptions import BadRequest
+
+# seconds between scheduled refreshes, 0 turns them off
+PAYROLL_REFRESH_SECONDS = int(os.getenv('PAYROLL_REFRESH_SECONDS', 3600))
+
+# pg_advisory_xact_lock key, one refresh at a time across workers
+PAYROLL_LOCK = 7343001
+
+# roles without a pay are left out. the 'all' row has id 0: concurrent
+# refreshes match rows on the unique (kind, id) index, which needs no nulls
+PAYROLL_VIEW_SQL = '''
+    CREATE MATERIALIZED VIEW IF NOT EXISTS payroll_rollup AS
+    WITH groups AS (
+        SELECT CASE WHEN GROUPING(ma.movie_id) = 0 THEN 'movie'
+                    WHEN GROUPING(ma.actor_id) = 0 THEN 'actor'
+                    WHEN GROUPING(m.director_id) = 0 THEN 'director'
+                    ELSE 'all' END AS kind,
+               COALESCE(ma.movie_id, ma.actor_id, m.director_id, 0) AS id,
+               count(*) AS roles,
+               sum(ma.actor_pay) AS total,
+               avg(ma.actor_pay)::float8 AS average,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY ma.actor_pay) AS p50,
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY ma.actor_pay) AS p90,
+               min(ma.actor_pay) AS min_pay,
+               max(ma.actor_pay) AS max_pay
+        FROM movie_actor ma JOIN movie m ON m.id = ma.movie_id
+        WHERE ma.actor_pay IS NOT NULL
+        GROUP BY GROUPING SETS ((ma.movie_id), (ma.actor_id), (m.director_id), ())
+    )
+    SELECT groups.*,
+           rank() OVER (PARTITION BY kind ORDER BY total DESC, id) AS rank,
+           now() AS refreshed_at
+    FROM groups;
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_payroll_rollup_kind_id ON payroll_rollup (kind, id);
+    CREATE INDEX IF NOT EXISTS ix_payroll_rollup_kind_rank ON payroll_rollup (kind, rank);
+'''
+
+DROP_PAYROLL_VIEW_SQL = 'DROP MATERIALIZED VIEW IF EXISTS payroll_rollup'
+
+# ?by= -> (table, name column) of the grouped entity
+PAYROLL_GROUPS = {
+    'movie': ('movie', 'title'),
+    'actor': ('actor', 'name'),
+    'director': ('director', 'name')
+}
+
+STATS_COLUMNS = 'roles, total, average, p50, p90, min_pay, max_pay'
+
+OVERALL_SQL = f'''
+    SELECT {STATS_COLUMNS}, refreshed_at,
+           extract(epoch FROM now() - refreshed_at)::float8 AS age_seconds
+    FROM payroll_rollup WHERE kind = 'all'
+'''
+
+# a page of groups by rank, entities deleted since the refresh are skipped
+GROUPS_SQL = '''
+    SELECT r.rank, r.id, t.{column} AS name, {columns}
+    FROM payroll_rollup r JOIN {table} t ON t.id = r.id
+    WHERE r.kind = :kind AND r.rank > :after
+    ORDER BY r.rank
+    LIMIT :limit + 1
+'''
+
+
+def payroll_args(args):
+    by = args.get('by', 'movie')
+    if by not in PAYROLL_GROUPS:
+        raise BadRequest
+    return by
+
+
+# ROLLUP OVER ALL ROLES PLUS ONE PAGE OF GROUPS, LARGEST TOTAL FIRST
+# returns (overall, groups, next_cursor), the cursor is the last rank
+def payroll_report(session, by, limit, after):
+    overall = dict(session.execute(text(OVERALL_SQL)).mappings().one())
+    table, column = PAYROLL_GROUPS[by]
+    rows = session.execute(
+        text(GROUPS_SQL.format(table=table, column=column, columns=STATS_COLUMNS)),
+        {'kind': by, 'after': after, 'limit': limit}).mappings().all()
+
+    groups = [dict(row) for row in rows[:limit]]
+    next_cursor = str(groups[-1]['rank']) if len(rows) > limit else None
+    return overall, groups, next_cursor
+
+
+# REFRESH THE ROLLUP, WAITING FOR A REFRESH ALREADY RUNNING ELSEWHERE
+# returns the seconds it took
+def refresh_payroll(connection):
+    started = time.perf_counter()
+    # the rollup reads every role, it may outlast DB_STATEMENT_TIMEOUT
+    connection.execute(text('SET LOCAL statement_timeout = 0'))
+    connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': PAYROLL_LOCK})
+    connection.execute(text('REFRESH MATERIALIZED VIEW CONCURRENTLY payroll_rollup'))
+    return time.perf_counter() - started
+
+
+class PayrollRefresher:
+    def __init__(self, engine, interval=PAYROLL_REFRESH_SECONDS):
+        self.engine = engine
+        self.interval = interval
+
+        self._thread = None
+        self._stopping = threading.Event()
+
+        # counters
+        self.refreshes = 0
+        self.failures = 0
+        self.last_seconds = None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='payroll-refresh',
+                                        daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    # every worker wakes up on the interval, the first to take the lock
+    # refreshes a stale rollup and the others find it fresh or skip
+    def refresh_if_stale(self):
+        with self.engine.begin() as connection:
+            locked = connection.execute(text('SELECT pg_try_advisory_xact_lock(:key)'),
+                                        {'key': PAYROLL_LOCK}).scalar()
+            if not locked:
+                return False
+            age = connection.execute(text(OVERALL_SQL)).mappings().one()['age_seconds']
+            if age < self.interval:
+                return False
+            self.last_seconds = refresh_payroll(connection)
+            self.refreshes += 1
+            return True
+
+    def _run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                self.failures += 1
+
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'last_seconds': self.last_seconds
+        }
+
+
+_refresher = None
+
+
+# one refresher per worker process, called from create_app
+def start_payroll_refresher(engine):
+    global _refresher
+    if _refresher is None:
+        _refresher = PayrollRefresher(engine)
+    _refresher.start()
+    return _refresher
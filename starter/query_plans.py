@@ -0,0 +1,135 @@
+# EXPLAIN check for the relationship queries every read runs, and the
+# sorted pages and range filters of the list endpoints
+# seeds a large catalog inside the caller's transaction (roll it back
+# afterwards), refreshes the planner statistics and reports which index, if
+# any, each hot query is planned with.
+# used by endpoint_test.py and benchmarks/explain_indexes.py
+from sqlalchemy import text
+
+# the relationship loads behind json_format (selectinload / joinedload, see
+# eager_query on the models) and the json_agg read path (see json_views.py),
+# with the index each one should use
+HOT_QUERIES = {
+    'director.movies': (
+        'SELECT id, title, release_date, director_id FROM movie '
+        'WHERE director_id = ANY(:director_ids)',
+        'ix_movie_director_id'),
+    'movie.actors': (
+        'SELECT id, actor_id, movie_id, actor_pay FROM movie_actor '
+        'WHERE movie_id = ANY(:movie_ids)',
+        'uq_movie_actor_movie_id_actor_id'),
+    'actor.movies': (
+        'SELECT id, actor_id, movie_id, actor_pay FROM movie_actor '
+        'WHERE actor_id = ANY(:actor_ids)',
+        'ix_movie_actor_actor_id'),
+    'json_agg movie cast': (
+        'SELECT m.id, (SELECT count(*) FROM movie_actor ma WHERE ma.movie_id = m.id) '
+        'FROM movie m WHERE m.id = ANY(:movie_ids)',
+        'uq_movie_actor_movie_id_actor_id'),
+    'json_agg actor movies': (
+        'SELECT a.id, (SELECT count(*) FROM movie_actor ma WHERE ma.actor_id = a.id) '
+        'FROM actor a WHERE a.id = ANY(:actor_ids)',
+        'ix_movie_actor_actor_id'),
+    'json_agg director movies': (
+        'SELECT d.id, (SELECT count(*) FROM movie m WHERE m.director_id = d.id) '
+        'FROM director d WHERE d.id = ANY(:director_ids)',
+        'ix_movie_director_id'),
+    # a sorted keyset page and a range filter of the list endpoints
+    # (see filtering.py)
+    'movies by release date': (
+        "SELECT id FROM movie WHERE (release_date, id) < (DATE '2005-01-01', 0) "
+        'ORDER BY release_date DESC, id DESC LIMIT 21',
+        'ix_movie_release_date_id'),
+    'actors by age range': (
+        'SELECT id FROM actor WHERE age >= 30 AND age <= 31',
+        'ix_actor_age_id'),
+    'actors by gender page': (
+        "SELECT id FROM actor WHERE gender = 'female' AND id > 0 ORDER BY id LIMIT 21",
+        'ix_actor_gender_id')
+}
+
+SEED_SQL = {
+    'director': '''
+        WITH rows AS (
+            INSERT INTO director (name, age, gender)
+            SELECT 'plan_director_' || g, 30 + g % 40, 'female'
+            FROM generate_series(1, :count) g
+            RETURNING id)
+        SELECT min(id) FROM rows''',
+    'actor': '''
+        WITH rows AS (
+            INSERT INTO actor (name, age, gender)
+            SELECT 'plan_actor_' || g, 20 + g % 50, 'male'
+            FROM generate_series(1, :count) g
+            RETURNING id)
+        SELECT min(id) FROM rows''',
+    'movie': '''
+        WITH rows AS (
+            INSERT INTO movie (title, release_date, director_id)
+            SELECT 'plan_movie_' || g, DATE '2000-01-01' + g % 7000,
+                   :first_director + g % :directors
+            FROM generate_series(0, :count - 1) g
+            RETURNING id)
+        SELECT min(id) FROM rows''',
+    'movie_actor': '''
+        INSERT INTO movie_actor (movie_id, actor_id, actor_pay)
+        SELECT :first_movie + g / :cast_size,
+               :first_actor + (g::bigint * 7919) % :actors, 1000
+        FROM generate_series(0, :movies * :cast_size - 1) g
+        ON CONFLICT DO NOTHING'''
+}
+
+
+# SEED A CATALOG, RETURNS A FEW IDS OF EACH KIND TO QUERY WITH
+def seed_catalog(session, movies=20000, actors=5000, directors=2000,
+                 cast_size=4):
+    # the large seeds outlast DB_STATEMENT_TIMEOUT
+    session.execute(text('SET LOCAL statement_timeout = 0'))
+    first_director = session.execute(text(SEED_SQL['director']),
+                                     {'count': directors}).scalar()
+    first_actor = session.execute(text(SEED_SQL['actor']),
+                                  {'count': actors}).scalar()
+    first_movie = session.execute(text(SEED_SQL['movie']),
+                                  {'count': movies, 'directors': directors,
+                                   'first_director': first_director}).scalar()
+    session.execute(text(SEED_SQL['movie_actor']),
+                    {'first_movie': first_movie, 'first_actor': first_actor,
+                     'movies': movies, 'actors': actors,
+                     'cast_size': cast_size})
+    session.execute(text('ANALYZE director, actor, movie, movie_actor'))
+
+    # a page worth of parents, like one selectinload batch
+    return {
+        'director_ids': list(range(first_director, first_director + 20)),
+        'actor_ids': list(range(first_actor, first_actor + 20)),
+        'movie_ids': list(range(first_movie, first_movie + 20))
+    }
+
+
+def plan_indexes(plan):
+    indexes = set()
+    if 'Index Name' in plan:
+        indexes.add(plan['Index Name'])
+    for child in plan.get('Plans', ()):
+        indexes |= plan_indexes(child)
+    return indexes
+
+
+def plan_seq_scans(plan):
+    scans = set()
+    if plan['Node Type'] == 'Seq Scan':
+        scans.add(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        scans |= plan_seq_scans(child)
+    return scans
+
+
+# EXPLAIN EVERY HOT QUERY
+# returns {name: (expected index, indexes used, seq scanned tables, plan)}
+def explain_hot_queries(session, ids):
+    report = {}
+    for name, (sql, index) in HOT_QUERIES.items():
+        plan = session.execute(text(f'EXPLAIN (FORMAT JSON) {sql}'),
+                               ids).scalar()[0]['Plan']
+        report[name] = (index, plan_indexes(plan), plan_seq_scans(plan), plan)
+    return report
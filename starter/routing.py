@@ -0,0 +1,197 @@
+# read replica routing
+# replicas are flask-sqlalchemy binds named replica_<n> (see config.py).
+# GET / HEAD handlers read from a replica picked round-robin, everything else
+# (and every flush) goes to the primary. a replica that fails its health
+# check, lags too far behind or drops a connection is ejected for a while.
+# after a write, the writer's reads stay on the primary for a few seconds so
+# they see their own changes. each response names its route in X-DB-Route
+# replica reads never fill the response or entity caches: a write evicts them
+# at commit, before the replicas have replayed it, and a lagging read cached
+# right after would outlive the eviction until its ttl
+import os
+import time
+import threading
+from flask import g, request, has_request_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import event, orm, text
+
+# REPLICA ROUTING SETUP (seconds)
+REPLICA_CHECK_INTERVAL = int(os.getenv('REPLICA_CHECK_INTERVAL', 5))
+REPLICA_EJECT_SECONDS = int(os.getenv('REPLICA_EJECT_SECONDS', 30))
+REPLICA_MAX_LAG = int(os.getenv('REPLICA_MAX_LAG', 10))
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 15))
+
+READ_METHODS = ('GET', 'HEAD')
+
+# replay lag in seconds, 0 when caught up with everything received (an idle
+# primary sends nothing, so the last replay time alone would keep growing)
+# and on a server that is not a standby
+LAG_SQL = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+          OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END'''
+
+
+def replica_binds(config):
+    return sorted(bind for bind in (config.get('SQLALCHEMY_BINDS') or {})
+                  if bind.startswith('replica_'))
+
+
+class ReplicaRouter:
+    def __init__(self, binds=(), check_interval=5, eject_seconds=30,
+                 max_lag=10, sticky_seconds=15):
+        self.binds = list(binds)
+        self.check_interval = check_interval
+        self.eject_seconds = eject_seconds
+        self.max_lag = max_lag
+        self.sticky_seconds = sticky_seconds
+
+        self._next = 0
+        self._checked_at = {}
+        self._ejected_until = {}
+        self._sticky_until = {}
+        self._watched = set()
+        self._lock = threading.Lock()
+
+        # counters
+        self.routes = {}
+        self.ejections = 0
+
+    # NEXT HEALTHY REPLICA, ROUND-ROBIN
+    # probe(bind) -> replay lag in seconds, called at most every
+    # check_interval per replica. returns None when every replica is out
+    def pick(self, probe):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % max(len(self.binds), 1)
+        now = time.monotonic()
+        for bind in self.binds[start:] + self.binds[:start]:
+            if self._ejected_until.get(bind, 0) > now:
+                continue
+            if now - self._checked_at.get(bind, float('-inf')) >= self.check_interval:
+                self._checked_at[bind] = now
+                try:
+                    healthy = probe(bind) <= self.max_lag
+                except Exception:
+                    healthy = False
+                if not healthy:
+                    self.eject(bind)
+                    continue
+            return bind
+        return None
+
+    def eject(self, bind):
+        with self._lock:
+            self._ejected_until[bind] = time.monotonic() + self.eject_seconds
+            self.ejections += 1
+
+    # eject a replica as soon as one of its connections is lost mid-request
+    def watch(self, bind, engine):
+        if bind in self._watched:
+            return
+        self._watched.add(bind)
+
+        @event.listens_for(engine, 'handle_error')
+        def on_error(context):
+            if context.is_disconnect:
+                self.eject(bind)
+
+    def mark_write(self, subject):
+        if not subject:
+            return
+        now = time.monotonic()
+        with self._lock:
+            if len(self._sticky_until) > 1024:
+                self._sticky_until = {s: until for s, until in self._sticky_until.items()
+                                      if until > now}
+            self._sticky_until[subject] = now + self.sticky_seconds
+
+    def is_sticky(self, subject):
+        return bool(subject) and self._sticky_until.get(subject, 0) > time.monotonic()
+
+    def record(self, route, reason):
+        with self._lock:
+            key = f'{route}:{reason}'
+            self.routes[key] = self.routes.get(key, 0) + 1
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            'replicas': self.binds,
+            'ejected': sorted(bind for bind, until in self._ejected_until.items()
+                              if until > now),
+            'ejections': self.ejections,
+            'routes': dict(self.routes)
+        }
+
+
+def replica_lag(app, bind):
+    engine = get_state(app).db.get_engine(app, bind=bind)
+    with engine.connect() as connection:
+        return float(connection.execute(text(LAG_SQL)).scalar())
+
+
+# ROUTE OF THE CURRENT REQUEST, DECIDED ON ITS FIRST QUERY
+# returns (bind, reason), bind None for the primary
+def request_route(app):
+    if 'db_route' in g:
+        return g.db_route, g.db_route_reason
+
+    router = app.extensions.get('replica_router')
+    bind, reason = None, 'read'
+    if router is None or not router.binds:
+        reason = 'no-replicas'
+    elif request.method not in READ_METHODS:
+        reason = 'write'
+    elif request.headers.get('X-DB-Route', '').lower() == 'primary':
+        reason = 'requested'
+    elif router.is_sticky(g.get('subject')):
+        reason = 'read-your-writes'
+    else:
+        bind = router.pick(lambda b: replica_lag(app, b))
+        if bind is None:
+            reason = 'replicas-down'
+    if router is not None:
+        router.record(bind or 'primary', reason)
+
+    g.db_route, g.db_route_reason = bind, reason
+    return bind, reason
+
+
+# did the current request read from a replica?
+def read_from_replica():
+    return has_request_context() and g.get('db_route') is not None
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        if has_request_context() and not self._flushing:
+            bind, _ = request_route(self.app)
+            if bind is not None:
+                engine = get_state(self.app).db.get_engine(self.app, bind=bind)
+                self.app.extensions['replica_router'].watch(bind, engine)
+                return engine
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def init_routing(app):
+    app.extensions['replica_router'] = ReplicaRouter(
+        replica_binds(app.config), REPLICA_CHECK_INTERVAL,
+        REPLICA_EJECT_SECONDS, REPLICA_MAX_LAG, READ_YOUR_WRITES_SECONDS)
+
+    @app.after_request
+    def route_header(response):
+        if 'db_route' in g:
+            response.headers['X-DB-Route'] = (f'{g.db_route or "primary"}; '
+                                              f'reason={g.db_route_reason}')
+        # a successful write keeps the writer's reads on the primary
+        if request.method not in READ_METHODS and response.status_code < 400:
+            app.extensions['replica_router'].mark_write(g.get('subject'))
+        return response
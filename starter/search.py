@@ -0,0 +1,155 @@
+# GET /search?q=: ranked full-text search over movie titles and actor /
+# director names, backed by the gin indexes of revision d2a6c8f4e1b7
+# the words of q are matched as typed ahead: all but the last as whole
+# words of the name, the last as the start of one ('star wa' finds 'Star
+# Wars', 'sta wa' does not). hits are ranked with ts_rank, shorter names
+# first, and paged with a keyset cursor on (rank, type, id)
+# every kind ranks all its matches and keeps the best of them after the
+# cursor. a prefix matching more than SEARCH_MAX_MATCHES rows of a kind
+# takes longer to rank than the latency budget allows (see
+# benchmarks/search_latency.py): that kind ranks only its SEARCH_MAX_MATCHES
+# matches with the lowest ids, the same rows on every page, and the
+# response says so with truncated: true. a longer query narrows the matches
+# and makes the ranking complete again
+import os
+import re
+from sqlalchemy import text
+from werkzeug.exceptions import BadRequest
+
+from auth import AuthError
+
+# type -> (table, searched column, permission needed to see its hits)
+SEARCH_TYPES = {
+    'movie': ('movie', 'title', 'get:movies'),
+    'actor': ('actor', 'name', 'get:actors'),
+    'director': ('director', 'name', 'get:directors')
+}
+
+# matching rows of a kind ranked in full, see above
+SEARCH_MAX_MATCHES = int(os.getenv('SEARCH_MAX_MATCHES', 500))
+
+# shorter words match too large a share of the catalog to rank quickly
+MIN_WORD_LENGTH = 2
+MAX_WORDS = 8
+
+WORD = re.compile(r'\w+')
+
+# same expression as the indexes, or the planner won't use them. the
+# tsquery is spelled out rather than read from q, so the planner sees how
+# many rows match: a broad prefix walks the primary key until it has
+# enough matches, a narrow one sorts what the gin index returns. one match
+# past the cap tells a truncated kind from one with exactly that many
+MATCHES_SQL = '''
+    {type}_matches AS (
+        SELECT id, {column} AS name
+        FROM {table}
+        WHERE to_tsvector('simple', {column}) @@ to_tsquery('simple', :query)
+        ORDER BY id
+        LIMIT :max_matches + 1)'''
+
+RANK = "ts_rank(to_tsvector('simple', m.name), q.query, 1)"
+
+# each kind takes its limit + 1 best hits after the cursor
+BRANCH_SQL = '''
+    (SELECT '{type}' AS type, m.id, m.name, {rank} AS rank
+     FROM (SELECT * FROM {type}_matches ORDER BY id LIMIT :max_matches) m, q
+     {after}
+     ORDER BY rank DESC, m.id
+     LIMIT :limit + 1)'''
+
+
+# hits of kind after the cursor (rank, type, id): lower ranked, or equally
+# ranked and ordered after it by (type, id). the cursor rank is compared as
+# real, the type ts_rank returns, so it round-trips exactly through its text
+def after_sql(kind, after_type, rank):
+    if kind < after_type:
+        return f'WHERE {rank} < CAST(:rank AS real)'
+    if kind == after_type:
+        return (f'WHERE {rank} < CAST(:rank AS real) '
+                f'OR ({rank} = CAST(:rank AS real) AND m.id > :id)')
+    return f'WHERE {rank} <= CAST(:rank AS real)'
+
+
+def search_sql(types, after_type=None):
+    matches = ','.join(MATCHES_SQL.format(type=kind, table=SEARCH_TYPES[kind][0],
+                                          column=SEARCH_TYPES[kind][1]) for kind in types)
+    branches = ' UNION ALL '.join(
+        BRANCH_SQL.format(type=kind, rank=RANK,
+                          after=after_sql(kind, after_type, RANK) if after_type else '')
+        for kind in types)
+    truncated = ' OR '.join(f'(SELECT count(*) FROM {kind}_matches) > :max_matches'
+                            for kind in types)
+    return f'''
+        WITH q AS (SELECT to_tsquery('simple', :query) AS query), {matches}
+        SELECT type, id, name, rank, {truncated} AS truncated
+        FROM ({branches}) hits
+        ORDER BY rank DESC, type, id
+        LIMIT :limit + 1
+    '''
+
+
+# READ q / type / limit / after FROM THE QUERY STRING
+# returns (tsquery text, types, limit, after), after None on the first page
+def search_args(args, permissions, default_page_size, max_page_size):
+    words = WORD.findall(args.get('q', '').lower())
+    if not words or len(words) > MAX_WORDS or min(map(len, words)) < MIN_WORD_LENGTH:
+        raise BadRequest
+    # \w words carry no tsquery operators. a prefix of each word would
+    # intersect two large posting lists for 'a b', only the last is one
+    query = ' & '.join(words[:-1] + [f'{words[-1]}:*'])
+
+    requested = args.get('type')
+    types = [t.strip() for t in (requested or ','.join(SEARCH_TYPES)).split(',')]
+    if requested == '' or any(t not in SEARCH_TYPES for t in types):
+        raise BadRequest
+    # kinds named in type need their get: permission, without type the
+    # caller searches the kinds they may read
+    allowed = [t for t in SEARCH_TYPES if t in types
+               and SEARCH_TYPES[t][2] in permissions]
+    if not allowed or (requested is not None and len(allowed) < len(set(types))):
+        raise AuthError({
+            'code': 'permission_error',
+            'description': 'Request permission is not authorized'
+        }, 403)
+    types = allowed
+
+    try:
+        limit = int(args.get('limit', default_page_size))
+    except ValueError:
+        raise BadRequest
+    if limit < 1:
+        raise BadRequest
+
+    after = args.get('after')
+    if after is not None:
+        try:
+            rank, kind, row_id = after.split(',')
+            after = (float(rank), kind, int(row_id))
+        except ValueError:
+            raise BadRequest
+        if kind not in SEARCH_TYPES:
+            raise BadRequest
+
+    return query, types, min(limit, max_page_size), after
+
+
+# ONE PAGE OF HITS, THE CURSOR OF THE NEXT PAGE AND WHETHER A KIND HAD
+# MORE MATCHES THAN IT RANKED (SEE SEARCH_MAX_MATCHES)
+def search(session, query, types, limit, after=None):
+    if not types:
+        return [], None, False
+
+    params = {'query': query, 'limit': limit, 'max_matches': SEARCH_MAX_MATCHES}
+    if after is not None:
+        params.update(zip(('rank', 'type', 'id'), after))
+    # a parallel walk spends longer starting its workers than reading the
+    # few thousand rows the capped matches need
+    session.execute(text('SET LOCAL max_parallel_workers_per_gather = 0'))
+    rows = session.execute(text(search_sql(types, after and after[1])), params).mappings().all()
+
+    truncated = bool(rows) and rows[0]['truncated']
+    hits = [{key: row[key] for key in ('type', 'id', 'name', 'rank')} for row in rows[:limit]]
+    if len(rows) > limit:
+        last = hits[-1]
+        return hits, f'{last["rank"]!r},{last["type"]},{last["id"]}', truncated
+    return hits, None, truncated
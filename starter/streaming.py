@@ -0,0 +1,31 @@
+# chunked json responses for full-table dumps of the list endpoints
+# rows are pulled from a server-side cursor in batches and the json array is
+# written as they arrive, so worker memory stays flat whatever the table size
+# and the first bytes go out before the last row is read.
+# the status line is sent before the rows are read, so an error half way
+# through can only cut the body short
+
+
+# YIELD {"<view>":[ ... ],"success":true} ONE BATCH AT A TIME
+def stream_list(view, docs, batch_size):
+    yield f'{{"{view}":['
+
+    separator = ''
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            yield separator + ','.join(batch)
+            separator = ','
+            batch = []
+
+    if batch:
+        yield separator + ','.join(batch)
+
+    yield '],"success":true}\n'
+
+
+# ORM ROWS AS JSON TEXT, yield_per KEEPS A SERVER-SIDE CURSOR
+def orm_docs(query, order, batch_size, serialize):
+    for row in query.order_by(*order).yield_per(batch_size):
+        yield serialize(row)
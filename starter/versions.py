@@ -0,0 +1,69 @@
+# per-table change versions, bumped in the same transaction as every write
+# GET endpoints derive their ETag from the versions of the tables they read
+# (see http_cache.py), so a poll that finds nothing changed costs one
+# primary-key lookup instead of the serialization query
+# listeners registered with on_change hear which tables (and rows) a
+# transaction wrote once it commits, and what other workers wrote through
+# the postgres change feed (see change_feed.py). the response and entity
+# caches use it for invalidation
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+BUMP_SQL = '''
+    INSERT INTO entity_version (table_name, version)
+    VALUES {values}
+    ON CONFLICT (table_name) DO UPDATE SET version = entity_version.version + 1
+'''
+
+_listeners = []
+
+
+# BUMP THE VERSION OF EACH TABLE (CALL BEFORE COMMIT)
+# rows are the (table, id) pairs whose cached views the write changes
+def bump_versions(session, *tables, rows=()):
+    # fixed lock order, so concurrent writers can't deadlock on the rows
+    tables = sorted(set(tables))
+    values = ', '.join(f'(:t{i}, 1)' for i in range(len(tables)))
+    session.execute(text(BUMP_SQL.format(values=values)),
+                    {f't{i}': table for i, table in enumerate(tables)})
+    session.info.setdefault('changed_tables', set()).update(tables)
+    session.info.setdefault('changed_rows', set()).update(
+        row for row in rows if row[1] is not None)
+
+
+VERSIONS_SQL = ('SELECT table_name, version FROM entity_version '
+                'WHERE table_name = ANY(:tables)')
+
+
+# CURRENT VERSION OF EACH TABLE, 0 FOR TABLES NEVER WRITTEN
+def read_versions(session, tables):
+    rows = session.execute(text(VERSIONS_SQL), {'tables': list(tables)}).all()
+    versions = dict(rows)
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+# CALL listener(tables, rows) FOR EVERY CHANGE
+# tables (and rows) are None when everything may have changed, e.g. after
+# the change feed lost its connection
+def on_change(listener):
+    _listeners.append(listener)
+    return listener
+
+
+def changed(tables, rows=None):
+    for listener in _listeners:
+        listener(tables, rows)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    tables = session.info.pop('changed_tables', None)
+    rows = session.info.pop('changed_rows', None)
+    if tables:
+        changed(tables, rows)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(session):
+    session.info.pop('changed_tables', None)
+    session.info.pop('changed_rows', None)